@@ -0,0 +1,165 @@
+# Throughput of POST /api/v1/subscriptions/ when every payment check waits on
+# a slow TronGrid: the sync views under gunicorn's sync workers against the
+# async views (ASYNC_VIEWS=1) under gunicorn with uvicorn workers, with the
+# same number of worker processes. A stand-in TronGrid answers every lookup
+# after --latency seconds with an unknown transaction, so each request costs
+# one lookup and no subscription is written. The created users are removed
+# afterwards.
+#
+# Usage (from the app directory, against a scratch database):
+#   SQL_DATABASE=/tmp/load.sqlite3 python manage.py migrate
+#   SQL_DATABASE=/tmp/load.sqlite3 python -m benchmarks.asgi_concurrency \
+#       --requests 400 --concurrency 100 --latency 0.2
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import time
+from collections import Counter
+
+import aiohttp
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "localhost 127.0.0.1")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from subscription_service.models import Plan, TelegramUser  # noqa: E402
+
+from benchmarks.fake_tron import FakeTronServer  # noqa: E402
+
+SERVERS = {
+    "sync views, gunicorn sync workers": (
+        ["core.wsgi:application"],
+        {"ASYNC_VIEWS": "0"},
+    ),
+    "async views, gunicorn uvicorn workers": (
+        ["core.asgi:application", "-k", "uvicorn.workers.UvicornWorker"],
+        {"ASYNC_VIEWS": "1"},
+    ),
+}
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args: list, env: dict, workers: int, port: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        ["gunicorn", *args, "--workers", str(workers), "--bind", f"127.0.0.1:{port}"],
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gunicorn didn't start on port {port}")
+
+
+async def submit_payments(url: str, payments: list, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = Counter()
+
+    async def submit(session: aiohttp.ClientSession, payment: dict) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(url, json=payment) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status] += 1
+
+    timeout = aiohttp.ClientTimeout(total=None)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(submit(session, payment) for payment in payments))
+        elapsed = time.perf_counter() - started
+    return elapsed, latencies, statuses
+
+
+def create_users(count: int) -> list:
+    Plan.objects.get_or_create(period="1 month", defaults={"price": 100})
+    users = TelegramUser.objects.bulk_create(
+        [
+            TelegramUser(chat_id=10**12 + i, telegram_username=f"asgi_{i}")
+            for i in range(count)
+        ]
+    )
+    return [user.telegram_username for user in users]
+
+
+def clean_up() -> None:
+    TelegramUser.objects.filter(telegram_username__startswith="asgi_").delete()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    clean_up()
+    usernames = create_users(args.concurrency)
+    tron = FakeTronServer(latency=args.latency)
+    env = {
+        "TRON_PROVIDERS": f"{tron.endpoint}|benchmark",
+        "TRON_API_KEY_LIMIT": str(10**6),
+        "PAYMENT_SUBMISSION_LIMIT": str(10**6),
+        "PAYMENT_VERIFICATION_MODE": "sync",
+    }
+    try:
+        for run, (label, (server_args, server_env)) in enumerate(SERVERS.items()):
+            cache.clear()
+            payments = [
+                {
+                    "telegram_username": usernames[i % len(usernames)],
+                    "plan": "1 month",
+                    "transaction_hash": f"{run:08x}{i:056x}",
+                }
+                for i in range(args.requests)
+            ]
+            port = get_free_port()
+            server = start_server(
+                server_args, {**env, **server_env}, args.workers, port
+            )
+            try:
+                elapsed, latencies, statuses = asyncio.run(
+                    submit_payments(
+                        f"http://127.0.0.1:{port}/api/v1/subscriptions/",
+                        payments,
+                        args.concurrency,
+                    )
+                )
+            finally:
+                server.terminate()
+                server.wait()
+
+            latencies.sort()
+            print(
+                f"{label}: {args.requests / elapsed:.1f} req/s, "
+                f"p50 {statistics.median(latencies) * 1000:.0f} ms, "
+                f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f} ms, "
+                f"statuses {dict(statuses)}"
+            )
+    finally:
+        tron.shutdown()
+        clean_up()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Runs an aiohttp application standing in for an upstream API in a forked
+# process, so it doesn't compete with the code under test for the GIL. The
+# app records the calls it receives, they are read back over GET /_calls.
+# With tls=True it serves HTTPS with a throwaway self-signed certificate
+# (made with the openssl command), pass server.verify to requests.
+import asyncio
+import multiprocessing
+import os
+import socket
+import ssl
+import subprocess
+import tempfile
+
+import requests
+from aiohttp import web
+
+
+def create_certificate(directory: str) -> tuple:
+    certificate = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes"]
+        + ["-keyout", key, "-out", certificate, "-days", "1"]
+        + ["-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1"],
+        check=True,
+        capture_output=True,
+    )
+    return certificate, key
+
+
+def serve(app_class, sock: socket.socket, options: dict, certificate=None) -> None:
+    async def main():
+        ssl_context = None
+        if certificate:
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(*certificate)
+        runner = web.AppRunner(app_class(**options).build(), access_log=None)
+        await runner.setup()
+        await web.SockSite(runner, sock, ssl_context=ssl_context).start()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+class FakeServer:
+    app_class = None
+
+    def __init__(self, tls: bool = False, **options):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(1024)
+        self.server_port = sock.getsockname()[1]
+
+        certificate = None
+        self.verify = True
+        self.certificate_directory = None
+        if tls:
+            self.certificate_directory = tempfile.TemporaryDirectory()
+            certificate = create_certificate(self.certificate_directory.name)
+            self.verify = certificate[0]
+        scheme = "https" if tls else "http"
+        self.url = f"{scheme}://127.0.0.1:{self.server_port}"
+
+        self.process = multiprocessing.get_context("fork").Process(
+            target=serve,
+            args=(self.app_class, sock, options, certificate),
+            daemon=True,
+        )
+        self.process.start()
+        sock.close()
+
+    def get_calls(self) -> list:
+        return requests.get(f"{self.url}/_calls", timeout=10, verify=self.verify).json()
+
+    def reset(self) -> None:
+        requests.delete(f"{self.url}/_calls", timeout=10, verify=self.verify)
+
+    def shutdown(self) -> None:
+        self.process.terminate()
+        self.process.join()
+        if self.certificate_directory is not None:
+            self.certificate_directory.cleanup()
+
+    def __enter__(self) -> "FakeServer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.shutdown()
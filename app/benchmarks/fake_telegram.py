@@ -0,0 +1,137 @@
+# Local fake of the Telegram Bot API for load and integration tests. It
+# answers sendMessage and sendPhoto like the real API (file_ids included) and
+# can add latency, fail a share of requests and answer 429 with retry_after.
+# Every call is recorded and can be read back with GET /_calls.
+#
+# Point TelegramMessageSender at it with settings.TELEGRAM_API_URL = server.url.
+import asyncio
+import random
+import uuid
+from itertools import count
+
+from aiohttp import web
+
+from benchmarks.fake_server import FakeServer
+
+WRONG_FILE_ID = "Bad Request: wrong file identifier/HTTP URL specified"
+
+
+class FakeTelegramApp:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: int = 1,
+        seed=None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.message_ids = count(1)
+        # file_ids are unique across servers, like Telegram's, so ids cached
+        # against an earlier server are rejected
+        self.file_id_prefix = f"fake-file-{uuid.uuid4().hex[:8]}"
+        self.file_ids = set()
+        self.calls = []
+
+    def build(self) -> web.Application:
+        app = web.Application(client_max_size=20 * 1024**2)
+        app.router.add_get("/_calls", self.get_calls)
+        app.router.add_delete("/_calls", self.reset_calls)
+        app.router.add_post("/bot{token}/sendMessage", self.send_message)
+        app.router.add_post("/bot{token}/sendPhoto", self.send_photo)
+        return app
+
+    async def get_calls(self, request: web.Request) -> web.Response:
+        return web.json_response(self.calls)
+
+    async def reset_calls(self, request: web.Request) -> web.Response:
+        self.calls.clear()
+        return web.json_response({"ok": True})
+
+    async def read_params(self, request: web.Request) -> dict:
+        params = dict(request.query)
+        if request.content_type in (
+            "multipart/form-data",
+            "application/x-www-form-urlencoded",
+        ):
+            for name, value in (await request.post()).items():
+                params[name] = value if isinstance(value, str) else value.file.read()
+        return params
+
+    def fail(self):
+        # Injected failures, decided before the request is "processed"
+        if self.random.random() < self.throttle_rate:
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        if self.random.random() < self.error_rate:
+            return 500, {
+                "ok": False,
+                "error_code": 500,
+                "description": "Internal Server Error",
+            }
+        return None
+
+    async def respond(
+        self, method: str, params: dict, photo: str, result
+    ) -> web.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        failure = self.fail()
+        if failure is None and isinstance(result, str):
+            failure = 400, {"ok": False, "error_code": 400, "description": result}
+        status, body = failure or (200, {"ok": True, "result": result})
+
+        self.calls.append(
+            {
+                "method": method,
+                "chat_id": params.get("chat_id"),
+                "text": params.get("text", params.get("caption")),
+                "photo": photo,
+                "status": status,
+            }
+        )
+        return web.json_response(body, status=status)
+
+    def build_message(self, params: dict) -> dict:
+        return {
+            "message_id": next(self.message_ids),
+            "chat": {"id": int(params.get("chat_id", 0))},
+        }
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        params = await self.read_params(request)
+        result = {**self.build_message(params), "text": params.get("text")}
+        return await self.respond("sendMessage", params, None, result)
+
+    async def send_photo(self, request: web.Request) -> web.Response:
+        params = await self.read_params(request)
+        photo = params.get("photo")
+
+        if isinstance(photo, bytes):
+            file_id = f"{self.file_id_prefix}-{len(self.file_ids) + 1}"
+            self.file_ids.add(file_id)
+            recorded_photo = "upload"
+        elif photo in self.file_ids:
+            file_id = recorded_photo = photo
+        else:
+            return await self.respond("sendPhoto", params, photo, WRONG_FILE_ID)
+
+        result = {
+            **self.build_message(params),
+            "caption": params.get("caption"),
+            "photo": [{"file_id": f"{file_id}-thumb"}, {"file_id": file_id}],
+        }
+        return await self.respond("sendPhoto", params, recorded_photo, result)
+
+
+class FakeTelegramServer(FakeServer):
+    app_class = FakeTelegramApp
@@ -0,0 +1,98 @@
+# Local fake of a TronGrid-style transaction lookup API for load and
+# integration tests. GET /api/transaction-info?hash=<hash> answers with a
+# confirmed USDT transfer to wallet_address (or {} like the real API for
+# unknown hashes when no wallet is given), and can add latency, fail a share
+# of requests and answer 429 with Retry-After. Every call is recorded and can
+# be read back with GET /_calls.
+#
+# Point the provider pool at it with settings.TRON_PROVIDERS =
+# [{"endpoint": server.endpoint, "api_key": "..."}].
+import asyncio
+import random
+import time
+
+from aiohttp import web
+
+from benchmarks.fake_server import FakeServer
+
+
+class FakeTronApp:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: int = 1,
+        wallet_address=None,
+        amount_str: str = "100000000",
+        seed=None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.wallet_address = wallet_address
+        self.amount_str = amount_str
+        self.random = random.Random(seed)
+        self.calls = []
+
+    def build(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/_calls", self.get_calls)
+        app.router.add_delete("/_calls", self.reset_calls)
+        app.router.add_get("/api/transaction-info", self.get_transaction)
+        return app
+
+    async def get_calls(self, request: web.Request) -> web.Response:
+        return web.json_response(self.calls)
+
+    async def reset_calls(self, request: web.Request) -> web.Response:
+        self.calls.clear()
+        return web.json_response({"ok": True})
+
+    def build_transaction(self, tx_hash: str) -> dict:
+        if self.wallet_address is None:
+            return {}
+        return {
+            "hash": tx_hash,
+            "confirmed": True,
+            "timestamp": int(time.time() * 1000),
+            "trc20TransferInfo": [
+                {
+                    "to_address": self.wallet_address,
+                    "amount_str": self.amount_str,
+                    "decimals": 6,
+                    "symbol": "USDT",
+                }
+            ],
+        }
+
+    async def get_transaction(self, request: web.Request) -> web.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        headers = {}
+        if self.random.random() < self.throttle_rate:
+            status, body = 429, {"Error": "request rate exceeded"}
+            headers["Retry-After"] = str(self.retry_after)
+        elif self.random.random() < self.error_rate:
+            status, body = 500, {"Error": "Internal Server Error"}
+        else:
+            status, body = 200, self.build_transaction(request.query.get("hash"))
+
+        self.calls.append(
+            {
+                "hash": request.query.get("hash"),
+                "api_key": request.headers.get("TRON-PRO-API-KEY"),
+                "status": status,
+            }
+        )
+        return web.json_response(body, status=status, headers=headers)
+
+
+class FakeTronServer(FakeServer):
+    app_class = FakeTronApp
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.url}/api/transaction-info?hash"
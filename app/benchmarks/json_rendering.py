@@ -0,0 +1,157 @@
+# Compares building the subscription statuses of a batch of users the way
+# the API used to, model instances through GetSubscriptionSerializer and
+# DRF's JSONRenderer, with values() rows and the orjson renderer. Both
+# produce the same bytes, which is checked. The endpoint itself is timed too,
+# POST /api/v1/subscriptions/statuses/ with a cold cache through the Django
+# test client. The created rows are removed afterwards.
+#
+# Usage (from the app directory, against a scratch database):
+#   SQL_DATABASE=/tmp/load.sqlite3 python manage.py migrate
+#   SQL_DATABASE=/tmp/load.sqlite3 python -m benchmarks.json_rendering \
+#       --users 5000
+import argparse
+import os
+import statistics
+import time
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "localhost testserver")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from subscription_service.models import Plan, Subscription, TelegramUser  # noqa: E402
+from subscription_service.renderers import ORJSONRenderer  # noqa: E402
+from subscription_service.serializers import GetSubscriptionSerializer  # noqa: E402
+from subscription_service.services import (  # noqa: E402
+    build_subscription_status,
+    get_subscription_status_rows,
+)
+
+FIRST_CHAT_ID = 2 * 10**12
+
+
+def create_users(users: int) -> list:
+    plan, _ = Plan.objects.get_or_create(period="1 month", defaults={"price": 100})
+    created = TelegramUser.objects.bulk_create(
+        [
+            TelegramUser(chat_id=FIRST_CHAT_ID + i, telegram_username=f"render_{i}")
+            for i in range(users)
+        ]
+    )
+    # bulk_create skips save(), so the dates are set here
+    now = timezone.now()
+    Subscription.objects.bulk_create(
+        [
+            Subscription(
+                customer=user,
+                plan=plan,
+                transaction_hash=f"render_{user.chat_id}",
+                start_date=now,
+                end_date=now + timedelta(days=30),
+                duration=timedelta(days=30),
+            )
+            for user in created
+        ]
+    )
+    return [user.telegram_username for user in created]
+
+
+def clean_up() -> None:
+    Subscription.objects.filter(transaction_hash__startswith="render_").delete()
+    TelegramUser.objects.filter(telegram_username__startswith="render_").delete()
+
+
+def render_with_serializer(usernames: list) -> bytes:
+    users = (
+        TelegramUser.objects.select_related("subscription__plan")
+        .filter(telegram_username__in=usernames)
+        .order_by("chat_id")
+    )
+    results = [
+        {
+            "telegram_username": user.telegram_username,
+            "status": 200,
+            "data": GetSubscriptionSerializer(instance=user.subscription).data,
+        }
+        for user in users
+    ]
+    return JSONRenderer().render({"results": results})
+
+
+def render_with_values(usernames: list) -> bytes:
+    results = []
+    rows = get_subscription_status_rows(telegram_username__in=usernames)
+    for row in rows.order_by("chat_id"):
+        status_code, payload = build_subscription_status(row)
+        results.append(
+            {
+                "telegram_username": row["telegram_username"],
+                "status": status_code,
+                "data": payload,
+            }
+        )
+    return ORJSONRenderer().render({"results": results})
+
+
+def time_best(func, *args, repeat: int) -> tuple:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), statistics.median(timings), result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    clean_up()
+    usernames = create_users(args.users)
+    try:
+        rendered = {}
+        for label, func in (
+            ("instances + serializer + JSONRenderer", render_with_serializer),
+            ("values() rows + ORJSONRenderer", render_with_values),
+        ):
+            best, median, rendered[label] = time_best(
+                func, usernames, repeat=args.repeat
+            )
+            print(
+                f"{label}: best {best * 1000:.0f} ms, median {median * 1000:.0f} ms "
+                f"for {args.users} users"
+            )
+        first, second = rendered.values()
+        assert first == second, "the two paths rendered different JSON"
+
+        client = Client()
+        url = reverse("subscription-statuses")
+        timings = []
+        for _ in range(args.repeat):
+            cache.clear()
+            started = time.perf_counter()
+            response = client.post(
+                url, {"telegram_usernames": usernames}, content_type="application/json"
+            )
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 200
+        print(
+            f"POST statuses, cold cache: best {min(timings) * 1000:.0f} ms, "
+            f"median {statistics.median(timings) * 1000:.0f} ms"
+        )
+    finally:
+        clean_up()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Throughput of reminder delivery against the local fake Bot API with a
+# simulated round trip: the sequential TelegramMessageSender loop the
+# notify tasks use vs AsyncTelegramDeliveryEngine. Each subscriber gets a
+# reminder photo and a subscription details message.
+#
+# Bot API rate limits are lifted so the numbers show delivery overhead only;
+# in production the shared rate limiter caps throughput at ~30 msg/s.
+#
+# Usage (from the app directory, after `python manage.py migrate`):
+#   python -m benchmarks.reminder_delivery --subscribers 1000 10000 100000
+import argparse
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "localhost")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from subscription_service.delivery import OutboundMessage, deliver_messages  # noqa
+from subscription_service.utils import TelegramMessageSender  # noqa: E402
+
+from benchmarks.fake_telegram import FakeTelegramServer  # noqa: E402
+
+PHOTO_PATH = os.path.join(settings.MEDIA_ROOT, "7-days.jpg")
+
+
+def build_messages(subscribers: int) -> list:
+    messages = []
+    for chat_id in range(subscribers):
+        messages.append(OutboundMessage(chat_id, "reminder", photo_path=PHOTO_PATH))
+        messages.append(OutboundMessage(chat_id, "subscription details"))
+    return messages
+
+
+def run_sequential(messages: list) -> float:
+    started = time.perf_counter()
+    for message in messages:
+        if message.photo_path:
+            TelegramMessageSender.send_message_with_photo_to_chat(
+                message=message.text,
+                photo_path=message.photo_path,
+                chat_id=message.chat_id,
+            )
+        else:
+            TelegramMessageSender.send_message_to_chat(
+                message=message.text, chat_id=message.chat_id
+            )
+    return len(messages) / (time.perf_counter() - started)
+
+
+def run_engine(messages: list, concurrency: int) -> float:
+    started = time.perf_counter()
+    results = deliver_messages(messages, concurrency=concurrency)
+    elapsed = time.perf_counter() - started
+    assert all(result.ok for result in results)
+    return len(messages) / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument(
+        "--max-sequential",
+        type=int,
+        default=1000,
+        help="skip the sequential run above this many subscribers",
+    )
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(latency=args.latency)
+    settings.TELEGRAM_API_URL = server.url
+    settings.TELEGRAM_GLOBAL_RATE_LIMIT = settings.TELEGRAM_GLOBAL_BURST = 10**6
+    settings.TELEGRAM_POOL_MAXSIZE = args.concurrency
+
+    print(f"round trip {args.latency * 1000:.0f} ms, concurrency {args.concurrency}")
+    for subscribers in args.subscribers:
+        messages = build_messages(subscribers)
+        engine = run_engine(messages, args.concurrency)
+        if subscribers <= args.max_sequential:
+            sequential = f"{run_sequential(messages):8.1f} messages/s"
+        else:
+            sequential = "skipped"
+        print(
+            f"{subscribers:>7} subscribers: sequential {sequential}, "
+            f"engine {engine:8.1f} messages/s"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
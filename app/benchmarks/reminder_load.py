@@ -0,0 +1,133 @@
+# Load scenario for the reminder path: creates subscribers expiring in 7 days,
+# runs the real notify_about_expiring_subscriptions_7_days task against the
+# fake Bot API and reports throughput, what the fake received, the rate
+# limiter counters and circuit breaker transitions. The created rows are
+# removed afterwards.
+#
+# Usage (from the app directory, against a scratch database):
+#   SQL_DATABASE=/tmp/load.sqlite3 python manage.py migrate
+#   SQL_DATABASE=/tmp/load.sqlite3 python -m benchmarks.reminder_load \
+#       --subscribers 2000 --latency 0.05 --error-rate 0.01 --throttle-rate 0.001
+import argparse
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "localhost")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from subscription_service.models import (  # noqa: E402
+    Plan,
+    SentReminder,
+    Subscription,
+    TelegramUser,
+)
+from subscription_service.tasks import (  # noqa: E402
+    notify_about_expiring_subscriptions_7_days,
+)
+from subscription_service.utils import (  # noqa: E402
+    TelegramHTTPClient,
+    TelegramRateLimiter,
+)
+
+from benchmarks.fake_telegram import FakeTelegramServer  # noqa: E402
+
+FIRST_CHAT_ID = 10**12
+
+
+def create_subscribers(subscribers: int, admins: int) -> None:
+    plan, _ = Plan.objects.get_or_create(period="1 month", defaults={"price": 100})
+    start_date = timezone.now() - timedelta(days=23)
+    users = [
+        TelegramUser(
+            chat_id=FIRST_CHAT_ID + i,
+            telegram_username=f"load_user_{i}",
+            is_staff=i < admins,
+        )
+        for i in range(subscribers + admins)
+    ]
+    TelegramUser.objects.bulk_create(users)
+    # save() computes the end date, so subscriptions are created one by one
+    for user in users[admins:]:
+        Subscription.objects.create(
+            customer=user,
+            plan=plan,
+            transaction_hash=f"load_{user.chat_id}",
+            start_date=start_date,
+        )
+
+
+def clean_up() -> None:
+    Subscription.objects.filter(transaction_hash__startswith="load_").delete()
+    SentReminder.objects.filter(transaction_hash__startswith="load_").delete()
+    TelegramUser.objects.filter(telegram_username__startswith="load_user_").delete()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--admins", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument(
+        "--real-rate-limits",
+        action="store_true",
+        help="keep the Bot API rate limits instead of lifting them",
+    )
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        seed=1,
+    )
+    settings.TELEGRAM_API_URL = server.url
+    settings.TELEGRAM_DELIVERY_CONCURRENCY = args.concurrency
+    if not args.real_rate_limits:
+        settings.TELEGRAM_GLOBAL_RATE_LIMIT = settings.TELEGRAM_GLOBAL_BURST = 10**6
+    cache.clear()
+
+    clean_up()
+    create_subscribers(args.subscribers, args.admins)
+    try:
+        started = time.perf_counter()
+        notify_about_expiring_subscriptions_7_days()
+        elapsed = time.perf_counter() - started
+
+        calls = server.get_calls()
+        reminded = SentReminder.objects.filter(
+            transaction_hash__startswith="load_"
+        ).count()
+    finally:
+        clean_up()
+        server.shutdown()
+
+    statuses = Counter(call["status"] for call in calls)
+    methods = Counter(call["method"] for call in calls)
+    print(
+        f"{args.subscribers} subscribers, round trip {args.latency * 1000:.0f} ms, "
+        f"error rate {args.error_rate}, throttle rate {args.throttle_rate}"
+    )
+    print(f"task took {elapsed:.2f}s, {len(calls) / elapsed:.1f} calls/s")
+    print(f"calls by method: {dict(methods)}, by status: {dict(statuses)}")
+    print(f"subscribers reminded: {reminded} of {args.subscribers}")
+    print(f"rate limiter counters: {TelegramRateLimiter.get_counters()}")
+    breaker = TelegramHTTPClient.get_circuit_breaker()
+    print(f"circuit breaker transitions: {breaker.get_transitions()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Page latency of GET /api/v1/subscriptions/all/ at increasing depths of a
+# large subscriptions table: the keyset query against the OFFSET query the
+# admin's paginator runs for the same page, and the whole API request. Ten
+# subscriptions share each end date, so the cursor has ties to split.
+# cachalot is switched off, otherwise repeated pages come from Redis. The
+# created rows are removed afterwards.
+#
+# Usage (from the app directory, against a scratch database):
+#   SQL_DATABASE=/tmp/load.sqlite3 python manage.py migrate
+#   SQL_DATABASE=/tmp/load.sqlite3 python -m benchmarks.subscription_listing \
+#       --subscriptions 1000000
+import argparse
+import os
+import statistics
+import time
+from datetime import timedelta
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "localhost testserver")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+django.setup()
+
+from django.db import connection  # noqa: E402
+from cachalot.api import cachalot_disabled  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.test import APIRequestFactory, force_authenticate  # noqa: E402
+from subscription_service.models import Plan, Subscription, TelegramUser  # noqa: E402
+from subscription_service.pagination import SubscriptionPagination  # noqa: E402
+from subscription_service.services import get_subscription_rows  # noqa: E402
+from subscription_service.views import SubscriptionListAPIView  # noqa: E402
+
+PREFIX = "listing_"
+
+
+def create_subscriptions(count: int, batch_size: int = 20000) -> None:
+    plan, _ = Plan.objects.get_or_create(period="1 month", defaults={"price": 100})
+    now = timezone.now()
+    for start in range(0, count, batch_size):
+        # bulk_create skips save(), so the dates are set here
+        Subscription.objects.bulk_create(
+            [
+                Subscription(
+                    plan=plan,
+                    transaction_hash=f"{PREFIX}{i:09d}",
+                    start_date=now,
+                    end_date=now + timedelta(minutes=i // 10),
+                    duration=timedelta(days=30),
+                )
+                for i in range(start, min(start + batch_size, count))
+            ],
+            batch_size=1000,
+        )
+
+
+def clean_up() -> None:
+    # A queryset delete() would load every row for the signals
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {Subscription._meta.db_table} WHERE transaction_hash LIKE %s",
+            [f"{PREFIX}%"],
+        )
+    TelegramUser.objects.filter(telegram_username=f"{PREFIX}admin").delete()
+
+
+def time_median(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscriptions", type=int, default=1000000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    clean_up()
+    started = time.perf_counter()
+    create_subscriptions(args.subscriptions)
+    print(
+        f"created {args.subscriptions} subscriptions in {time.perf_counter() - started:.0f} s"
+    )
+
+    admin = TelegramUser.objects.create(
+        chat_id=10**15, telegram_username=f"{PREFIX}admin", is_staff=True
+    )
+    view = SubscriptionListAPIView.as_view()
+    factory = APIRequestFactory()
+    rows = get_subscription_rows()
+    total = rows.count()
+
+    def get_page(params: dict) -> None:
+        request = factory.get("/api/v1/subscriptions/all/", params)
+        force_authenticate(request, user=admin)
+        response = view(request)
+        assert response.status_code == 200
+        assert len(response.data["results"]) == args.page_size
+
+    try:
+        with cachalot_disabled():
+            for share in (0, 0.1, 0.5, 0.99):
+                depth = int((total - args.page_size) * share)
+                params = {"page_size": args.page_size}
+                keyset_rows = rows
+                if depth:
+                    # The cursor a client walking the pages would hold here
+                    paginator = SubscriptionPagination()
+                    cursor = paginator.encode_cursor(rows[depth - 1])
+                    params["cursor"] = cursor
+                    keyset_rows = paginator.filter_after(
+                        rows, paginator.decode_cursor(rows, cursor)
+                    )
+
+                keyset = time_median(
+                    lambda: list(keyset_rows[: args.page_size]), args.repeat
+                )
+                end = depth + args.page_size
+                offset = time_median(lambda: list(rows[depth:end]), args.repeat)
+                page = time_median(lambda: get_page(params), args.repeat)
+                print(
+                    f"row {depth:>9}: keyset query {keyset * 1000:7.1f} ms, "
+                    f"OFFSET query {offset * 1000:7.1f} ms, "
+                    f"API page {page * 1000:7.1f} ms"
+                )
+    finally:
+        clean_up()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Compares the bot checking a roster of users one GET /api/v1/subscriptions/
+# at a time with a single POST /api/v1/subscriptions/statuses/, both with a
+# cold and a warm cache. Requests go through the Django test client, so the
+# numbers leave out the network round trip every single call would add.
+# The created rows are removed afterwards.
+#
+# Usage (from the app directory, against a scratch database):
+#   SQL_DATABASE=/tmp/load.sqlite3 python manage.py migrate
+#   SQL_DATABASE=/tmp/load.sqlite3 python -m benchmarks.subscription_status \
+#       --users 2000
+import argparse
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "localhost testserver")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from subscription_service.models import Plan, Subscription, TelegramUser  # noqa: E402
+
+FIRST_CHAT_ID = 10**12
+
+
+def create_users(users: int) -> list:
+    plan, _ = Plan.objects.get_or_create(period="1 month", defaults={"price": 100})
+    created = TelegramUser.objects.bulk_create(
+        [
+            TelegramUser(chat_id=FIRST_CHAT_ID + i, telegram_username=f"status_{i}")
+            for i in range(users)
+        ]
+    )
+    # Every other user is subscribed, save() computes the end date
+    for user in created[::2]:
+        Subscription.objects.create(
+            customer=user, plan=plan, transaction_hash=f"status_{user.chat_id}"
+        )
+    return [user.telegram_username for user in created]
+
+
+def clean_up() -> None:
+    Subscription.objects.filter(transaction_hash__startswith="status_").delete()
+    TelegramUser.objects.filter(telegram_username__startswith="status_").delete()
+
+
+def run_single(client: Client, usernames: list) -> tuple:
+    url = reverse("manage-subscription")
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        for username in usernames:
+            client.get(url, {"telegram_username": username})
+        elapsed = time.perf_counter() - started
+    return elapsed, len(queries)
+
+
+def run_bulk(client: Client, usernames: list) -> tuple:
+    url = reverse("subscription-statuses")
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = client.post(
+            url, {"telegram_usernames": usernames}, content_type="application/json"
+        )
+        elapsed = time.perf_counter() - started
+    assert len(response.json()["results"]) == len(usernames)
+    return elapsed, len(queries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+
+    clean_up()
+    usernames = create_users(args.users)
+    client = Client()
+    try:
+        for label, run in (("one GET per user", run_single), ("bulk POST", run_bulk)):
+            cache.clear()
+            for state in ("cold", "warm"):
+                elapsed, queries = run(client, usernames)
+                print(
+                    f"{label}, {state} cache: {elapsed * 1000:.0f} ms, "
+                    f"{queries} queries for {args.users} users"
+                )
+    finally:
+        clean_up()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Micro-benchmark of the Telegram transport against the local fake Bot API
+# served over HTTPS: a new connection and TLS handshake per message (bare
+# requests.post, the old behaviour) vs the keep-alive session of
+# TelegramHTTPClient. Both send the same request with the same timeout, the
+# rate limiter and circuit breaker around the session are left out.
+#
+# Usage (from the app directory):
+#   python -m benchmarks.telegram_sender --messages 2000
+#   python -m benchmarks.telegram_sender --plain  # over HTTP
+import argparse
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "localhost")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+django.setup()
+
+import requests  # noqa: E402
+from django.conf import settings  # noqa: E402
+from subscription_service.utils import (  # noqa: E402
+    TelegramHTTPClient,
+    TelegramMessageSender,
+)
+
+from benchmarks.fake_telegram import FakeTelegramServer  # noqa: E402
+
+
+def run_bare_requests(url: str, messages: int, verify) -> float:
+    timeout = TelegramHTTPClient.get_timeout()
+    started = time.perf_counter()
+    for i in range(messages):
+        requests.post(
+            url=url,
+            params={"chat_id": i, "text": "benchmark"},
+            timeout=timeout,
+            verify=verify,
+        )
+    return messages / (time.perf_counter() - started)
+
+
+def run_pooled_session(url: str, messages: int, verify) -> float:
+    timeout = TelegramHTTPClient.get_timeout()
+    session = TelegramHTTPClient.get_session()
+    started = time.perf_counter()
+    for i in range(messages):
+        session.post(
+            url=url,
+            params={"chat_id": i, "text": "benchmark"},
+            timeout=timeout,
+            verify=verify,
+        )
+    return messages / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--plain", action="store_true", help="HTTP instead of TLS")
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(tls=not args.plain)
+    settings.TELEGRAM_API_URL = server.url
+    url = TelegramMessageSender.build_url("sendMessage")
+
+    before = run_bare_requests(url, args.messages, server.verify)
+    after = run_pooled_session(url, args.messages, server.verify)
+    server.shutdown()
+
+    print(f"bare requests.post: {before:8.1f} messages/s")
+    print(f"pooled session:     {after:8.1f} messages/s ({after / before:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Load scenario for the TronGrid provider pool: starts a fast, a slow and a
+# throttling stand-in provider, runs lookups through TronProviderPool and
+# reports latency percentiles, how the lookups were spread and the
+# per-provider metrics the pool keeps.
+#
+# Usage (from the app directory):
+#   python -m benchmarks.tron_providers --lookups 500 --slow-latency 0.3
+import argparse
+import os
+import statistics
+import time
+from collections import Counter
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "localhost")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from subscription_service.utils import TronProviderPool  # noqa: E402
+
+from benchmarks.fake_tron import FakeTronServer  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lookups", type=int, default=300)
+    parser.add_argument("--fast-latency", type=float, default=0.02)
+    parser.add_argument("--slow-latency", type=float, default=0.3)
+    parser.add_argument("--throttle-rate", type=float, default=0.5)
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    servers = {
+        "slow": FakeTronServer(latency=args.slow_latency, seed=1),
+        "throttling": FakeTronServer(
+            latency=args.fast_latency,
+            throttle_rate=args.throttle_rate,
+            retry_after=args.retry_after,
+            seed=2,
+        ),
+        "fast": FakeTronServer(latency=args.fast_latency, seed=3),
+    }
+    settings.TRON_PROVIDERS = [
+        {"endpoint": server.endpoint, "api_key": label}
+        for label, server in servers.items()
+    ]
+    cache.clear()
+
+    latencies = []
+    statuses = Counter()
+    try:
+        started = time.perf_counter()
+        for i in range(args.lookups):
+            lookup_started = time.perf_counter()
+            response = TronProviderPool.get_transaction(f"bench_{i}")
+            latencies.append(time.perf_counter() - lookup_started)
+            statuses[response.status_code] += 1
+        elapsed = time.perf_counter() - started
+        calls = {label: server.get_calls() for label, server in servers.items()}
+        stats = TronProviderPool.get_stats()
+    finally:
+        for server in servers.values():
+            server.shutdown()
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{args.lookups} lookups in {elapsed:.2f}s, "
+        f"p50 {quantiles[49] * 1000:.0f} ms, p95 {quantiles[94] * 1000:.0f} ms, "
+        f"statuses {dict(statuses)}"
+    )
+    for label, provider_calls in calls.items():
+        by_status = Counter(call["status"] for call in provider_calls)
+        print(f"{label}: {len(provider_calls)} calls, by status {dict(by_status)}")
+    for name, provider_stats in stats.items():
+        print(f"{name}: {provider_stats}")
+
+
+if __name__ == "__main__":
+    main()
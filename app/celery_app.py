@@ -32,6 +32,14 @@ app.conf.beat_schedule = {
         "task": "subscription_service.tasks.notify_about_expiring_subscriptions_7_days",
         "schedule": crontab(minute=0, hour=0),
     },
+    "send_outbox_messages": {
+        "task": "subscription_service.tasks.send_outbox_messages",
+        "schedule": 60.0,
+    },
+    "ingest_incoming_transfers": {
+        "task": "subscription_service.tasks.ingest_incoming_transfers",
+        "schedule": 30.0,
+    },
 }
 
 app.autodiscover_tasks()
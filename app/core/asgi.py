@@ -13,4 +13,22 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from subscription_service.async_utils import AsyncTronClient  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Django doesn't speak the lifespan protocol, it is answered here so the
+    # aiohttp session of the async views is closed when the worker stops
+    if scope["type"] != "lifespan":
+        return await django_application(scope, receive, send)
+
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await AsyncTronClient.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -36,6 +36,7 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     # third-party packages
     "rest_framework",
+    "rest_framework.authtoken",
     "cachalot",
     "corsheaders",
     # apps
@@ -116,6 +117,153 @@ CACHES = {
     }
 }
 
+# Telegram Bot API client
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_CONNECT_TIMEOUT = float(os.environ.get("TELEGRAM_CONNECT_TIMEOUT", 3.05))
+TELEGRAM_READ_TIMEOUT = float(os.environ.get("TELEGRAM_READ_TIMEOUT", 10))
+TELEGRAM_POOL_CONNECTIONS = int(os.environ.get("TELEGRAM_POOL_CONNECTIONS", 1))
+TELEGRAM_POOL_MAXSIZE = int(os.environ.get("TELEGRAM_POOL_MAXSIZE", 10))
+
+# Bot API limits shared by all workers: messages per second and burst size
+TELEGRAM_GLOBAL_RATE_LIMIT = float(os.environ.get("TELEGRAM_GLOBAL_RATE_LIMIT", 30))
+TELEGRAM_GLOBAL_BURST = int(os.environ.get("TELEGRAM_GLOBAL_BURST", 30))
+TELEGRAM_CHAT_RATE_LIMIT = float(os.environ.get("TELEGRAM_CHAT_RATE_LIMIT", 1))
+TELEGRAM_CHAT_BURST = int(os.environ.get("TELEGRAM_CHAT_BURST", 3))
+TELEGRAM_MAX_RETRIES_ON_429 = int(os.environ.get("TELEGRAM_MAX_RETRIES_ON_429", 3))
+
+# Number of Bot API requests in flight when delivering a batch of messages
+TELEGRAM_DELIVERY_CONCURRENCY = int(os.environ.get("TELEGRAM_DELIVERY_CONCURRENCY", 20))
+
+# TronGrid API connect and read timeouts in seconds
+TRON_CONNECT_TIMEOUT = float(os.environ.get("TRON_CONNECT_TIMEOUT", 3.05))
+TRON_READ_TIMEOUT = float(os.environ.get("TRON_READ_TIMEOUT", 10))
+
+# How long parsed TronGrid transactions stay cached in seconds: confirmed
+# ones for a day, missing, unconfirmed or failed lookups briefly
+TRON_TRANSACTION_CACHE_TTL = int(os.environ.get("TRON_TRANSACTION_CACHE_TTL", 86400))
+TRON_NEGATIVE_CACHE_TTL = int(os.environ.get("TRON_NEGATIVE_CACHE_TTL", 30))
+
+# Ingestion of incoming USDT transfers into the local index: token contract,
+# transfers per page and pages per run. Pages are fetched from the hosts of
+# the TRON_PROVIDERS below.
+TRON_USDT_CONTRACT_ADDRESS = os.environ.get(
+    "TRON_USDT_CONTRACT_ADDRESS", "TR7NHqjeKQxGTCi8q8ZY4pq3BjTKB7GcWw"
+)
+TRON_INGEST_PAGE_SIZE = int(os.environ.get("TRON_INGEST_PAGE_SIZE", 200))
+TRON_INGEST_MAX_PAGES = int(os.environ.get("TRON_INGEST_MAX_PAGES", 50))
+
+# Providers for transaction lookups as comma separated "<endpoint>|<api key>"
+# pairs, the endpoint is the URL the hash is appended to like API_ENDPOINT.
+# Defaults to API_ENDPOINT and API_KEY alone.
+TRON_PROVIDERS = [
+    dict(zip(("endpoint", "api_key"), provider.strip().split("|", 1)))
+    for provider in os.environ.get("TRON_PROVIDERS", "").split(",")
+    if provider.strip()
+]
+
+# Provider health: weight of the newest call in the rolling latency and error
+# rate, share of lookups sent to a random provider to keep its numbers fresh,
+# and seconds a provider rests after a 429 without Retry-After
+TRON_PROVIDER_EWMA_ALPHA = float(os.environ.get("TRON_PROVIDER_EWMA_ALPHA", 0.3))
+TRON_PROVIDER_EXPLORATION = float(os.environ.get("TRON_PROVIDER_EXPLORATION", 0.05))
+TRON_PROVIDER_COOLDOWN = int(os.environ.get("TRON_PROVIDER_COOLDOWN", 10))
+
+# Sliding-window limits: payment submissions per Telegram user and window in
+# seconds, and TronGrid lookups per API key and window in seconds
+PAYMENT_SUBMISSION_LIMIT = int(os.environ.get("PAYMENT_SUBMISSION_LIMIT", 5))
+PAYMENT_SUBMISSION_WINDOW = int(os.environ.get("PAYMENT_SUBMISSION_WINDOW", 60))
+TRON_API_KEY_LIMIT = int(os.environ.get("TRON_API_KEY_LIMIT", 15))
+TRON_API_KEY_WINDOW = float(os.environ.get("TRON_API_KEY_WINDOW", 1))
+
+# Retries of failed upstream calls: attempts in total, base and maximum
+# backoff in seconds (full jitter is applied)
+HTTP_RETRY_ATTEMPTS = int(os.environ.get("HTTP_RETRY_ATTEMPTS", 3))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", 0.5))
+HTTP_RETRY_MAX_BACKOFF = float(os.environ.get("HTTP_RETRY_MAX_BACKOFF", 5))
+
+# An upstream's circuit opens once FAILURE_THRESHOLD calls within
+# FAILURE_WINDOW seconds failed and they make FAILURE_RATIO of all calls,
+# then stays open for RESET_TIMEOUT seconds
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(
+    os.environ.get("CIRCUIT_BREAKER_FAILURE_THRESHOLD", 5)
+)
+CIRCUIT_BREAKER_FAILURE_RATIO = float(
+    os.environ.get("CIRCUIT_BREAKER_FAILURE_RATIO", 0.5)
+)
+CIRCUIT_BREAKER_FAILURE_WINDOW = int(
+    os.environ.get("CIRCUIT_BREAKER_FAILURE_WINDOW", 60)
+)
+CIRCUIT_BREAKER_RESET_TIMEOUT = int(os.environ.get("CIRCUIT_BREAKER_RESET_TIMEOUT", 30))
+
+# Concurrent submissions of one transaction hash share one TronGrid lookup:
+# seconds the winner may hold the lock, seconds its result stays around for
+# requests that waited on it, and how often those check for it
+SINGLEFLIGHT_LOCK_TIMEOUT = int(os.environ.get("SINGLEFLIGHT_LOCK_TIMEOUT", 60))
+SINGLEFLIGHT_RESULT_TTL = int(os.environ.get("SINGLEFLIGHT_RESULT_TTL", 10))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.environ.get("SINGLEFLIGHT_POLL_INTERVAL", 0.05))
+
+# Reference data (plans, admins) is kept in every process for LOCAL_TTL
+# seconds and in Redis for TTL seconds. Changes are announced over Redis
+# pub/sub, the local TTL only bounds staleness when an announcement is missed.
+REFERENCE_CACHE_TTL = int(os.environ.get("REFERENCE_CACHE_TTL", 3600))
+REFERENCE_CACHE_LOCAL_TTL = int(os.environ.get("REFERENCE_CACHE_LOCAL_TTL", 60))
+
+# Most users registered by one bulk registration request
+USER_REGISTRATION_BATCH_LIMIT = int(
+    os.environ.get("USER_REGISTRATION_BATCH_LIMIT", 5000)
+)
+
+# Seconds a subscription status answered by GET /api/v1/subscriptions/ stays
+# cached, changes to the subscription invalidate it earlier
+SUBSCRIPTION_CACHE_TTL = int(os.environ.get("SUBSCRIPTION_CACHE_TTL", 300))
+
+# Most users whose subscription status can be asked for in one request
+SUBSCRIPTION_STATUS_BATCH_LIMIT = int(
+    os.environ.get("SUBSCRIPTION_STATUS_BATCH_LIMIT", 5000)
+)
+
+# GET /api/v1/subscriptions/all/: subscriptions per page by default and at most
+SUBSCRIPTION_LIST_PAGE_SIZE = int(os.environ.get("SUBSCRIPTION_LIST_PAGE_SIZE", 100))
+SUBSCRIPTION_LIST_MAX_PAGE_SIZE = int(
+    os.environ.get("SUBSCRIPTION_LIST_MAX_PAGE_SIZE", 1000)
+)
+
+# How admins hear about task runs: "digest" sends each admin one summary per
+# run, "per_event" sends a message per subscription
+ADMIN_NOTIFICATION_MODE = os.environ.get("ADMIN_NOTIFICATION_MODE", "digest")
+
+# Notification outbox drained by the send_outbox_messages task: rows per run,
+# attempts before a message is marked failed, base retry delay in seconds and
+# seconds a worker may take to send a batch before another one may retry it
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+OUTBOX_RETRY_BACKOFF = int(os.environ.get("OUTBOX_RETRY_BACKOFF", 30))
+OUTBOX_LEASE_TIMEOUT = int(os.environ.get("OUTBOX_LEASE_TIMEOUT", 600))
+
+# Subscribers reminded per delivery batch, the sent-reminder ledger is
+# written after each one
+REMINDER_CHUNK_SIZE = int(os.environ.get("REMINDER_CHUNK_SIZE", 200))
+
+# How POST /api/v1/subscriptions/ checks the payment: "sync" validates the
+# transaction within the request, "async" answers 202 with a job id and
+# leaves the check to a Celery worker, retried while TronGrid is unavailable
+PAYMENT_VERIFICATION_MODE = os.environ.get("PAYMENT_VERIFICATION_MODE", "sync")
+PAYMENT_VERIFICATION_MAX_RETRIES = int(
+    os.environ.get("PAYMENT_VERIFICATION_MAX_RETRIES", 10)
+)
+# Seconds a worker has for the TronGrid check of a payment before another
+# one may take the verification over
+PAYMENT_VERIFICATION_LEASE_TIMEOUT = int(
+    os.environ.get("PAYMENT_VERIFICATION_LEASE_TIMEOUT", 300)
+)
+
+# Serve the user and subscription endpoints with async views, which await
+# the ORM, Redis and TronGrid instead of holding a worker. Only worth it
+# under an ASGI server, e.g.
+#   gunicorn core.asgi:application -k uvicorn.workers.UvicornWorker
+# under WSGI every request still takes a thread.
+ASYNC_VIEWS = bool(int(os.environ.get("ASYNC_VIEWS", 0)))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -170,4 +318,8 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.TokenAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
+    "DEFAULT_RENDERER_CLASSES": (
+        "subscription_service.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
 }
@@ -1,6 +1,16 @@
 from django.contrib import admin
 
-from .models import Plan, Subscription, TelegramUser
+from .models import (
+    IncomingTransfer,
+    OutboxMessage,
+    PaymentVerification,
+    Plan,
+    SentReminder,
+    Subscription,
+    SubscriptionHistory,
+    TelegramFile,
+    TelegramUser,
+)
 
 
 class TelegramUserAdmin(admin.ModelAdmin):
@@ -47,3 +57,38 @@ class PlanAdmin(admin.ModelAdmin):
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ["customer", "plan", "transaction_hash", "start_date", "end_date"]
+
+
+@admin.register(SubscriptionHistory)
+class SubscriptionHistoryAdmin(admin.ModelAdmin):
+    list_display = ["customer", "plan", "transaction_hash", "end_date", "reason"]
+    list_filter = ["reason"]
+    search_fields = ["transaction_hash"]
+
+
+@admin.register(TelegramFile)
+class TelegramFileAdmin(admin.ModelAdmin):
+    list_display = ["content_hash", "file_id", "created_at"]
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ["chat_id", "status", "attempts", "created_at", "sent_at"]
+    list_filter = ["status"]
+
+
+@admin.register(SentReminder)
+class SentReminderAdmin(admin.ModelAdmin):
+    list_display = ["transaction_hash", "offset_days", "sent_at"]
+
+
+@admin.register(PaymentVerification)
+class PaymentVerificationAdmin(admin.ModelAdmin):
+    list_display = ["customer", "plan", "transaction_hash", "status", "created_at"]
+    list_filter = ["status"]
+
+
+@admin.register(IncomingTransfer)
+class IncomingTransferAdmin(admin.ModelAdmin):
+    list_display = ["transaction_hash", "from_address", "amount_str", "timestamp"]
+    search_fields = ["transaction_hash", "from_address"]
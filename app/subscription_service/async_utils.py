@@ -0,0 +1,173 @@
+import asyncio
+import functools
+import json
+import time
+import weakref
+from dataclasses import dataclass, field
+from typing import Optional
+
+import aiohttp
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .utils import (
+    CircuitOpenError,
+    Singleflight,
+    TronLookup,
+    TronProviderPool,
+    TronTransactionAnalyzer,
+)
+
+
+async def run_in_thread(func, *args, **kwargs):
+    # Redis calls don't touch the ORM, so they can run on any thread
+    return await sync_to_async(func, thread_sensitive=False)(*args, **kwargs)
+
+
+@dataclass
+class BufferedResponse:
+    # Fully read aiohttp response, shaped like requests.Response so the
+    # helpers written for the blocking clients work on both
+    status_code: int
+    text: str
+    headers: dict = field(default_factory=dict)
+
+    def json(self) -> dict:
+        return json.loads(self.text)
+
+    @classmethod
+    async def read(cls, raw_response: aiohttp.ClientResponse) -> "BufferedResponse":
+        return cls(
+            status_code=raw_response.status,
+            text=await raw_response.text(),
+            headers=dict(raw_response.headers),
+        )
+
+
+class AsyncTronClient:
+    # Transaction lookups for the async views. Same failover over the
+    # TronProviderPool providers, with the same stats, quotas and circuit
+    # breakers in Redis, but the requests go over an aiohttp session, so one
+    # worker waits on TronGrid for many payments at once.
+    _sessions = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def get_session(cls) -> aiohttp.ClientSession:
+        # A session is bound to its event loop, each loop gets its own
+        loop = asyncio.get_running_loop()
+        session = cls._sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=settings.TRON_CONNECT_TIMEOUT,
+                    sock_read=settings.TRON_READ_TIMEOUT,
+                ),
+            )
+            cls._sessions[loop] = session
+        return session
+
+    @classmethod
+    async def close(cls) -> None:
+        # Called on ASGI lifespan shutdown, see core.asgi
+        session = cls._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    @classmethod
+    async def get_transaction(cls, tx_hash: str) -> BufferedResponse:
+        # TronProviderPool.get_transaction, awaiting instead of blocking
+        lookup = TronLookup(
+            await run_in_thread(TronProviderPool.rank_providers),
+            functools.partial(TronProviderPool.get_transaction_url, tx_hash=tx_hash),
+        )
+        attempts = lookup.get_attempts()
+        while True:
+            attempt = await run_in_thread(next, attempts, None)
+            if attempt is None:
+                return lookup.give_up()
+            provider, delay = attempt
+            await asyncio.sleep(delay)
+
+            breaker = await run_in_thread(lookup.reserve, provider)
+            if breaker is None:
+                continue
+            if not await run_in_thread(breaker.allow_request):
+                lookup.retry_after.append(await run_in_thread(breaker.get_retry_after))
+                continue
+
+            started = time.perf_counter()
+            try:
+                async with cls.get_session().get(
+                    lookup.get_url(provider),
+                    headers=TronProviderPool.get_headers(provider),
+                ) as raw_response:
+                    response = await BufferedResponse.read(raw_response)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                await run_in_thread(breaker.record_failure)
+                await run_in_thread(
+                    lookup.record_error, provider, e, time.perf_counter() - started
+                )
+                continue
+
+            latency = time.perf_counter() - started
+            if response.status_code < 500:
+                await run_in_thread(breaker.record_success)
+            else:
+                await run_in_thread(breaker.record_failure)
+            if await run_in_thread(lookup.record_response, provider, response, latency):
+                return response
+
+    @classmethod
+    async def get_transaction_facts(cls, tx_hash: str) -> Optional[dict]:
+        # TronTransactionAnalyzer.get_transaction_facts with an awaited lookup
+        facts = await sync_to_async(
+            TronTransactionAnalyzer.get_known_transaction_facts
+        )(tx_hash)
+        if facts is None:
+            facts = await AsyncSingleflight("tron_transaction").do(
+                tx_hash, lambda: cls.fetch_and_cache_transaction_facts(tx_hash)
+            )
+        return facts if facts["found"] else None
+
+    @classmethod
+    async def fetch_and_cache_transaction_facts(cls, tx_hash: str) -> dict:
+        try:
+            response = await cls.get_transaction(tx_hash)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TronTransactionAnalyzer.lookup_failed(e) from e
+        return await run_in_thread(
+            TronTransactionAnalyzer.cache_transaction_facts, tx_hash, response
+        )
+
+    @classmethod
+    async def validate_tx_hash(cls, tx_hash: str, plan_price: int) -> bool:
+        try:
+            return TronTransactionAnalyzer.check_transaction_facts(
+                tx_hash, await cls.get_transaction_facts(tx_hash), plan_price
+            )
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            print(f"Error occurred: {e}")
+            return False
+
+
+class AsyncSingleflight(Singleflight):
+    # Singleflight for coroutines: func returns an awaitable and waiting for
+    # another caller's result doesn't block the event loop
+    async def do(self, key: str, func):
+        while True:
+            result = await run_in_thread(self.get_result, key)
+            if result is not None:
+                return result
+
+            token = await run_in_thread(self.acquire, key)
+            if token is not None:
+                try:
+                    result = await func()
+                    await run_in_thread(self.publish, key, result)
+                    return result
+                finally:
+                    await run_in_thread(self.release, key, token)
+
+            await asyncio.sleep(settings.SINGLEFLIGHT_POLL_INTERVAL)
@@ -0,0 +1,150 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .async_utils import AsyncTronClient, run_in_thread
+from .models import Plan, TelegramUser
+from .services import (
+    USER_NOT_FOUND,
+    activate_subscription,
+    ais_transaction_hash_used,
+    build_subscription_status,
+    get_activated_subscription,
+    get_plan,
+    get_subscription_status_rows,
+    submit_payment_verification,
+)
+from .utils import CircuitOpenError, SubscriptionStatusCache, TronTransactionAnalyzer
+from .views import SubscriptionAPIView, TelegramUserAPIView
+
+
+class AsyncAPIView(APIView):
+    # APIView whose handlers are coroutines, for running under an ASGI server
+    # (DRF 3.14 only dispatches sync handlers). Authentication, permissions
+    # and exception handling stay DRF's, so the answers are the same.
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            self.initial(request, *args, **kwargs)
+            handler = self.http_method_not_allowed
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(
+                    self, request.method.lower(), self.http_method_not_allowed
+                )
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncTelegramUserAPIView(AsyncAPIView, TelegramUserAPIView):
+    # Validation and saving are ORM work, they run on the request's thread
+    # for database access
+    async def post(self, request: HttpRequest) -> HttpResponse:
+        return await sync_to_async(super().post)(request)
+
+    async def put(self, request: HttpRequest) -> HttpResponse:
+        return await sync_to_async(super().put)(request)
+
+
+class AsyncSubscriptionAPIView(AsyncAPIView, SubscriptionAPIView):
+    # SubscriptionAPIView awaiting the ORM, Redis and TronGrid, so a worker
+    # keeps serving other requests while a payment is checked
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        telegram_username = request.query_params.get("telegram_username")
+
+        cached = await run_in_thread(SubscriptionStatusCache.get, telegram_username)
+        if cached is not None:
+            status_code, payload = cached
+            return self.status_response(request, status_code, payload)
+
+        row = await get_subscription_status_rows(
+            telegram_username=telegram_username
+        ).afirst()
+        if row is None:
+            status_code, payload = USER_NOT_FOUND
+        else:
+            status_code, payload = build_subscription_status(row)
+        await run_in_thread(
+            SubscriptionStatusCache.set, telegram_username, status_code, payload
+        )
+        return self.status_response(request, status_code, payload)
+
+    async def post(self, request: HttpRequest) -> HttpResponse:
+        data = request.data
+        telegram_username = data.get("telegram_username")
+        plan_name = data.get("plan")
+        transaction_hash = data.get("transaction_hash")
+
+        retry_after = await run_in_thread(
+            self.get_submission_throttle().hit, str(telegram_username)
+        )
+        if retry_after:
+            return self.too_many_submissions(retry_after)
+
+        try:
+            user = await TelegramUser.objects.aget(telegram_username=telegram_username)
+        except TelegramUser.DoesNotExist:
+            return Response(
+                {"message": "User not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        plan = await sync_to_async(get_plan)(plan_name)
+        if plan is None:
+            return Response(
+                {"message": "Plan not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        if not TronTransactionAnalyzer.is_well_formed_tx_hash(transaction_hash):
+            return Response(
+                self.INVALID_TRANSACTION, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if await ais_transaction_hash_used(transaction_hash):
+            data = await sync_to_async(get_activated_subscription)(
+                user, transaction_hash
+            )
+            if data is None:
+                raise ValidationError("Transaction hash already used for subscription.")
+            return self.outcome_response(self.build_outcome((data, None)))
+
+        if settings.PAYMENT_VERIFICATION_MODE == "async":
+            verification = await sync_to_async(submit_payment_verification)(
+                user=user, plan=plan, transaction_hash=transaction_hash
+            )
+            return self.verification_accepted(verification)
+
+        try:
+            outcome = await self.averify_and_activate(user, plan, transaction_hash)
+        except CircuitOpenError as e:
+            return self.verification_unavailable(e)
+        return self.outcome_response(outcome)
+
+    @classmethod
+    async def averify_and_activate(
+        cls, user: TelegramUser, plan: Plan, transaction_hash: str
+    ) -> dict:
+        success = await AsyncTronClient.validate_tx_hash(
+            tx_hash=transaction_hash, plan_price=plan.price
+        )
+        activation = None
+        if success:
+            activation = await sync_to_async(activate_subscription)(
+                user=user, plan=plan, transaction_hash=transaction_hash
+            )
+        return cls.build_outcome(activation)
@@ -0,0 +1,305 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Union
+
+import aiohttp
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+
+from .async_utils import BufferedResponse, run_in_thread
+from .utils import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    TelegramFileIdCache,
+    TelegramHTTPClient,
+    TelegramMessageSender,
+    TelegramRateLimiter,
+)
+
+
+@dataclass
+class OutboundMessage:
+    chat_id: Union[int, str]
+    text: str
+    photo_path: Optional[str] = None
+
+
+@dataclass
+class DeliveryResult:
+    message: OutboundMessage
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code == 200
+
+
+class AsyncTelegramDeliveryEngine:
+    # Sends a batch of messages over one pooled aiohttp session with at most
+    # `concurrency` requests in flight. Messages to the same chat keep their
+    # order (a reminder photo must arrive before its subscription details),
+    # different chats are delivered concurrently. Every request still goes
+    # through the shared TelegramRateLimiter and Telegram circuit breaker.
+
+    # A closed breaker is looked up in Redis at most once per interval and
+    # successes are reported in bulk, failures are reported right away
+    BREAKER_CHECK_INTERVAL = 1.0
+    SUCCESS_FLUSH_SIZE = 100
+
+    def __init__(self, concurrency: Optional[int] = None):
+        self.concurrency = concurrency or settings.TELEGRAM_DELIVERY_CONCURRENCY
+        self._photo_locks = {}
+        self._file_ids = {}
+        self._counters = Counter()
+        self.retry_policy = RetryPolicy()
+        self.breaker = TelegramHTTPClient.get_circuit_breaker()
+        self._breaker_checked_at = None
+        self._probing = False
+        self._successes = 0
+
+    def get_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=settings.TELEGRAM_CONNECT_TIMEOUT,
+                sock_read=settings.TELEGRAM_READ_TIMEOUT,
+            ),
+        )
+
+    async def deliver(
+        self, messages: Iterable[OutboundMessage]
+    ) -> List[DeliveryResult]:
+        messages = list(messages)
+        results = [None] * len(messages)
+
+        # Group message indexes by chat, preserving the order inside each chat
+        chats = {}
+        for index, message in enumerate(messages):
+            chats.setdefault(message.chat_id, []).append(index)
+        pending_chats = iter(chats.values())
+
+        async def worker(session: aiohttp.ClientSession) -> None:
+            for indexes in pending_chats:
+                for index in indexes:
+                    results[index] = await self.send(session, messages[index])
+
+        async with self.get_session() as session:
+            workers = min(self.concurrency, len(chats))
+            await asyncio.gather(*(worker(session) for _ in range(workers)))
+
+        # Counters are flushed once per batch instead of once per message
+        await self.flush_successes()
+        for counter, amount in self._counters.items():
+            await run_in_thread(TelegramRateLimiter.increment, counter, amount)
+        self._counters.clear()
+        return results
+
+    async def send(
+        self, session: aiohttp.ClientSession, message: OutboundMessage
+    ) -> DeliveryResult:
+        try:
+            if message.photo_path:
+                response = await self.send_photo(session, message)
+            else:
+                response = await self.request(
+                    session,
+                    "sendMessage",
+                    message.chat_id,
+                    params={"chat_id": message.chat_id, "text": message.text},
+                )
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            print(f"Failed to send message to chat {message.chat_id}: {error}")
+            return DeliveryResult(message=message, error=error)
+
+        if response.status_code == 200:
+            return DeliveryResult(message=message, status_code=200)
+        print(f"Failed to send message to chat {message.chat_id}:", response.text)
+        return DeliveryResult(
+            message=message, status_code=response.status_code, error=response.text
+        )
+
+    async def send_photo(
+        self, session: aiohttp.ClientSession, message: OutboundMessage
+    ) -> BufferedResponse:
+        params = {"chat_id": message.chat_id, "caption": message.text}
+        content_hash = TelegramFileIdCache.get_content_hash(message.photo_path)
+
+        # Only the first message with a new photo uploads it, the others wait
+        # for its file_id instead of uploading the same image concurrently
+        lock = self._photo_locks.setdefault(content_hash, asyncio.Lock())
+        async with lock:
+            file_id = self._file_ids.get(content_hash)
+            if file_id is None:
+                file_id = await sync_to_async(TelegramFileIdCache.get)(content_hash)
+            if file_id is None:
+                return await self.upload_photo(session, message, params, content_hash)
+            self._file_ids[content_hash] = file_id
+
+        response = await self.request(
+            session, "sendPhoto", message.chat_id, params={**params, "photo": file_id}
+        )
+        if not TelegramMessageSender.is_file_id_rejected(response):
+            return response
+
+        async with lock:
+            new_file_id = self._file_ids.get(content_hash)
+            if new_file_id is None or new_file_id == file_id:
+                print(f"Telegram rejected cached file_id {file_id}, uploading again.")
+                self._file_ids.pop(content_hash, None)
+                await sync_to_async(TelegramFileIdCache.delete)(content_hash)
+                return await self.upload_photo(session, message, params, content_hash)
+
+        # Another message already uploaded the photo again, reuse its file_id
+        return await self.request(
+            session,
+            "sendPhoto",
+            message.chat_id,
+            params={**params, "photo": new_file_id},
+        )
+
+    async def upload_photo(
+        self,
+        session: aiohttp.ClientSession,
+        message: OutboundMessage,
+        params: dict,
+        content_hash: str,
+    ) -> BufferedResponse:
+        with open(message.photo_path, "rb") as photo:
+            content = photo.read()
+        files = {"photo": (os.path.basename(message.photo_path), content)}
+
+        response = await self.request(
+            session, "sendPhoto", message.chat_id, params=params, files=files
+        )
+        if response.status_code == 200:
+            file_id = TelegramMessageSender.get_file_id_from_response(response)
+            if file_id is not None:
+                self._file_ids[content_hash] = file_id
+                await sync_to_async(TelegramFileIdCache.set)(content_hash, file_id)
+        return response
+
+    async def request(
+        self,
+        session: aiohttp.ClientSession,
+        method: str,
+        chat_id: Union[int, str],
+        params: dict,
+        files: Optional[dict] = None,
+    ) -> BufferedResponse:
+        url = TelegramMessageSender.build_url(method)
+        for attempt in range(settings.TELEGRAM_MAX_RETRIES_ON_429 + 1):
+            await self.acquire(chat_id)
+            response = await self.post(session, url, params=params, files=files)
+            if response.status_code != 429:
+                if response.status_code == 200:
+                    self._counters["sent"] += 1
+                return response
+
+            retry_after = TelegramMessageSender.get_retry_after(response)
+            print(f"Telegram rate limit hit, retrying after {retry_after}s.")
+            self._counters["throttled"] += 1
+            await run_in_thread(TelegramRateLimiter.pause, retry_after)
+        return response
+
+    async def post(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        params: dict,
+        files: Optional[dict] = None,
+    ) -> BufferedResponse:
+        for attempt in range(self.retry_policy.attempts):
+            if not await self.allow_request():
+                retry_after = await run_in_thread(self.breaker.get_retry_after)
+                raise CircuitOpenError(TelegramHTTPClient.UPSTREAM, retry_after)
+
+            # Multipart bodies can only be sent once, build them per attempt
+            data = None
+            if files:
+                data = aiohttp.FormData()
+                for name, (filename, content) in files.items():
+                    data.add_field(name, content, filename=filename)
+
+            last_attempt = attempt + 1 == self.retry_policy.attempts
+            try:
+                async with session.post(url, params=params, data=data) as raw_response:
+                    response = await BufferedResponse.read(raw_response)
+            except aiohttp.ClientConnectorError as e:
+                # The connection was never made, so the message wasn't sent
+                await self.record_failure()
+                if last_attempt:
+                    raise
+                print(f"Telegram request failed: {e}, retrying.")
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                await self.record_failure()
+                raise
+            else:
+                if response.status_code < 500:
+                    await self.record_success()
+                else:
+                    await self.record_failure()
+                # Sends aren't idempotent, Telegram may have delivered the
+                # message before answering 5xx, so it isn't sent again
+                return response
+            await asyncio.sleep(self.retry_policy.get_delay(attempt))
+
+    async def allow_request(self) -> bool:
+        now = time.monotonic()
+        if (
+            self._breaker_checked_at is not None
+            and now - self._breaker_checked_at < self.BREAKER_CHECK_INTERVAL
+        ):
+            return True
+
+        state = await run_in_thread(self.breaker.get_state)
+        if state == CircuitBreaker.CLOSED:
+            self._breaker_checked_at = now
+            return True
+        self._breaker_checked_at = None
+        allowed = await run_in_thread(self.breaker.allow_request)
+        self._probing = self._probing or allowed
+        return allowed
+
+    async def record_success(self) -> None:
+        self._successes += 1
+        # A successful probe has to close the breaker for everyone at once
+        if self._probing or self._successes >= self.SUCCESS_FLUSH_SIZE:
+            await self.flush_successes()
+
+    async def flush_successes(self) -> None:
+        if self._successes:
+            successes, self._successes = self._successes, 0
+            self._probing = False
+            await run_in_thread(self.breaker.record_success, successes)
+
+    async def record_failure(self) -> None:
+        # Pending successes go first, the failure ratio depends on them
+        await self.flush_successes()
+        self._breaker_checked_at = None
+        self._probing = False
+        await run_in_thread(self.breaker.record_failure)
+
+    async def acquire(self, chat_id: Union[int, str]) -> None:
+        queued = False
+        wait = await run_in_thread(TelegramRateLimiter.try_acquire, chat_id)
+        while wait > 0:
+            if not queued:
+                self._counters["queued"] += 1
+                queued = True
+            await asyncio.sleep(wait)
+            wait = await run_in_thread(TelegramRateLimiter.try_acquire, chat_id)
+
+
+def deliver_messages(
+    messages: Iterable[OutboundMessage], concurrency: Optional[int] = None
+) -> List[DeliveryResult]:
+    # Entry point for synchronous code such as Celery tasks. async_to_sync
+    # keeps ORM calls on the caller's thread and database connection.
+    engine = AsyncTelegramDeliveryEngine(concurrency=concurrency)
+    return async_to_sync(engine.deliver)(messages)
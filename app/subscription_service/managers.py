@@ -1,4 +1,6 @@
 from django.contrib.auth.models import BaseUserManager
+from django.db import models
+from django.utils import timezone
 
 
 class TelegramUserManager(BaseUserManager):
@@ -39,3 +41,46 @@ class TelegramUserManager(BaseUserManager):
         user.is_superuser = True
         user.save(using=self._db)
         return user
+
+    UPSERT_FIELDS = ("telegram_username", "first_name", "last_name")
+
+    def upsert(self, users, batch_size: int = 1000) -> None:
+        # INSERT ... ON CONFLICT (chat_id) DO UPDATE: the bot registers users
+        # again whenever it sees them, that only refreshes names and username.
+        # A name left out of the payload is kept, so users are upserted in
+        # groups by the fields they carry.
+        groups = {}
+        for user in users:
+            groups.setdefault(frozenset(user), []).append(user)
+
+        for fields, group in groups.items():
+            self.bulk_create(
+                [self.model(**user) for user in group],
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=["chat_id"],
+                update_fields=[
+                    field for field in self.UPSERT_FIELDS if field in fields
+                ],
+            )
+
+
+class OutboxMessageManager(models.Manager):
+    def enqueue(self, messages) -> list:
+        # Call inside the transaction that makes the change the messages are
+        # about, so they are stored if and only if the change is committed
+        return self.bulk_create(
+            [
+                self.model(
+                    chat_id=message.chat_id,
+                    text=message.text,
+                    photo_path=message.photo_path,
+                )
+                for message in messages
+            ]
+        )
+
+    def due(self):
+        return self.filter(
+            status=self.model.PENDING, next_attempt_at__lte=timezone.now()
+        ).order_by("next_attempt_at", "pk")
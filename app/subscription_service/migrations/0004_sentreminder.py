@@ -0,0 +1,37 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscription_service", "0003_outboxmessage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SentReminder",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("transaction_hash", models.CharField(max_length=256)),
+                ("offset_days", models.PositiveSmallIntegerField()),
+                ("sent_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="sentreminder",
+            constraint=models.UniqueConstraint(
+                fields=("transaction_hash", "offset_days"), name="unique_sent_reminder"
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscription_service", "0005_paymentverification"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IncomingTransfer",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("transaction_hash", models.CharField(max_length=256, unique=True)),
+                ("from_address", models.CharField(max_length=64)),
+                ("to_address", models.CharField(max_length=64)),
+                ("token_address", models.CharField(max_length=64)),
+                ("amount_str", models.CharField(max_length=80)),
+                ("decimals", models.PositiveSmallIntegerField()),
+                ("timestamp", models.BigIntegerField(db_index=True)),
+            ],
+        ),
+    ]
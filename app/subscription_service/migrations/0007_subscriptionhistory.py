@@ -0,0 +1,66 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscription_service", "0006_incomingtransfer"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SubscriptionHistory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("transaction_hash", models.CharField(max_length=256, unique=True)),
+                ("start_date", models.DateTimeField()),
+                ("end_date", models.DateTimeField(blank=True, null=True)),
+                ("duration", models.DurationField()),
+                (
+                    "reason",
+                    models.CharField(
+                        choices=[("extended", "extended"), ("expired", "expired")],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "archived_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "customer",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "plan",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="subscription_service.plan",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "subscription history",
+            },
+        ),
+    ]
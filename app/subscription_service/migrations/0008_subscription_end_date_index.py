@@ -0,0 +1,20 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscription_service", "0007_subscriptionhistory"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="subscription",
+            index=models.Index(
+                fields=["end_date", "transaction_hash"],
+                name="subscriptio_end_dat_82ac87_idx",
+            ),
+        ),
+    ]
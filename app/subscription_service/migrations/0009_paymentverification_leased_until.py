@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("subscription_service", "0008_subscription_end_date_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paymentverification",
+            name="leased_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,10 +1,11 @@
+import uuid
 from datetime import timedelta
 
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.db import models
 from django.utils import timezone
 
-from .managers import TelegramUserManager
+from .managers import OutboxMessageManager, TelegramUserManager
 
 
 class TelegramUser(AbstractBaseUser, PermissionsMixin):
@@ -62,6 +63,10 @@ class Subscription(models.Model):
     end_date = models.DateTimeField(null=True, blank=True)
     duration = models.DurationField(null=False, blank=False)
 
+    class Meta:
+        # Keyset pagination of GET /api/v1/subscriptions/all/
+        indexes = [models.Index(fields=["end_date", "transaction_hash"])]
+
     def save(self, *args, **kwargs):
         if self.plan:
             self.set_duration()
@@ -87,3 +92,145 @@ class Subscription(models.Model):
     def set_end_date(self):
         if self.start_date and self.duration:
             self.end_date = self.start_date + self.duration
+
+
+class SubscriptionHistory(models.Model):
+    # Subscriptions replaced by an extension or removed once expired. Their
+    # transaction hashes stay here, so a hash can't pay for a second period.
+    EXTENDED = "extended"
+    EXPIRED = "expired"
+    REASON_CHOICES = [
+        (EXTENDED, "extended"),
+        (EXPIRED, "expired"),
+    ]
+
+    transaction_hash = models.CharField(unique=True, max_length=256)
+    customer = models.ForeignKey(
+        TelegramUser, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    plan = models.ForeignKey(Plan, on_delete=models.SET_NULL, null=True, blank=True)
+    start_date = models.DateTimeField()
+    end_date = models.DateTimeField(null=True, blank=True)
+    duration = models.DurationField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = "subscription history"
+
+    def __str__(self) -> str:
+        return f"{self.transaction_hash} - {self.reason}"
+
+    @classmethod
+    def archive(cls, subscription: Subscription, reason: str) -> "SubscriptionHistory":
+        return cls.objects.create(
+            transaction_hash=subscription.transaction_hash,
+            customer_id=subscription.customer_id,
+            plan_id=subscription.plan_id,
+            start_date=subscription.start_date,
+            end_date=subscription.end_date,
+            duration=subscription.duration,
+            reason=reason,
+        )
+
+
+class TelegramFile(models.Model):
+    content_hash = models.CharField(unique=True, max_length=64)
+    file_id = models.CharField(max_length=256)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self) -> str:
+        return f"{self.content_hash} - {self.file_id}"
+
+
+class OutboxMessage(models.Model):
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "pending"),
+        (SENT, "sent"),
+        (FAILED, "failed"),
+    ]
+
+    chat_id = models.PositiveBigIntegerField(null=False, blank=False)
+    text = models.TextField(null=False, blank=False)
+    photo_path = models.CharField(null=True, blank=True, max_length=256)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = OutboxMessageManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self) -> str:
+        return f"{self.status} message to {self.chat_id}"
+
+
+class SentReminder(models.Model):
+    # Ledger of delivered expiration reminders, one row per subscription and
+    # reminder offset, so a rerun of a reminder task skips what was sent
+    transaction_hash = models.CharField(max_length=256)
+    offset_days = models.PositiveSmallIntegerField()
+    sent_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["transaction_hash", "offset_days"],
+                name="unique_sent_reminder",
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.transaction_hash} - {self.offset_days} days"
+
+
+class PaymentVerification(models.Model):
+    # A submitted payment waiting for, or done with, its TronGrid check. The
+    # id is the job id returned to the client to poll the status with.
+    PENDING = "pending"
+    VERIFIED = "verified"
+    REJECTED = "rejected"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "pending"),
+        (VERIFIED, "verified"),
+        (REJECTED, "rejected"),
+        (FAILED, "failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    customer = models.ForeignKey(TelegramUser, on_delete=models.CASCADE)
+    plan = models.ForeignKey(Plan, on_delete=models.CASCADE)
+    transaction_hash = models.CharField(max_length=256, db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    message = models.TextField(null=True, blank=True)
+    # Set while a worker checks the payment, see tasks.verify_payment
+    leased_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.transaction_hash} - {self.status}"
+
+
+class IncomingTransfer(models.Model):
+    # TRC-20 transfer to our wallet, ingested from TronGrid in bulk so most
+    # payments are validated without a per-hash API call
+    transaction_hash = models.CharField(unique=True, max_length=256)
+    from_address = models.CharField(max_length=64)
+    to_address = models.CharField(max_length=64)
+    token_address = models.CharField(max_length=64)
+    amount_str = models.CharField(max_length=80)
+    decimals = models.PositiveSmallIntegerField()
+    # Block time in milliseconds, as TronGrid reports it
+    timestamp = models.BigIntegerField(db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.transaction_hash} - {self.amount_str}"
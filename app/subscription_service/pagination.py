@@ -0,0 +1,110 @@
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    # Pages through values() rows ordered ascending by `ordering`, fields
+    # that together are unique. The cursor holds the last row's values and
+    # the next page starts right after them, so the database walks the index
+    # instead of skipping OFFSET rows and deep pages cost the same as the
+    # first. DRF's CursorPagination keys on one field plus an offset, which
+    # degrades with many equal end dates. Forward only. Subclasses set the
+    # ordering and the page sizes like for CursorPagination, PAGE_SIZE
+    # defaults to None and a page needs a size.
+    ordering = ()
+    page_size = api_settings.PAGE_SIZE or 100
+    max_page_size = None
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size < 1:
+            return self.page_size
+        if self.max_page_size is None:
+            return page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, row: dict) -> str:
+        # Datetimes keep their microseconds, DjangoJSONEncoder would cut them
+        position = [row[field] for field in self.ordering]
+        data = json.dumps(position, default=lambda value: value.isoformat()).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    def decode_cursor(self, queryset: QuerySet, cursor: str) -> list:
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(position) != len(self.ordering):
+                raise ValueError
+            return [
+                queryset.model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def filter_after(self, queryset: QuerySet, position: list) -> QuerySet:
+        # Rows after (a, b, ...): a > x, or a = x and b > y, and so on. The
+        # a >= x bound is redundant but lets the database seek the index.
+        conditions = []
+        for i, field in enumerate(self.ordering):
+            equal = dict(zip(self.ordering[:i], position[:i]))
+            conditions.append(Q(**equal, **{f"{field}__gt": position[i]}))
+        return queryset.filter(
+            reduce(or_, conditions), **{f"{self.ordering[0]}__gte": position[0]}
+        )
+
+    def paginate_queryset(self, queryset: QuerySet, request, view=None) -> list:
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = self.filter_after(queryset, self.decode_cursor(queryset, cursor))
+
+        # One row more tells whether there is a next page
+        rows = list(queryset[: self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[: self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data) -> Response:
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema: dict) -> dict:
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class SubscriptionPagination(KeysetPagination):
+    ordering = ("end_date", "transaction_hash")
+    page_size = settings.SUBSCRIPTION_LIST_PAGE_SIZE
+    max_page_size = settings.SUBSCRIPTION_LIST_MAX_PAGE_SIZE
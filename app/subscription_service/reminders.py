@@ -0,0 +1,143 @@
+import os
+from datetime import timedelta
+from typing import Iterable, List
+
+import pytz
+from django.conf import settings
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .delivery import DeliveryResult, OutboundMessage
+from .models import SentReminder, Subscription, TelegramUser
+from .utils import AdminDigest, TelegramMessageSender
+
+
+class ReminderPlanner:
+    # Builds the exact set of (recipient, message) pairs for one reminder run:
+    # every subscriber gets the reminder photo and subscription details once,
+    # admins are notified separately once the user messages were delivered.
+
+    def __init__(self, day: int, syntax_word: str, photo_name: str):
+        self.day = day
+        self.syntax_word = syntax_word
+        self.photo_path = os.path.join(settings.MEDIA_ROOT, photo_name)
+        self.moscow_tz = pytz.timezone("Europe/Moscow")
+
+    def get_subscriptions(self) -> QuerySet:
+        # Subscriptions that expire on the calendar day `day` days from today
+        # and weren't reminded yet by an earlier run
+        expiration_date = timezone.localdate() + timedelta(days=self.day)
+        already_reminded = SentReminder.objects.filter(offset_days=self.day).values(
+            "transaction_hash"
+        )
+        return (
+            Subscription.objects.filter(
+                end_date__date=expiration_date, customer__isnull=False
+            )
+            .exclude(transaction_hash__in=already_reminded)
+            .select_related("customer", "plan")
+        )
+
+    def format_date(self, date) -> str:
+        return date.astimezone(self.moscow_tz).strftime("%d/%m/%Y %H:%M:%S")
+
+    def plan_reminders(
+        self, subscriptions: Iterable[Subscription]
+    ) -> List[OutboundMessage]:
+        messages = []
+        for subscription in subscriptions:
+            telegram_username = subscription.customer.telegram_username
+            chat_id = subscription.customer.chat_id
+
+            # Firstly, a reminder with photo, secondly the subscription data
+            message_about_reminder = (
+                TelegramMessageSender.create_message_about_reminder(
+                    telegram_username=telegram_username,
+                    day=self.day,
+                    syntax_word=self.syntax_word,
+                )
+            )
+            message_with_subscription_data = (
+                TelegramMessageSender.create_message_with_subscription_data(
+                    telegram_username=telegram_username,
+                    subscription_plan=subscription.plan.period,
+                    subscription_start_date=self.format_date(subscription.start_date),
+                    subscription_end_date=self.format_date(subscription.end_date),
+                    subscription_price=subscription.plan.price,
+                )
+            )
+
+            messages.append(
+                OutboundMessage(
+                    chat_id=chat_id,
+                    text=message_about_reminder,
+                    photo_path=self.photo_path,
+                )
+            )
+            messages.append(
+                OutboundMessage(chat_id=chat_id, text=message_with_subscription_data)
+            )
+        return messages
+
+    @staticmethod
+    def get_outcomes(
+        subscriptions: Iterable[Subscription], results: Iterable[DeliveryResult]
+    ) -> dict:
+        # A subscriber was reminded only if every message to their chat arrived
+        delivered = {}
+        for result in results:
+            chat_id = result.message.chat_id
+            delivered[chat_id] = delivered.get(chat_id, True) and result.ok
+
+        outcomes = {}
+        for subscription in subscriptions:
+            outcomes[subscription] = delivered.get(subscription.customer.chat_id, False)
+        return outcomes
+
+    def record_sent(self, outcomes: dict) -> None:
+        SentReminder.objects.bulk_create(
+            [
+                SentReminder(
+                    transaction_hash=subscription.transaction_hash,
+                    offset_days=self.day,
+                )
+                for subscription, delivered in outcomes.items()
+                if delivered
+            ],
+            ignore_conflicts=True,
+        )
+
+    def plan_admin_notifications(
+        self, admins_of_group: Iterable[TelegramUser], outcomes: dict
+    ) -> List[OutboundMessage]:
+        messages = []
+
+        if settings.ADMIN_NOTIFICATION_MODE == "digest":
+            digest = AdminDigest(
+                title=f"Action: 🔔 remind about subscription expiring in {self.day} {self.syntax_word}"
+            )
+            for subscription, delivered in outcomes.items():
+                telegram_username = subscription.customer.telegram_username
+                if delivered:
+                    digest.add("Reminder sent", f"@{telegram_username}")
+                else:
+                    digest.add("Failed to send reminder", f"@{telegram_username}")
+
+            if digest.is_empty():
+                return messages
+            for admin in admins_of_group:
+                for page in digest.render_pages(admin_of_group=admin.telegram_username):
+                    messages.append(OutboundMessage(chat_id=admin.chat_id, text=page))
+            return messages
+
+        for admin in admins_of_group:
+            for subscription, delivered in outcomes.items():
+                if not delivered:
+                    continue
+                telegram_username = subscription.customer.telegram_username
+                message = (
+                    f"Hi, {admin.telegram_username}!\n\n"
+                    f"A reminder about extending the subscription was successfully sent to @{telegram_username}\n\n"
+                )
+                messages.append(OutboundMessage(chat_id=admin.chat_id, text=message))
+        return messages
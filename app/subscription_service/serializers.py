@@ -1,6 +1,21 @@
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
 
-from .models import Subscription, TelegramUser
+from .models import PaymentVerification, Plan, Subscription, TelegramUser
+
+DATETIME_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+
+def format_datetime(value: Optional[datetime]) -> Optional[str]:
+    # What DateTimeField(format=DATETIME_FORMAT) outputs, for rows read with
+    # values() instead of a serializer
+    if value is None:
+        return None
+    return timezone.localtime(value).strftime(DATETIME_FORMAT)
 
 
 class TelegramUserSerializer(serializers.ModelSerializer):
@@ -14,6 +29,41 @@ class TelegramUserSerializer(serializers.ModelSerializer):
         ]
 
 
+class TelegramUserUpsertSerializer(serializers.ModelSerializer):
+    # Registering a user again updates them, so existing chat_ids and
+    # usernames aren't errors here
+    class Meta:
+        model = TelegramUser
+        fields = [
+            "chat_id",
+            "telegram_username",
+            "first_name",
+            "last_name",
+        ]
+        extra_kwargs = {
+            "chat_id": {"validators": []},
+            "telegram_username": {"validators": []},
+        }
+
+
+class TelegramUserBulkSerializer(serializers.Serializer):
+    users = TelegramUserUpsertSerializer(many=True, allow_empty=False)
+
+    def validate_users(self, users):
+        limit = settings.USER_REGISTRATION_BATCH_LIMIT
+        if len(users) > limit:
+            raise serializers.ValidationError(f"At most {limit} users per request.")
+
+        chat_ids = {}
+        for user in users:
+            chat_id = chat_ids.setdefault(user["telegram_username"], user["chat_id"])
+            if chat_id != user["chat_id"]:
+                raise serializers.ValidationError(
+                    f"{user['telegram_username']} is given for several chat_ids."
+                )
+        return users
+
+
 class PostSubscriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscription
@@ -24,8 +74,8 @@ class GetSubscriptionSerializer(serializers.ModelSerializer):
     customer = serializers.CharField(source="customer.telegram_username")
     plan = serializers.CharField(source="plan.period")
     price = serializers.IntegerField(source="plan.price")
-    start_date = serializers.DateTimeField(format="%d/%m/%Y %H:%M:%S")
-    end_date = serializers.DateTimeField(format="%d/%m/%Y %H:%M:%S")
+    start_date = serializers.DateTimeField(format=DATETIME_FORMAT)
+    end_date = serializers.DateTimeField(format=DATETIME_FORMAT)
 
     class Meta:
         model = Subscription
@@ -37,3 +87,52 @@ class GetSubscriptionSerializer(serializers.ModelSerializer):
             "start_date",
             "end_date",
         ]
+
+
+class SubscriptionStatusRequestSerializer(serializers.Serializer):
+    telegram_usernames = serializers.ListField(
+        child=serializers.CharField(max_length=256), required=False, allow_empty=False
+    )
+    chat_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=0), required=False, allow_empty=False
+    )
+
+    def validate(self, attrs):
+        lookups = [
+            field for field in ("telegram_usernames", "chat_ids") if field in attrs
+        ]
+        if len(lookups) != 1:
+            raise serializers.ValidationError(
+                "Pass either telegram_usernames or chat_ids."
+            )
+        limit = settings.SUBSCRIPTION_STATUS_BATCH_LIMIT
+        if len(attrs[lookups[0]]) > limit:
+            raise serializers.ValidationError(f"At most {limit} users per request.")
+        return attrs
+
+
+class SubscriptionListQuerySerializer(serializers.Serializer):
+    expiring_before = serializers.DateTimeField(required=False)
+    expiring_after = serializers.DateTimeField(required=False)
+    plan = serializers.ChoiceField(choices=Plan.PERIOD_CHOICES, required=False)
+
+
+class PaymentVerificationSerializer(serializers.ModelSerializer):
+    job_id = serializers.UUIDField(source="id")
+    customer = serializers.CharField(source="customer.telegram_username")
+    plan = serializers.CharField(source="plan.period")
+    created_at = serializers.DateTimeField(format=DATETIME_FORMAT)
+    updated_at = serializers.DateTimeField(format=DATETIME_FORMAT)
+
+    class Meta:
+        model = PaymentVerification
+        fields = [
+            "job_id",
+            "customer",
+            "plan",
+            "transaction_hash",
+            "status",
+            "message",
+            "created_at",
+            "updated_at",
+        ]
@@ -0,0 +1,389 @@
+from datetime import datetime
+from typing import List, Optional
+
+import pytz
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, QuerySet
+from django.utils import timezone
+from rest_framework import status
+
+from .delivery import OutboundMessage
+from .models import (
+    OutboxMessage,
+    PaymentVerification,
+    Plan,
+    Subscription,
+    SubscriptionHistory,
+    TelegramUser,
+)
+from .serializers import PostSubscriptionSerializer, format_datetime
+from .signals import invalidate_subscription_status
+from .utils import (
+    ReferenceCache,
+    SubscriptionStatusCache,
+    TelegramMessageSender,
+)
+
+USER_NOT_FOUND = (status.HTTP_404_NOT_FOUND, {"message": "User not found"})
+TRANSACTION_HASH_USED = {
+    "transaction_hash": ["Transaction hash already used for subscription."]
+}
+
+
+def get_plans() -> dict:
+    # Plans by period
+    return ReferenceCache.get(
+        "plans", lambda: {plan.period: plan for plan in Plan.objects.all()}
+    )
+
+
+def get_plan(period: str) -> Optional[Plan]:
+    return get_plans().get(period)
+
+
+def get_admins() -> List[TelegramUser]:
+    return ReferenceCache.get(
+        "admins", lambda: list(TelegramUser.objects.filter(is_staff=True))
+    )
+
+
+def build_admin_notifications(
+    subscription: Subscription, extended: bool
+) -> List[OutboundMessage]:
+    # Convert time in Moscow time zone
+    moscow_tz = pytz.timezone("Europe/Moscow")
+    subscription_start_date = subscription.start_date.astimezone(moscow_tz).strftime(
+        "%d/%m/%Y %H:%M:%S"
+    )
+    subscription_end_date = subscription.end_date.astimezone(moscow_tz).strftime(
+        "%d/%m/%Y %H:%M:%S"
+    )
+
+    if extended:
+        create_message = TelegramMessageSender.create_message_about_keep_user
+    else:
+        create_message = TelegramMessageSender.create_message_about_add_user
+
+    messages = []
+    for admin in get_admins():
+        message = create_message(
+            admin_of_group=admin.telegram_username,
+            telegram_username=subscription.customer.telegram_username,
+            subscription_start_date=subscription_start_date,
+            subscription_end_date=subscription_end_date,
+            subscription_plan=subscription.plan.period,
+            subscription_price=subscription.plan.price,
+            tx_hash=subscription.transaction_hash,
+        )
+        messages.append(OutboundMessage(chat_id=admin.chat_id, text=message))
+    return messages
+
+
+def is_transaction_hash_used(transaction_hash: str) -> bool:
+    return (
+        Subscription.objects.filter(transaction_hash=transaction_hash).exists()
+        or SubscriptionHistory.objects.filter(
+            transaction_hash=transaction_hash
+        ).exists()
+    )
+
+
+async def ais_transaction_hash_used(transaction_hash: str) -> bool:
+    return (
+        await Subscription.objects.filter(transaction_hash=transaction_hash).aexists()
+        or await SubscriptionHistory.objects.filter(
+            transaction_hash=transaction_hash
+        ).aexists()
+    )
+
+
+def get_activated_subscription(
+    user: TelegramUser, transaction_hash: str
+) -> Optional[dict]:
+    # What activate_subscription() answered when this payment is the user's
+    # subscription already, so a duplicate submission gets the same answer
+    subscription = (
+        Subscription.objects.filter(customer=user, transaction_hash=transaction_hash)
+        .select_related("customer", "plan")
+        .first()
+    )
+    if subscription is None:
+        return None
+    return PostSubscriptionSerializer(instance=subscription).data
+
+
+def activate_subscription(
+    user: TelegramUser, plan: Plan, transaction_hash: str
+) -> tuple:
+    # Creates the user's subscription, or extends the current one in place:
+    # its row is locked, archived to SubscriptionHistory and updated to the
+    # new payment, so concurrent extensions queue up instead of racing.
+    # Admin notifications are written to the outbox in the same transaction
+    # and sent by a Celery worker once it is committed, so the caller never
+    # waits for the Telegram API. Returns (data, errors).
+    from .tasks import send_outbox_messages
+
+    with transaction.atomic():
+        if SubscriptionHistory.objects.filter(
+            transaction_hash=transaction_hash
+        ).exists():
+            return None, TRANSACTION_HASH_USED
+
+        current = Subscription.objects.select_for_update().filter(customer=user).first()
+        if current is not None and current.transaction_hash == transaction_hash:
+            # A concurrent submission of this payment activated it while this
+            # one was being checked, the user gets the same answer
+            return PostSubscriptionSerializer(instance=current).data, None
+
+        subscription = Subscription(
+            customer=user,
+            plan=plan,
+            transaction_hash=transaction_hash,
+            start_date=timezone.now(),
+        )
+        subscription.set_duration()
+        subscription.set_end_date()
+
+        try:
+            with transaction.atomic():
+                if current is None:
+                    subscription.save(force_insert=True)
+                else:
+                    SubscriptionHistory.archive(current, SubscriptionHistory.EXTENDED)
+                    # The primary key changes, which save() can't do
+                    Subscription.objects.filter(pk=current.pk).update(
+                        transaction_hash=transaction_hash,
+                        plan=plan,
+                        start_date=subscription.start_date,
+                        end_date=subscription.end_date,
+                        duration=subscription.duration,
+                    )
+                    invalidate_subscription_status(user.telegram_username)
+        except IntegrityError:
+            # A concurrent first purchase with this payment won the insert
+            data = get_activated_subscription(user, transaction_hash)
+            if data is not None:
+                return data, None
+            return None, TRANSACTION_HASH_USED
+
+        if not user.at_private_group:
+            user.add_to_private_group()
+        extended = current is not None
+        OutboxMessage.objects.enqueue(
+            build_admin_notifications(subscription, extended=extended)
+        )
+        transaction.on_commit(send_outbox_messages.delay)
+
+    action = "kept in" if extended else "added to"
+    print(f"User {user.telegram_username} must be {action} the group.")
+    return PostSubscriptionSerializer(instance=subscription).data, None
+
+
+def submit_payment_verification(
+    user: TelegramUser, plan: Plan, transaction_hash: str
+) -> PaymentVerification:
+    # Records the payment and leaves the TronGrid check to a Celery worker.
+    # A bot resubmitting the same payment gets the job it already has.
+    from .tasks import verify_payment
+
+    verification = (
+        PaymentVerification.objects.filter(
+            customer=user, transaction_hash=transaction_hash
+        )
+        .exclude(status__in=[PaymentVerification.REJECTED, PaymentVerification.FAILED])
+        .first()
+    )
+    if verification is not None:
+        return verification
+
+    with transaction.atomic():
+        verification = PaymentVerification.objects.create(
+            customer=user, plan=plan, transaction_hash=transaction_hash
+        )
+        transaction.on_commit(lambda: verify_payment.delay(str(verification.pk)))
+    return verification
+
+
+def complete_payment_verification(
+    verification: PaymentVerification, valid: bool
+) -> bool:
+    # Records the outcome of the TronGrid check of a verification leased by
+    # tasks.claim_payment_verification(). False when the lease ran out and
+    # another worker took the verification over meanwhile.
+    with transaction.atomic():
+        if (
+            PaymentVerification.objects.select_for_update()
+            .filter(
+                pk=verification.pk,
+                status=PaymentVerification.PENDING,
+                leased_until=verification.leased_until,
+            )
+            .first()
+            is None
+        ):
+            print(f"Payment verification {verification.pk} was taken over.")
+            return False
+
+        if not valid:
+            verification.status = PaymentVerification.REJECTED
+            verification.message = "Transaction is not valid"
+        else:
+            data, errors = activate_subscription(
+                user=verification.customer,
+                plan=verification.plan,
+                transaction_hash=verification.transaction_hash,
+            )
+            if errors:
+                verification.status = PaymentVerification.REJECTED
+                verification.message = str(errors)
+            else:
+                verification.status = PaymentVerification.VERIFIED
+                verification.message = None
+        verification.leased_until = None
+        verification.save(
+            update_fields=["status", "message", "leased_until", "updated_at"]
+        )
+    return True
+
+
+# Columns of a subscription status row, see get_subscription_status_rows()
+SUBSCRIPTION_STATUS_FIELDS = {
+    "transaction_hash": F("subscription__transaction_hash"),
+    "period": F("subscription__plan__period"),
+    "price": F("subscription__plan__price"),
+    "start_date": F("subscription__start_date"),
+    "end_date": F("subscription__end_date"),
+}
+
+
+def get_subscription_status_rows(**lookups) -> QuerySet:
+    # Users matching lookups with their subscription and plan in one query,
+    # as plain dicts: no model instances to build for large batches
+    return TelegramUser.objects.filter(**lookups).values(
+        "chat_id", "telegram_username", **SUBSCRIPTION_STATUS_FIELDS
+    )
+
+
+def build_subscription_payload(row: dict) -> dict:
+    # What GetSubscriptionSerializer gives for the subscription in a row
+    return {
+        "customer": row["telegram_username"],
+        "plan": row["period"],
+        "price": row["price"],
+        "transaction_hash": row["transaction_hash"],
+        "start_date": format_datetime(row["start_date"]),
+        "end_date": format_datetime(row["end_date"]),
+    }
+
+
+def build_subscription_status(row: dict) -> tuple:
+    # The answer of GET /api/v1/subscriptions/ for a user row, as (status
+    # code, payload)
+    if row["transaction_hash"] is None:
+        return status.HTTP_404_NOT_FOUND, {"message": "Subscription not found"}
+    return status.HTTP_200_OK, build_subscription_payload(row)
+
+
+def get_subscription_rows(
+    expiring_before: Optional[datetime] = None,
+    expiring_after: Optional[datetime] = None,
+    plan: Optional[str] = None,
+) -> QuerySet:
+    # Subscriptions for GET /api/v1/subscriptions/all/ as rows for
+    # build_subscription_payload(), ordered by end date. Subscriptions always
+    # get an end date on save, rows without one would break the cursor.
+    subscriptions = Subscription.objects.filter(end_date__isnull=False)
+    if expiring_before is not None:
+        subscriptions = subscriptions.filter(end_date__lt=expiring_before)
+    if expiring_after is not None:
+        subscriptions = subscriptions.filter(end_date__gt=expiring_after)
+    if plan is not None:
+        subscriptions = subscriptions.filter(plan__period=plan)
+    return subscriptions.order_by("end_date", "transaction_hash").values(
+        "transaction_hash",
+        "start_date",
+        "end_date",
+        telegram_username=F("customer__telegram_username"),
+        period=F("plan__period"),
+        price=F("plan__price"),
+    )
+
+
+def get_subscription_statuses(
+    telegram_usernames: Optional[List[str]] = None,
+    chat_ids: Optional[List[int]] = None,
+) -> List[dict]:
+    # Statuses of many users in the order asked for. Usernames are looked up
+    # in the cache first, the rest are fetched by one IN query and cached.
+    if chat_ids is not None:
+        statuses = {}
+        fetched = {}
+        for row in get_subscription_status_rows(chat_id__in=set(chat_ids)):
+            statuses[row["chat_id"]] = fetched[row["telegram_username"]] = (
+                build_subscription_status(row)
+            )
+        SubscriptionStatusCache.set_many(fetched)
+        lookups = [("chat_id", chat_id) for chat_id in chat_ids]
+    else:
+        statuses = SubscriptionStatusCache.get_many(telegram_usernames)
+        missing = set(telegram_usernames) - statuses.keys()
+        if missing:
+            # Rosters are full of people who never talked to the bot, so
+            # unknown usernames are cached as well
+            fetched = dict.fromkeys(missing, USER_NOT_FOUND)
+            for row in get_subscription_status_rows(telegram_username__in=missing):
+                fetched[row["telegram_username"]] = build_subscription_status(row)
+            SubscriptionStatusCache.set_many(fetched)
+            statuses.update(fetched)
+        lookups = [("telegram_username", username) for username in telegram_usernames]
+
+    results = []
+    for field, value in lookups:
+        status_code, payload = statuses.get(value, USER_NOT_FOUND)
+        results.append({field: value, "status": status_code, "data": payload})
+    return results
+
+
+def register_telegram_users(users: List[dict]) -> dict:
+    # Creates or updates users by chat_id in one upsert. A username still
+    # held by another chat can't be taken over, such users are left out and
+    # returned as conflicts.
+    users = list({user["chat_id"]: user for user in users}.values())
+    holders = dict(
+        TelegramUser.objects.filter(
+            Q(chat_id__in=[user["chat_id"] for user in users])
+            | Q(telegram_username__in=[user["telegram_username"] for user in users])
+        ).values_list("telegram_username", "chat_id")
+    )
+    current_usernames = {chat_id: username for username, chat_id in holders.items()}
+
+    accepted, conflicts = [], []
+    for user in users:
+        holder = holders.get(user["telegram_username"], user["chat_id"])
+        (accepted if holder == user["chat_id"] else conflicts).append(user)
+
+    TelegramUser.objects.upsert(accepted)
+    admin_chat_ids = {admin.chat_id for admin in get_admins()}
+    if any(user["chat_id"] in admin_chat_ids for user in accepted):
+        ReferenceCache.invalidate("admins")
+
+    # bulk_create sends no signals, cached "User not found" answers and the
+    # answers for old usernames are dropped here
+    SubscriptionStatusCache.delete_many(
+        [user["telegram_username"] for user in accepted]
+        + [
+            current_usernames[user["chat_id"]]
+            for user in accepted
+            if user["chat_id"] in current_usernames
+        ]
+    )
+
+    created = [user for user in accepted if user["chat_id"] not in current_usernames]
+    return {
+        "created": len(created),
+        "updated": len(accepted) - len(created),
+        "conflicts": [
+            {"chat_id": user["chat_id"], "telegram_username": user["telegram_username"]}
+            for user in conflicts
+        ],
+    }
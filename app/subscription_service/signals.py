@@ -0,0 +1,52 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Plan, Subscription, TelegramUser
+from .utils import ReferenceCache, SubscriptionStatusCache
+
+
+def invalidate_reference(name: str) -> None:
+    # Again on commit, a process may have loaded the old rows in between
+    ReferenceCache.invalidate(name)
+    transaction.on_commit(lambda: ReferenceCache.invalidate(name))
+
+
+def invalidate_subscription_status(telegram_username: str) -> None:
+    # Dropped right away and again on commit, so a request reading the old
+    # row in between can't keep it cached
+    SubscriptionStatusCache.delete(telegram_username)
+    transaction.on_commit(lambda: SubscriptionStatusCache.delete(telegram_username))
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_subscription(sender, instance: Subscription, **kwargs) -> None:
+    if instance.customer_id is not None:
+        invalidate_subscription_status(instance.customer.telegram_username)
+
+
+@receiver(post_save, sender=TelegramUser)
+@receiver(post_delete, sender=TelegramUser)
+def invalidate_user(sender, instance: TelegramUser, **kwargs) -> None:
+    # "User not found" is cached too, and a deleted user's subscription loses
+    # its customer by an UPDATE, which sends no signal
+    invalidate_subscription_status(instance.telegram_username)
+
+    # Only staff changes matter to the cached admins; a new user, or one
+    # saved for other fields, can't have been an admin before
+    update_fields = kwargs.get("update_fields")
+    if (
+        instance.is_staff
+        or (update_fields is None and not kwargs.get("created"))
+        or (update_fields is not None and "is_staff" in update_fields)
+    ):
+        invalidate_reference("admins")
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+def invalidate_plan(sender, instance: Plan, **kwargs) -> None:
+    # The cached answers carry the plan's price, plan changes are rare
+    invalidate_reference("plans")
+    SubscriptionStatusCache.delete_all()
@@ -1,26 +1,45 @@
-import os
+import math
 from datetime import timedelta
 
 import pytz
 from celery import shared_task
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
-from subscription_service.utils import TelegramMessageSender
-
-from .models import Subscription, TelegramUser
+from subscription_service.utils import (
+    AdminDigest,
+    CircuitOpenError,
+    TelegramMessageSender,
+    TronTransactionAnalyzer,
+    TronTransferIngester,
+)
+
+from .delivery import DeliveryResult, OutboundMessage, deliver_messages
+from .models import (
+    OutboxMessage,
+    PaymentVerification,
+    SentReminder,
+    Subscription,
+    SubscriptionHistory,
+    TelegramUser,
+)
+from .reminders import ReminderPlanner
+from .services import complete_payment_verification, get_admins
 
 
 @shared_task
 def delete_expired_subscriptions() -> None:
     # Get the admins
     try:
-        admins_of_group = TelegramUser.objects.filter(is_staff=True)
+        admins_of_group = get_admins()
         print("Found users:", admins_of_group)
     except TelegramUser.DoesNotExist:
         print("Users not found.")
 
     today = timezone.now()
     moscow_tz = pytz.timezone("Europe/Moscow")
+    digest = AdminDigest(title="Action: 🔴 delete expired subscriptions")
 
     try:
         # Print today's date for debugging
@@ -47,6 +66,28 @@ def delete_expired_subscriptions() -> None:
         subscription_price = subscription.plan.price
         tx_hash = subscription.transaction_hash
 
+        if settings.ADMIN_NOTIFICATION_MODE == "digest":
+            try:
+                with transaction.atomic():
+                    SubscriptionHistory.archive(
+                        subscription, SubscriptionHistory.EXPIRED
+                    )
+                    subscription.delete()
+                print(f"{subscription} was successfully deleted.")
+                subscription.customer.delete_from_private_group()
+                digest.add(
+                    "Must be deleted from the group",
+                    f"@{telegram_username}, {subscription_plan} for {subscription_price} USDT, "
+                    f"expired on {subscription_end_date}, "
+                    f"hash: https://tronscan.org/#/transaction/{tx_hash}",
+                )
+            except Exception as e:
+                print(f"Failed to delete subscription {subscription}: {str(e)}")
+                digest.add("Failed to delete", f"@{telegram_username}: {str(e)}")
+            continue
+
+        # The subscription is deleted once at least one admin was told
+        notified = False
         for admin in admins_of_group:
             try:
                 message = TelegramMessageSender.create_message_about_delete_user(
@@ -64,318 +105,232 @@ def delete_expired_subscriptions() -> None:
                 )
 
                 if response.status_code == 200:
-                    subscription.delete()
-                    print(f"{subscription} was successfully deleted.")
-                    subscription.customer.delete_from_private_group()
-                    print(
-                        f"User {subscription.customer.telegram_username} must be deleted from the group."
-                    )
+                    notified = True
                 else:
-                    print(f"{subscription} was not deleted.")
                     print(
-                        f"Failed to delete user {subscription.customer.telegram_username} from the group. Status code: {response.status_code}"
+                        f"Failed to tell {admin.telegram_username} to delete user "
+                        f"{telegram_username} from the group. "
+                        f"Status code: {response.status_code}"
                     )
             except Exception as e:
                 print(
-                    f"Failed to delete user {subscription.customer.telegram_username} from the group: {str(e)}"
+                    f"Failed to tell {admin.telegram_username} to delete user "
+                    f"{telegram_username} from the group: {str(e)}"
                 )
 
-
-@shared_task
-def notify_about_expiring_subscriptions_1_day() -> None:
+        if not notified:
+            print(f"{subscription} was not deleted.")
+            continue
+        try:
+            with transaction.atomic():
+                SubscriptionHistory.archive(subscription, SubscriptionHistory.EXPIRED)
+                subscription.delete()
+            print(f"{subscription} was successfully deleted.")
+            subscription.customer.delete_from_private_group()
+            print(f"User {telegram_username} must be deleted from the group.")
+        except Exception as e:
+            print(f"Failed to delete subscription {subscription}: {str(e)}")
+
+    # Reminders of deleted subscriptions won't be sent again, drop them
+    SentReminder.objects.exclude(
+        transaction_hash__in=Subscription.objects.values("transaction_hash")
+    ).delete()
+
+    digest.send(admins_of_group)
+
+
+def notify_about_expiring_subscriptions(
+    day: int, syntax_word: str, photo_name: str
+) -> None:
     # Get the admins
-    try:
-        admins_of_group = TelegramUser.objects.filter(is_staff=True)
-        print("Found users:", admins_of_group)
-    except TelegramUser.DoesNotExist:
-        print("Users not found.")
+    admins_of_group = get_admins()
+    print("Found users:", admins_of_group)
+
+    planner = ReminderPlanner(day=day, syntax_word=syntax_word, photo_name=photo_name)
+    subscriptions = list(planner.get_subscriptions())
+    print(f"Found {len(subscriptions)} subscriptions ending in {day} {syntax_word}.")
+
+    # Firstly, remind every user exactly once. The ledger is written after
+    # every chunk, so a crashed or repeated run resumes where it stopped.
+    outcomes = {}
+    chunk_size = settings.REMINDER_CHUNK_SIZE
+    for start in range(0, len(subscriptions), chunk_size):
+        end = start + chunk_size
+        chunk = subscriptions[start:end]
+        results = deliver_messages(planner.plan_reminders(chunk))
+        chunk_outcomes = planner.get_outcomes(chunk, results)
+        planner.record_sent(chunk_outcomes)
+        outcomes.update(chunk_outcomes)
+    print(
+        f"Reminders sent to {sum(outcomes.values())} of {len(outcomes)} users "
+        f"expiring in {day} {syntax_word}."
+    )
+
+    # Secondly, notify admins of group about it
+    deliver_messages(planner.plan_admin_notifications(admins_of_group, outcomes))
 
-    try:
-        subscriptions = Subscription.objects.filter(
-            end_date__gte=timezone.now() + timedelta(days=1)
-        ).select_related("customer", "plan")
-        print(f"Found subscriptions ending after 1 day: {subscriptions}")
-    except Subscription.DoesNotExist:
-        print("Subscriptions ending after 1 day not found.")
 
-    moscow_tz = pytz.timezone("Europe/Moscow")
-
-    for subscription in subscriptions:
-        telegram_username = subscription.customer.telegram_username
-        chat_id = subscription.customer.chat_id
-        subscription_start_date = subscription.start_date.astimezone(
-            moscow_tz
-        ).strftime("%d/%m/%Y %H:%M:%S")
-        subscription_end_date = subscription.end_date.astimezone(moscow_tz).strftime(
-            "%d/%m/%Y %H:%M:%S"
-        )
-        subscription_plan = subscription.plan.period
-        subscription_price = subscription.plan.price
-
-        for admin in admins_of_group:
-            try:
-                # Firstly, send a text reminder to user
-                message_about_reminder = (
-                    TelegramMessageSender.create_message_about_reminder(
-                        telegram_username=telegram_username,
-                        day=1,
-                        syntax_word="день",
-                    )
-                )
-
-                # Secondly, send subscription data
-                message_with_subscription_data = (
-                    TelegramMessageSender.create_message_with_subscription_data(
-                        telegram_username=telegram_username,
-                        subscription_plan=subscription_plan,
-                        subscription_start_date=subscription_start_date,
-                        subscription_end_date=subscription_end_date,
-                        subscription_price=subscription_price,
-                    )
-                )
-
-                response_message_about_reminder = (
-                    TelegramMessageSender.send_message_with_photo_to_chat(
-                        message=message_about_reminder,
-                        photo_path=os.path.join(
-                            settings.MEDIA_ROOT,
-                            "1-day.jpg",
-                        ),
-                        chat_id=chat_id,
-                    )
-                )
-
-                response_message_with_subscription_data = (
-                    TelegramMessageSender.send_message_to_chat(
-                        message=message_with_subscription_data, chat_id=chat_id
-                    )
-                )
-
-                if (
-                    response_message_about_reminder.status_code == 200
-                    and response_message_with_subscription_data.status_code == 200
-                ):
-                    print(f"Reminder sent to user {telegram_username}.")
-
-                    # Secondly, notify about it admins of group
-                    message = (
-                        f"Hi, {admin.telegram_username}!\n\n"
-                        f"A reminder about extending the subscription was successfully sent to @{telegram_username}\n\n"
-                    )
-
-                    response = TelegramMessageSender.send_message_to_chat(
-                        message=message, chat_id=admin.chat_id
-                    )
-
-                    if response.status_code == 200:
-                        print("Log message was successfully sent to admin")
-                    else:
-                        print(
-                            f"Failed to sent log message to admin. Status code: {response.status_code}"
-                        )
-                else:
-                    print(
-                        f"Failed to send reminder to user {telegram_username}. Status code: {response.status_code}"
-                    )
-            except Exception as e:
-                print(f"Failed to send reminder to user {telegram_username}: {str(e)}")
+@shared_task
+def notify_about_expiring_subscriptions_1_day() -> None:
+    notify_about_expiring_subscriptions(
+        day=1, syntax_word="день", photo_name="1-day.jpg"
+    )
 
 
 @shared_task
 def notify_about_expiring_subscriptions_3_days() -> None:
-    # Get the admins
-    try:
-        admins_of_group = TelegramUser.objects.filter(is_staff=True)
-        print("Found users:", admins_of_group)
-    except TelegramUser.DoesNotExist:
-        print("Users not found.")
-
-    try:
-        subscriptions = Subscription.objects.filter(
-            end_date__gte=timezone.now() + timedelta(days=3)
-        ).select_related("customer", "plan")
-        print(f"Found subscriptions ending after 3 days: {subscriptions}")
-    except Subscription.DoesNotExist:
-        print("Subscriptions ending after 3 days not found.")
-
-    moscow_tz = pytz.timezone("Europe/Moscow")
-
-    for subscription in subscriptions:
-        telegram_username = subscription.customer.telegram_username
-        chat_id = subscription.customer.chat_id
-        subscription_start_date = subscription.start_date.astimezone(
-            moscow_tz
-        ).strftime("%d/%m/%Y %H:%M:%S")
-        subscription_end_date = subscription.end_date.astimezone(moscow_tz).strftime(
-            "%d/%m/%Y %H:%M:%S"
-        )
-        subscription_plan = subscription.plan.period
-        subscription_price = subscription.plan.price
-
-        for admin in admins_of_group:
-            try:
-                # Firstly, send a text reminder to user
-                message_about_reminder = (
-                    TelegramMessageSender.create_message_about_reminder(
-                        telegram_username=telegram_username,
-                        day=3,
-                        syntax_word="дня",
-                    )
-                )
-
-                # Secondly, send subscription data
-                message_with_subscription_data = (
-                    TelegramMessageSender.create_message_with_subscription_data(
-                        telegram_username=telegram_username,
-                        subscription_plan=subscription_plan,
-                        subscription_start_date=subscription_start_date,
-                        subscription_end_date=subscription_end_date,
-                        subscription_price=subscription_price,
-                    )
-                )
-
-                response_message_about_reminder = (
-                    TelegramMessageSender.send_message_with_photo_to_chat(
-                        message=message_about_reminder,
-                        photo_path=os.path.join(
-                            settings.MEDIA_ROOT,
-                            "3-days.jpg",
-                        ),
-                        chat_id=chat_id,
-                    )
-                )
-
-                response_message_with_subscription_data = (
-                    TelegramMessageSender.send_message_to_chat(
-                        message=message_with_subscription_data, chat_id=chat_id
-                    )
-                )
-
-                if (
-                    response_message_about_reminder.status_code == 200
-                    and response_message_with_subscription_data.status_code == 200
-                ):
-                    print(f"Reminder sent to user {telegram_username}.")
-
-                    # Secondly, notify about it admins of group
-                    message = (
-                        f"Hi, {admin.telegram_username}!\n\n"
-                        f"A reminder about extending the subscription was successfully sent to @{telegram_username}\n\n"
-                    )
-
-                    response = TelegramMessageSender.send_message_to_chat(
-                        message=message, chat_id=admin.chat_id
-                    )
-
-                    if response.status_code == 200:
-                        print("Log message was successfully sent to admin")
-                    else:
-                        print(
-                            f"Failed to sent log message to admin. Status code: {response.status_code}"
-                        )
-                else:
-                    print(
-                        f"Failed to send reminder to user {telegram_username}. Status code: {response.status_code}"
-                    )
-            except Exception as e:
-                print(f"Failed to send reminder to user {telegram_username}: {str(e)}")
+    notify_about_expiring_subscriptions(
+        day=3, syntax_word="дня", photo_name="3-days.jpg"
+    )
 
 
 @shared_task
 def notify_about_expiring_subscriptions_7_days() -> None:
-    # Get the admins
-    try:
-        admins_of_group = TelegramUser.objects.filter(is_staff=True)
-        print("Found users:", admins_of_group)
-    except TelegramUser.DoesNotExist:
-        print("Users not found.")
+    notify_about_expiring_subscriptions(
+        day=7, syntax_word="дней", photo_name="7-days.jpg"
+    )
 
-    try:
-        subscriptions = Subscription.objects.filter(
-            end_date__gte=timezone.now() + timedelta(days=7)
-        ).select_related("customer", "plan")
-        print(f"Found subscriptions ending after 7 days: {subscriptions}")
-    except Subscription.DoesNotExist:
-        print("Subscriptions ending after 7 days not found.")
-
-    moscow_tz = pytz.timezone("Europe/Moscow")
 
-    for subscription in subscriptions:
-        telegram_username = subscription.customer.telegram_username
-        chat_id = subscription.customer.chat_id
-        subscription_start_date = subscription.start_date.astimezone(
-            moscow_tz
-        ).strftime("%d/%m/%Y %H:%M:%S")
-        subscription_end_date = subscription.end_date.astimezone(moscow_tz).strftime(
-            "%d/%m/%Y %H:%M:%S"
+@shared_task
+def send_outbox_messages() -> None:
+    # Drains the notification outbox batch by batch. A batch is claimed in a
+    # short transaction and sent with no transaction or row lock held, see
+    # claim_outbox_messages. Each message's outcome is saved on its own.
+    while True:
+        batch = claim_outbox_messages()
+        if not batch:
+            return
+
+        results = deliver_messages(
+            OutboundMessage(
+                chat_id=outbox_message.chat_id,
+                text=outbox_message.text,
+                photo_path=outbox_message.photo_path,
+            )
+            for outbox_message in batch
         )
-        subscription_plan = subscription.plan.period
-        subscription_price = subscription.plan.price
-
-        for admin in admins_of_group:
-            try:
-                # Firstly, send a text reminder to user
-                message_about_reminder = (
-                    TelegramMessageSender.create_message_about_reminder(
-                        telegram_username=telegram_username,
-                        day=7,
-                        syntax_word="дней",
-                    )
-                )
-
-                # Secondly, send subscription data
-                message_with_subscription_data = (
-                    TelegramMessageSender.create_message_with_subscription_data(
-                        telegram_username=telegram_username,
-                        subscription_plan=subscription_plan,
-                        subscription_start_date=subscription_start_date,
-                        subscription_end_date=subscription_end_date,
-                        subscription_price=subscription_price,
-                    )
-                )
+        for outbox_message, result in zip(batch, results):
+            record_outbox_result(outbox_message, result)
+        print(f"Outbox: processed {len(batch)} messages.")
+
+
+def claim_outbox_messages() -> list:
+    # Rows are locked with SKIP LOCKED only while they are leased: their
+    # next attempt moves OUTBOX_LEASE_TIMEOUT ahead, so no other worker takes
+    # them while they are being sent. Should this worker die, they become
+    # due again once the lease runs out.
+    with transaction.atomic():
+        batch = list(
+            OutboxMessage.objects.due().select_for_update(skip_locked=True)[
+                : settings.OUTBOX_BATCH_SIZE
+            ]
+        )
+        leased_until = timezone.now() + timedelta(seconds=settings.OUTBOX_LEASE_TIMEOUT)
+        for outbox_message in batch:
+            outbox_message.attempts += 1
+            outbox_message.next_attempt_at = leased_until
+        OutboxMessage.objects.bulk_update(batch, ["attempts", "next_attempt_at"])
+    return batch
+
+
+def record_outbox_result(outbox_message: OutboxMessage, result: DeliveryResult) -> None:
+    now = timezone.now()
+    if result.ok:
+        outbox_message.status = OutboxMessage.SENT
+        outbox_message.sent_at = now
+        outbox_message.last_error = None
+    else:
+        outbox_message.last_error = result.error
+        # Telegram refuses a 4xx request for good (blocked bot, wrong chat),
+        # retrying it won't help. 429 is already retried by the delivery
+        # engine, so a leftover one is retried later.
+        permanent = (
+            result.status_code is not None
+            and 400 <= result.status_code < 500
+            and result.status_code != 429
+        )
+        if permanent or outbox_message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            outbox_message.status = OutboxMessage.FAILED
+            print(f"Outbox message {outbox_message.pk} failed: {result.error}")
+        else:
+            delay = settings.OUTBOX_RETRY_BACKOFF * 2 ** (outbox_message.attempts - 1)
+            outbox_message.next_attempt_at = now + timedelta(seconds=delay)
+
+    # Unless the lease ran out and another worker claimed the message since
+    OutboxMessage.objects.filter(
+        pk=outbox_message.pk, attempts=outbox_message.attempts
+    ).update(
+        status=outbox_message.status,
+        last_error=outbox_message.last_error,
+        next_attempt_at=outbox_message.next_attempt_at,
+        sent_at=outbox_message.sent_at,
+    )
+
+
+def claim_payment_verification(verification_id: str):
+    # A pending verification is leased to one worker, so a duplicated task
+    # doesn't check the payment twice. The row is locked only while the lease
+    # is taken, should the worker die the lease runs out and a retry takes
+    # over. None when the verification isn't pending or is leased.
+    now = timezone.now()
+    with transaction.atomic():
+        verification = (
+            PaymentVerification.objects.select_for_update()
+            .select_related("customer", "plan")
+            .filter(Q(leased_until__isnull=True) | Q(leased_until__lte=now))
+            .filter(pk=verification_id, status=PaymentVerification.PENDING)
+            .first()
+        )
+        if verification is None:
+            return None
+        verification.leased_until = now + timedelta(
+            seconds=settings.PAYMENT_VERIFICATION_LEASE_TIMEOUT
+        )
+        verification.save(update_fields=["leased_until", "updated_at"])
+    return verification
 
-                response_message_about_reminder = (
-                    TelegramMessageSender.send_message_with_photo_to_chat(
-                        message=message_about_reminder,
-                        photo_path=os.path.join(
-                            settings.MEDIA_ROOT,
-                            "7-days.jpg",
-                        ),
-                        chat_id=chat_id,
-                    )
-                )
 
-                response_message_with_subscription_data = (
-                    TelegramMessageSender.send_message_to_chat(
-                        message=message_with_subscription_data, chat_id=chat_id
-                    )
-                )
+@shared_task(bind=True)
+def verify_payment(self, verification_id: str) -> None:
+    verification = claim_payment_verification(verification_id)
+    if verification is None:
+        print(f"Payment verification {verification_id} is not pending or is leased.")
+        return
 
-                if (
-                    response_message_about_reminder.status_code == 200
-                    and response_message_with_subscription_data.status_code == 200
-                ):
-                    print(f"Reminder sent to user {telegram_username}.")
+    try:
+        # TronGrid is asked with no transaction open and no row locked
+        valid = TronTransactionAnalyzer.validate_tx_hash(
+            tx_hash=verification.transaction_hash, plan_price=verification.plan.price
+        )
+    except CircuitOpenError as e:
+        # TronGrid is down or didn't answer, try again once it may be back
+        leased = PaymentVerification.objects.filter(
+            pk=verification.pk, leased_until=verification.leased_until
+        )
+        if self.request.retries >= settings.PAYMENT_VERIFICATION_MAX_RETRIES:
+            leased.update(
+                status=PaymentVerification.FAILED,
+                message="Transaction could not be verified, please try again later",
+                leased_until=None,
+                updated_at=timezone.now(),
+            )
+            return
+        leased.update(leased_until=None)
+        raise self.retry(
+            exc=e,
+            countdown=max(1, math.ceil(e.retry_after)),
+            max_retries=settings.PAYMENT_VERIFICATION_MAX_RETRIES,
+        )
 
-                    # Secondly, notify about it admins of group
-                    message = (
-                        f"Hi, {admin.telegram_username}!\n\n"
-                        f"A reminder about extending the subscription was successfully sent to @{telegram_username}\n\n"
-                    )
+    if complete_payment_verification(verification, valid):
+        print(f"Payment verification {verification_id}: {verification.status}")
 
-                    response = TelegramMessageSender.send_message_to_chat(
-                        message=message, chat_id=admin.chat_id
-                    )
 
-                    if response.status_code == 200:
-                        print("Log message was successfully sent to admin")
-                    else:
-                        print(
-                            f"Failed to sent log message to admin. Status code: {response.status_code}"
-                        )
-                else:
-                    print(
-                        f"Failed to send reminder to user {telegram_username}. Status code: {response.status_code}"
-                    )
-            except Exception as e:
-                print(f"Failed to send reminder to user {telegram_username}: {str(e)}")
+@shared_task
+def ingest_incoming_transfers() -> None:
+    try:
+        ingested = TronTransferIngester.ingest()
+    except Exception as e:
+        print(f"Failed to ingest incoming transfers: {str(e)}")
+        return
+    print(f"Ingested {ingested} incoming transfers.")
@@ -1,10 +1,47 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import SubscriptionAPIView, TelegramUserAPIView
+from .async_views import AsyncSubscriptionAPIView, AsyncTelegramUserAPIView
+from .views import (
+    PaymentVerificationAPIView,
+    SubscriptionAPIView,
+    SubscriptionListAPIView,
+    SubscriptionStatusAPIView,
+    TelegramUserAPIView,
+    TelegramUserBulkAPIView,
+)
+
+# Under an ASGI server the user and subscription endpoints can run as
+# coroutines, see ASYNC_VIEWS
+if settings.ASYNC_VIEWS:
+    TelegramUserView, SubscriptionView = (
+        AsyncTelegramUserAPIView,
+        AsyncSubscriptionAPIView,
+    )
+else:
+    TelegramUserView, SubscriptionView = TelegramUserAPIView, SubscriptionAPIView
 
 urlpatterns = [
-    path("v1/users/", TelegramUserAPIView.as_view(), name="create-telegram-user"),
+    path("v1/users/", TelegramUserView.as_view(), name="create-telegram-user"),
+    path(
+        "v1/users/bulk/",
+        TelegramUserBulkAPIView.as_view(),
+        name="register-telegram-users",
+    ),
+    path("v1/subscriptions/", SubscriptionView.as_view(), name="manage-subscription"),
+    path(
+        "v1/subscriptions/all/",
+        SubscriptionListAPIView.as_view(),
+        name="list-subscriptions",
+    ),
+    path(
+        "v1/subscriptions/statuses/",
+        SubscriptionStatusAPIView.as_view(),
+        name="subscription-statuses",
+    ),
     path(
-        "v1/subscriptions/", SubscriptionAPIView.as_view(), name="manage-subscription"
+        "v1/subscriptions/verifications/<uuid:job_id>/",
+        PaymentVerificationAPIView.as_view(),
+        name="payment-verification",
     ),
 ]
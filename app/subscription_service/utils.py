@@ -1,16 +1,60 @@
+import functools
+import hashlib
+import json
+import math
 import os
+import random
+import re
+import threading
+import time
 from datetime import datetime
-from typing import Union
+from typing import Optional, Union
+from urllib.parse import urlsplit
 
 import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django_redis import get_redis_connection
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 
-from .models import TelegramUser
+from .models import IncomingTransfer, TelegramFile, TelegramUser
+
+
+class CircuitOpenError(Exception):
+    # Raised instead of calling an upstream whose circuit breaker is open
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} is unavailable, retry in {retry_after}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class QuotaExceededError(CircuitOpenError):
+    # Raised instead of calling an upstream when our own quota for it is used
+    # up, so callers can tell it apart from the upstream being down
+    pass
+
+
+class UpstreamUnavailableError(CircuitOpenError):
+    # Raised when the upstream was asked but gave no usable answer, a network
+    # error or a 5xx/429 from every host. Like an open circuit, it says
+    # nothing about the request itself and asking again later may work.
+    pass
 
 
 class TronTransactionAnalyzer:
     API_ENDPOINT = os.environ.get("API_ENDPOINT")
     API_KEY = os.environ.get("API_KEY")
     STAS_TRC20_WALLET_ADDRESS = os.environ.get("STAS_TRC20_WALLET_ADDRESS")
+    TRANSACTION_CACHE_KEY = "tron_transaction:{tx_hash}"
+    TX_HASH_PATTERN = re.compile(r"[0-9a-fA-F]{64}")
+
+    @classmethod
+    def is_well_formed_tx_hash(cls, tx_hash) -> bool:
+        # Tron transaction ids are 32 bytes in hex, anything else can't be a
+        # payment and isn't worth a TronGrid call
+        return isinstance(tx_hash, str) and bool(cls.TX_HASH_PATTERN.fullmatch(tx_hash))
 
     @staticmethod
     def convert_string_to_trc20(amount_str: str, decimals: int) -> int:
@@ -41,79 +85,1346 @@ class TronTransactionAnalyzer:
             print("The date of transaction is not today.")
             return False
 
+    @classmethod
+    def get_cache_key(cls, tx_hash: str) -> str:
+        return cls.TRANSACTION_CACHE_KEY.format(tx_hash=tx_hash)
+
+    @staticmethod
+    def parse_transaction_facts(tx_hash: str, response) -> tuple:
+        # Returns the facts of a transaction that decide whether it pays for a
+        # plan, {"found": False} when TronGrid has no usable answer, and how
+        # long they may be cached: a confirmed transaction never changes, a
+        # missing or unconfirmed one may show up any moment.
+        if response.status_code != 200:
+            print(f"Error: {response.status_code}")
+            return {"found": False}, settings.TRON_NEGATIVE_CACHE_TTL
+
+        try:
+            valid_data = response.json()
+            facts = {
+                "found": True,
+                "timestamp": valid_data["timestamp"],
+                "transfers": [
+                    {
+                        "to_address": transfer_info["to_address"],
+                        "amount_str": transfer_info["amount_str"],
+                        "decimals": transfer_info["decimals"],
+                    }
+                    for transfer_info in valid_data["trc20TransferInfo"]
+                ],
+            }
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Unexpected transaction data for {tx_hash}: {e}")
+            return {"found": False}, settings.TRON_NEGATIVE_CACHE_TTL
+
+        if valid_data.get("confirmed", True):
+            return facts, settings.TRON_TRANSACTION_CACHE_TTL
+        return facts, settings.TRON_NEGATIVE_CACHE_TTL
+
+    @classmethod
+    def get_indexed_transaction_facts(cls, tx_hash: str) -> Optional[dict]:
+        return cls.get_transfer_facts(
+            IncomingTransfer.objects.filter(transaction_hash=tx_hash).first()
+        )
+
+    @staticmethod
+    def get_transfer_facts(transfer: Optional[IncomingTransfer]) -> Optional[dict]:
+        if transfer is None:
+            return None
+        return {
+            "found": True,
+            "timestamp": transfer.timestamp,
+            "transfers": [
+                {
+                    "to_address": transfer.to_address,
+                    "amount_str": transfer.amount_str,
+                    "decimals": transfer.decimals,
+                }
+            ],
+        }
+
+    @classmethod
+    def get_known_transaction_facts(cls, tx_hash: str) -> Optional[dict]:
+        # Transfers to our wallet are usually in the local index already.
+        # Otherwise bots often retry the same hash, so repeated lookups are
+        # answered from Redis instead of costing a TronGrid call and API quota
+        facts = cls.get_indexed_transaction_facts(tx_hash)
+        if facts is None:
+            facts = cache.get(cls.get_cache_key(tx_hash))
+        return facts
+
+    @classmethod
+    def get_transaction_facts(cls, tx_hash: str) -> Optional[dict]:
+        facts = cls.get_known_transaction_facts(tx_hash)
+        if facts is None:
+            # A double-tapped "paid" button submits the same payment several
+            # times at once, they share one TronGrid call. Only the lookup is
+            # shared, the price and the user are checked by every caller.
+            facts = Singleflight("tron_transaction").do(
+                tx_hash, lambda: cls.fetch_and_cache_transaction_facts(tx_hash)
+            )
+        return facts if facts["found"] else None
+
+    @classmethod
+    def fetch_and_cache_transaction_facts(cls, tx_hash: str) -> dict:
+        try:
+            response = TronProviderPool.get_transaction(tx_hash)
+        except requests.RequestException as e:
+            raise cls.lookup_failed(e) from e
+        return cls.cache_transaction_facts(tx_hash, response)
+
+    @staticmethod
+    def lookup_failed(reason) -> UpstreamUnavailableError:
+        print(f"TronGrid lookup failed: {reason}")
+        return UpstreamUnavailableError(
+            TronHTTPClient.UPSTREAM, settings.HTTP_RETRY_MAX_BACKOFF
+        )
+
+    @classmethod
+    def cache_transaction_facts(cls, tx_hash: str, response) -> dict:
+        # A 5xx or 429 left over after every provider was asked is no answer
+        # about the transaction, it isn't cached as "not found"
+        if response.status_code >= 500 or response.status_code == 429:
+            raise cls.lookup_failed(f"status {response.status_code}")
+        facts, timeout = cls.parse_transaction_facts(tx_hash, response)
+        cache.set(cls.get_cache_key(tx_hash), facts, timeout)
+        return facts
+
     @classmethod
     def validate_tx_hash(cls, tx_hash: str, plan_price: int) -> bool:
-        # is_valid = False
-        url = f"{cls.API_ENDPOINT}={tx_hash}"
+        try:
+            return cls.check_transaction_facts(
+                tx_hash, cls.get_transaction_facts(tx_hash), plan_price
+            )
+        except CircuitOpenError:
+            # Let the caller tell "can't check now" apart from "not valid",
+            # this includes TronGrid failing to answer
+            raise
+        except Exception as e:
+            print(f"Error occurred: {e}")
+            return False
+
+    @classmethod
+    def check_transaction_facts(
+        cls, tx_hash: str, facts: Optional[dict], plan_price: int
+    ) -> bool:
+        if facts is None:
+            return False
+
+        transaction_date = TronTransactionAnalyzer.convert_timestamp_to_date_format(
+            facts["timestamp"]
+        )
+        if TronTransactionAnalyzer.check_transaction_was_today(
+            transaction_date=transaction_date
+        ):
+            for transfer_info in facts["transfers"]:
+                if transfer_info["to_address"] != cls.STAS_TRC20_WALLET_ADDRESS:
+                    print(
+                        f"Stanislav Ivankin {cls.STAS_TRC20_WALLET_ADDRESS} didn't get your USDT!",
+                        False,
+                    )
+                    return False
+                else:
+                    amount_usdt = cls.convert_string_to_trc20(
+                        transfer_info["amount_str"], transfer_info["decimals"]
+                    )
+                    result = {
+                        "tx_hash": tx_hash,
+                        "to_address": transfer_info["to_address"],
+                        "amount_usdt": amount_usdt,
+                        "subscription_price": plan_price,
+                    }
+                    if amount_usdt >= plan_price:
+                        print(result, True)
+                        return True
+                    else:
+                        print(result, False)
+                        return False
+        else:
+            print(False)
+            return False
+
+
+class TronTransferIngester:
+    # Pages through confirmed TRC-20 transfers to our wallet on TronGrid,
+    # oldest first, and stores them in the IncomingTransfer index. The newest
+    # stored block time is the high-water mark the next run starts from.
+
+    @staticmethod
+    def get_high_water_mark() -> int:
+        return (
+            IncomingTransfer.objects.aggregate(Max("timestamp"))["timestamp__max"] or 0
+        )
+
+    @staticmethod
+    def build_url(provider: dict) -> str:
+        address = TronTransactionAnalyzer.STAS_TRC20_WALLET_ADDRESS
+        return TronProviderPool.get_api_url(
+            provider, f"/v1/accounts/{address}/transactions/trc20"
+        )
+
+    @staticmethod
+    def parse_transfer(transfer: dict) -> IncomingTransfer:
+        return IncomingTransfer(
+            transaction_hash=transfer["transaction_id"],
+            from_address=transfer["from"],
+            to_address=transfer["to"],
+            token_address=transfer["token_info"]["address"],
+            amount_str=transfer["value"],
+            decimals=transfer["token_info"]["decimals"],
+            timestamp=transfer["block_timestamp"],
+        )
+
+    @classmethod
+    def fetch_page(cls, min_timestamp: int, fingerprint: Optional[str] = None) -> dict:
+        params = {
+            "only_to": "true",
+            "only_confirmed": "true",
+            "contract_address": settings.TRON_USDT_CONTRACT_ADDRESS,
+            "order_by": "block_timestamp,asc",
+            "min_timestamp": min_timestamp,
+            "limit": settings.TRON_INGEST_PAGE_SIZE,
+        }
+        if fingerprint:
+            params["fingerprint"] = fingerprint
+
+        # Pages count against the same key quotas and breakers as lookups
+        response = TronProviderPool.get(cls.build_url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    @classmethod
+    def ingest(cls) -> int:
+        # Transfers at the high-water mark itself are fetched again and
+        # skipped as already known
+        min_timestamp = cls.get_high_water_mark()
+        fingerprint = None
+        ingested = 0
+
+        for page in range(settings.TRON_INGEST_MAX_PAGES):
+            data = cls.fetch_page(min_timestamp, fingerprint)
+            transfers = [
+                cls.parse_transfer(transfer)
+                for transfer in data.get("data", [])
+                if transfer["to"] == TronTransactionAnalyzer.STAS_TRC20_WALLET_ADDRESS
+            ]
+            known = set(
+                IncomingTransfer.objects.filter(
+                    transaction_hash__in=[t.transaction_hash for t in transfers]
+                ).values_list("transaction_hash", flat=True)
+            )
+            transfers = [t for t in transfers if t.transaction_hash not in known]
+            # A concurrent run may still insert the same transfers
+            IncomingTransfer.objects.bulk_create(transfers, ignore_conflicts=True)
+            ingested += len(transfers)
+
+            fingerprint = data.get("meta", {}).get("fingerprint")
+            if not fingerprint:
+                break
+        return ingested
+
+
+class SlidingWindowThrottle:
+    # Allows `limit` hits per key within any `window` seconds. Hits are kept
+    # in a Redis sorted set scored by Redis time, shared by every worker.
+    KEY = "throttle:{name}:{key}"
+
+    HIT_SCRIPT = """
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local window = tonumber(ARGV[1])
+    local limit = tonumber(ARGV[2])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+    if redis.call('ZCARD', KEYS[1]) < limit then
+        redis.call('ZADD', KEYS[1], now, ARGV[3])
+        redis.call('PEXPIRE', KEYS[1], math.ceil(window * 1000))
+        return '0'
+    end
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return tostring(tonumber(oldest[2]) + window - now)
+    """
+
+    def __init__(self, name: str, limit: int, window: float):
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def hit(self, key: str) -> float:
+        # Returns 0 when the hit is allowed, otherwise seconds until it would be
+        retry_after = get_redis_connection("default").eval(
+            self.HIT_SCRIPT,
+            1,
+            self.KEY.format(name=self.name, key=key),
+            self.window,
+            self.limit,
+            os.urandom(8).hex(),
+        )
+        return max(0.0, float(retry_after))
+
+
+class RetryPolicy:
+    # Bounded exponential backoff with full jitter, so workers retrying a
+    # recovering upstream don't hit it at the same moment. Only idempotent
+    # calls (lookups) are retried after the upstream got the request, a
+    # Telegram send that failed with a 5xx or a read timeout may have been
+    # delivered and is not sent twice.
+    RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+    def __init__(
+        self,
+        attempts: Optional[int] = None,
+        backoff: Optional[float] = None,
+        max_backoff: Optional[float] = None,
+    ):
+        self.attempts = attempts or settings.HTTP_RETRY_ATTEMPTS
+        self.backoff = backoff if backoff is not None else settings.HTTP_RETRY_BACKOFF
+        self.max_backoff = (
+            max_backoff if max_backoff is not None else settings.HTTP_RETRY_MAX_BACKOFF
+        )
+
+    def get_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def is_retryable_status(self, status_code: int, idempotent: bool) -> bool:
+        return idempotent and status_code in self.RETRY_STATUS_CODES
+
+    @staticmethod
+    def is_retryable_exception(exception: Exception, idempotent: bool) -> bool:
+        if idempotent:
+            return isinstance(exception, (requests.ConnectionError, requests.Timeout))
+        return RetryPolicy.is_connect_error(exception)
+
+    @staticmethod
+    def is_connect_error(exception: Exception) -> bool:
+        # The connection was never made, so the upstream never saw the request
+        if isinstance(exception, requests.ConnectTimeout):
+            return True
+        if not isinstance(exception, requests.ConnectionError) or not exception.args:
+            return False
+        reason = exception.args[0]
+        if isinstance(reason, MaxRetryError):
+            reason = reason.reason
+        return isinstance(reason, NewConnectionError)
+
+
+class CircuitBreaker:
+    # Per-upstream breaker kept in Redis, so once one worker sees TronGrid or
+    # Telegram failing every process fails fast instead of waiting on it.
+    # Closed: calls within the window are counted, the breaker trips when at
+    # least FAILURE_THRESHOLD of them failed and they make FAILURE_RATIO of
+    # all calls. Open: no calls until the reset timeout passes. Half open: a
+    # single probe decides which way to go.
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    REQUESTS_KEY = "circuit:{name}:requests"
+    FAILURES_KEY = "circuit:{name}:failures"
+    OPEN_KEY = "circuit:{name}:open"
+    TRIPPED_KEY = "circuit:{name}:tripped"
+    PROBE_KEY = "circuit:{name}:probe"
+    TRANSITIONS_KEY = "circuit:{name}:transitions"
+
+    # Closes the breaker only from half open: the reset timeout has passed and
+    # ARGV[1] is the probe lock this breaker took
+    CLOSE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return 0
+    end
+    if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+        return 0
+    end
+    redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5])
+    return 1
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.probe_token = None
+
+    def get_redis(self):
+        return get_redis_connection("default")
+
+    def key(self, template: str) -> str:
+        return template.format(name=self.name)
+
+    def get_state(self) -> str:
+        pipeline = self.get_redis().pipeline()
+        pipeline.exists(self.key(self.OPEN_KEY))
+        pipeline.exists(self.key(self.TRIPPED_KEY))
+        is_open, is_tripped = pipeline.execute()
+        if is_open:
+            return self.OPEN
+        if is_tripped:
+            return self.HALF_OPEN
+        return self.CLOSED
+
+    def get_retry_after(self) -> float:
+        return max(0, self.get_redis().pttl(self.key(self.OPEN_KEY))) / 1000
+
+    def allow_request(self) -> bool:
+        state = self.get_state()
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN:
+            return False
+
+        # Only the worker that takes the probe lock may try the upstream
+        probe_timeout = settings.CIRCUIT_BREAKER_RESET_TIMEOUT * 1000
+        token = os.urandom(8).hex()
+        if self.get_redis().set(
+            self.key(self.PROBE_KEY), token, nx=True, px=probe_timeout
+        ):
+            self.probe_token = token
+            self.record_transition(self.OPEN, self.HALF_OPEN)
+            return True
+        return False
+
+    def count(self, failed: bool, amount: int = 1) -> tuple:
+        # Returns (requests, failures) in the current window and whether the
+        # breaker had tripped before
+        window = settings.CIRCUIT_BREAKER_FAILURE_WINDOW
+        requests_key = self.key(self.REQUESTS_KEY)
+        failures_key = self.key(self.FAILURES_KEY)
+
+        pipeline = self.get_redis().pipeline()
+        pipeline.incrby(requests_key, amount)
+        if failed:
+            pipeline.incr(failures_key)
+        else:
+            pipeline.get(failures_key)
+        pipeline.exists(self.key(self.TRIPPED_KEY))
+        requests_count, failures, is_tripped = pipeline.execute()
+
+        if requests_count == amount:
+            self.get_redis().expire(requests_key, window)
+        if failed and failures == 1:
+            self.get_redis().expire(failures_key, window)
+        return requests_count, int(failures or 0), is_tripped
+
+    def record_success(self, amount: int = 1) -> None:
+        requests_count, failures, is_tripped = self.count(failed=False, amount=amount)
+        # A call that started before the breaker opened may still succeed,
+        # only the probe's success closes it
+        if not is_tripped or self.probe_token is None:
+            return
+        token, self.probe_token = self.probe_token, None
+        closed = self.get_redis().eval(
+            self.CLOSE_SCRIPT,
+            5,
+            self.key(self.OPEN_KEY),
+            self.key(self.PROBE_KEY),
+            self.key(self.TRIPPED_KEY),
+            self.key(self.REQUESTS_KEY),
+            self.key(self.FAILURES_KEY),
+            token,
+        )
+        if closed:
+            self.record_transition(self.HALF_OPEN, self.CLOSED)
+
+    def record_failure(self) -> None:
+        requests_count, failures, is_tripped = self.count(failed=True)
+        if not is_tripped and (
+            failures < settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD
+            or failures / requests_count < settings.CIRCUIT_BREAKER_FAILURE_RATIO
+        ):
+            return
+
+        redis = self.get_redis()
+        if redis.set(
+            self.key(self.OPEN_KEY),
+            1,
+            nx=True,
+            ex=settings.CIRCUIT_BREAKER_RESET_TIMEOUT,
+        ):
+            redis.set(self.key(self.TRIPPED_KEY), 1)
+            redis.delete(self.key(self.PROBE_KEY))
+            self.probe_token = None
+            self.record_transition(
+                self.HALF_OPEN if is_tripped else self.CLOSED, self.OPEN
+            )
+
+    def record_transition(self, from_state: str, to_state: str) -> None:
+        print(f"Circuit breaker {self.name}: {from_state} -> {to_state}")
+        self.get_redis().hincrby(self.key(self.TRANSITIONS_KEY), to_state, 1)
+
+    def get_transitions(self) -> dict:
+        transitions = self.get_redis().hgetall(self.key(self.TRANSITIONS_KEY))
+        return {
+            state: int(transitions.get(state.encode(), 0))
+            for state in (self.OPEN, self.HALF_OPEN, self.CLOSED)
+        }
+
+
+class ResilientHTTPClient:
+    # One keep-alive session per process, so consecutive calls reuse the
+    # TCP+TLS connection. The session is recreated after a fork (Celery
+    # prefork, gunicorn workers) as pooled sockets can't be shared. Every call
+    # gets a timeout, retries with jitter and goes through the upstream's
+    # circuit breaker. Subclasses name the upstream and the settings holding
+    # its connect and read timeouts.
+    UPSTREAM = None
+    TIMEOUT = None
+    _session = None
+    _session_pid = None
+
+    @classmethod
+    def get_adapter(cls) -> HTTPAdapter:
+        return HTTPAdapter()
+
+    @classmethod
+    def get_session(cls) -> requests.Session:
+        if cls._session is None or cls._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = cls.get_adapter()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            cls._session = session
+            cls._session_pid = os.getpid()
+        return cls._session
+
+    @classmethod
+    def get_timeout(cls) -> tuple:
+        return tuple(getattr(settings, name) for name in cls.TIMEOUT)
+
+    @classmethod
+    def get_circuit_breaker(cls) -> CircuitBreaker:
+        return CircuitBreaker(cls.UPSTREAM)
+
+    @classmethod
+    def request(
+        cls,
+        method: str,
+        url: str,
+        breaker: Optional[CircuitBreaker] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        idempotent: Optional[bool] = None,
+        **kwargs,
+    ) -> requests.Response:
+        # Callers spreading calls over several hosts of the upstream pass
+        # their own breaker per host and decide themselves about retrying.
+        # GETs are idempotent, a POST that only reads may say so.
+        kwargs.setdefault("timeout", cls.get_timeout())
+        breaker = breaker or cls.get_circuit_breaker()
+        policy = retry_policy or RetryPolicy()
+        if idempotent is None:
+            idempotent = method == "get"
+
+        for attempt in range(policy.attempts):
+            if not breaker.allow_request():
+                raise CircuitOpenError(breaker.name, breaker.get_retry_after())
+            for file in (kwargs.get("files") or {}).values():
+                file.seek(0)
+
+            last_attempt = attempt + 1 == policy.attempts
+            try:
+                response = getattr(cls.get_session(), method)(url=url, **kwargs)
+            except requests.RequestException as e:
+                breaker.record_failure()
+                if last_attempt or not policy.is_retryable_exception(e, idempotent):
+                    raise
+                print(f"{cls.UPSTREAM} request failed: {e}, retrying.")
+            else:
+                if response.status_code < 500:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if last_attempt or not policy.is_retryable_status(
+                    response.status_code, idempotent
+                ):
+                    return response
+                print(f"{cls.UPSTREAM} answered {response.status_code}, retrying.")
+            time.sleep(policy.get_delay(attempt))
+
+    @classmethod
+    def get(cls, url: str, **kwargs) -> requests.Response:
+        return cls.request("get", url, **kwargs)
+
+    @classmethod
+    def post(cls, url: str, **kwargs) -> requests.Response:
+        return cls.request("post", url, **kwargs)
+
+    @classmethod
+    def close(cls) -> None:
+        if cls._session is not None:
+            cls._session.close()
+        cls._session = None
+        cls._session_pid = None
+
+
+class TelegramHTTPClient(ResilientHTTPClient):
+    UPSTREAM = "telegram"
+    TIMEOUT = ("TELEGRAM_CONNECT_TIMEOUT", "TELEGRAM_READ_TIMEOUT")
+
+    @classmethod
+    def get_adapter(cls) -> HTTPAdapter:
+        return HTTPAdapter(
+            pool_connections=settings.TELEGRAM_POOL_CONNECTIONS,
+            pool_maxsize=settings.TELEGRAM_POOL_MAXSIZE,
+        )
+
+
+class TronHTTPClient(ResilientHTTPClient):
+    UPSTREAM = "trongrid"
+    TIMEOUT = ("TRON_CONNECT_TIMEOUT", "TRON_READ_TIMEOUT")
+
+
+class TronProviderPool:
+    # Spreads transaction lookups over every configured TronGrid endpoint and
+    # API key. A rolling latency and error rate per provider is kept in Redis
+    # for all workers, each lookup goes to the healthiest provider and fails
+    # over to the next one on connection errors, timeouts, 5xx and 429. A
+    # throttled provider rests until its Retry-After passes and every provider
+    # has its own circuit breaker.
+    STATS_KEY = "tron_provider:{name}:stats"
+    COOLDOWN_KEY = "tron_provider:{name}:cooldown"
+    # An error rate of 10% doubles a provider's effective latency
+    ERROR_PENALTY = 10
+
+    UPDATE_STATS_SCRIPT = """
+    local latency = tonumber(ARGV[1])
+    local failed = tonumber(ARGV[2])
+    local alpha = tonumber(ARGV[3])
+    local stats = redis.call('HMGET', KEYS[1], 'latency', 'error_rate')
+    local latency_ewma = tonumber(stats[1]) or latency
+    local error_ewma = tonumber(stats[2]) or failed
+    latency_ewma = latency_ewma + alpha * (latency - latency_ewma)
+    error_ewma = error_ewma + alpha * (failed - error_ewma)
+    redis.call('HSET', KEYS[1], 'latency', tostring(latency_ewma),
+        'error_rate', tostring(error_ewma))
+    redis.call('HINCRBY', KEYS[1], 'requests', 1)
+    redis.call('HINCRBY', KEYS[1], 'errors', failed)
+    return 1
+    """
+
+    @staticmethod
+    def get_redis():
+        return get_redis_connection("default")
+
+    @staticmethod
+    def get_providers() -> list:
+        configured = settings.TRON_PROVIDERS or [
+            {
+                "endpoint": TronTransactionAnalyzer.API_ENDPOINT,
+                "api_key": TronTransactionAnalyzer.API_KEY,
+            }
+        ]
+        providers = []
+        for provider in configured:
+            endpoint, api_key = provider["endpoint"], provider.get("api_key")
+            # Named after the host and a digest of the key, so stats survive
+            # reordering the list and keys never end up in Redis or logs
+            key_digest = hashlib.sha1(f"{api_key}".encode()).hexdigest()[:8]
+            netloc = urlsplit(f"{endpoint}").netloc
+            providers.append(
+                {
+                    "name": f"{netloc}:{key_digest}",
+                    "endpoint": endpoint,
+                    "api_key": api_key,
+                    "key_digest": key_digest,
+                }
+            )
+        return providers
+
+    @classmethod
+    def get_circuit_breaker(cls, provider: dict) -> CircuitBreaker:
+        return CircuitBreaker(f"{TronHTTPClient.UPSTREAM}:{provider['name']}")
+
+    @classmethod
+    def read_stats(cls, providers: list) -> list:
+        pipeline = cls.get_redis().pipeline()
+        for provider in providers:
+            pipeline.hgetall(cls.STATS_KEY.format(name=provider["name"]))
+            pipeline.pttl(cls.COOLDOWN_KEY.format(name=provider["name"]))
+        results = pipeline.execute()
+
+        stats = []
+        for stats_hash, cooldown in zip(results[::2], results[1::2]):
+            stats.append(
+                {
+                    "latency": float(stats_hash.get(b"latency", 0)),
+                    "error_rate": float(stats_hash.get(b"error_rate", 0)),
+                    "requests": int(stats_hash.get(b"requests", 0)),
+                    "errors": int(stats_hash.get(b"errors", 0)),
+                    "throttled": int(stats_hash.get(b"throttled", 0)),
+                    "cooldown": max(0, cooldown) / 1000,
+                }
+            )
+        return stats
+
+    @classmethod
+    def rank_providers(cls) -> list:
+        # Healthiest first: providers without numbers yet, then by latency
+        # weighted with the error rate. Resting providers go last.
+        providers = cls.get_providers()
+        stats = cls.read_stats(providers)
+
+        def score(index: int) -> tuple:
+            provider_stats = stats[index]
+            penalty = 1 + cls.ERROR_PENALTY * provider_stats["error_rate"]
+            return (
+                provider_stats["cooldown"] > 0,
+                provider_stats["latency"] * penalty,
+            )
+
+        ranked = [providers[i] for i in sorted(range(len(providers)), key=score)]
+        # Now and then another provider goes first, so one that recovered gets
+        # the chance to show it
+        if len(ranked) > 1 and random.random() < settings.TRON_PROVIDER_EXPLORATION:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    @staticmethod
+    def acquire_quota(provider: dict) -> float:
+        # Every API key has a request budget, a provider whose key is spent is
+        # skipped before TronGrid answers 429
+        throttle = SlidingWindowThrottle(
+            "tron_api_key", settings.TRON_API_KEY_LIMIT, settings.TRON_API_KEY_WINDOW
+        )
+        return throttle.hit(provider["key_digest"])
+
+    @classmethod
+    def record(cls, provider: dict, latency: float, failed: bool) -> None:
+        cls.get_redis().eval(
+            cls.UPDATE_STATS_SCRIPT,
+            1,
+            cls.STATS_KEY.format(name=provider["name"]),
+            latency,
+            int(failed),
+            settings.TRON_PROVIDER_EWMA_ALPHA,
+        )
+
+    @classmethod
+    def cool_down(cls, provider: dict, response: requests.Response) -> None:
+        try:
+            seconds = float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            seconds = settings.TRON_PROVIDER_COOLDOWN
+        redis = cls.get_redis()
+        redis.set(
+            cls.COOLDOWN_KEY.format(name=provider["name"]),
+            1,
+            px=max(1, int(seconds * 1000)),
+        )
+        redis.hincrby(cls.STATS_KEY.format(name=provider["name"]), "throttled", 1)
+
+    @classmethod
+    def is_cooling_down(cls, provider: dict) -> bool:
+        return bool(
+            cls.get_redis().exists(cls.COOLDOWN_KEY.format(name=provider["name"]))
+        )
+
+    @staticmethod
+    def get_headers(provider: dict) -> dict:
         headers = {
             "Accept": "application/json",
             "Content-Type": "application/json",
-            "TRON-PRO-API-KEY": f"{cls.API_KEY}",
         }
+        # Without a key TronGrid serves the request from the public budget
+        if provider["api_key"]:
+            headers["TRON-PRO-API-KEY"] = provider["api_key"]
+        return headers
 
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                valid_data = response.json()
-                transaction_date = (
-                    TronTransactionAnalyzer.convert_timestamp_to_date_format(
-                        valid_data["timestamp"]
-                    )
+    @staticmethod
+    def get_transaction_url(provider: dict, tx_hash: str) -> str:
+        return f"{provider['endpoint']}={tx_hash}"
+
+    @staticmethod
+    def get_api_url(provider: dict, path: str) -> str:
+        # Other TronGrid APIs of the provider, the endpoint names the host
+        endpoint = urlsplit(f"{provider['endpoint']}")
+        return f"{endpoint.scheme}://{endpoint.netloc}{path}"
+
+    @classmethod
+    def get_transaction(cls, tx_hash: str) -> requests.Response:
+        return cls.get(functools.partial(cls.get_transaction_url, tx_hash=tx_hash))
+
+    @classmethod
+    def get(cls, build_url, **kwargs) -> requests.Response:
+        # A GET to the providers in order of health, build_url gives the URL
+        # for a provider. kwargs go to TronHTTPClient.
+        lookup = TronLookup(cls.rank_providers(), build_url)
+        for provider, delay in lookup.get_attempts():
+            time.sleep(delay)
+            # The probe of a half-open circuit is left to the HTTP client
+            breaker = lookup.reserve(provider)
+            if breaker is None:
+                continue
+
+            started = time.perf_counter()
+            try:
+                response = TronHTTPClient.get(
+                    lookup.get_url(provider),
+                    breaker=breaker,
+                    retry_policy=RetryPolicy(attempts=1),
+                    headers=cls.get_headers(provider),
+                    **kwargs,
                 )
-                if TronTransactionAnalyzer.check_transaction_was_today(
-                    transaction_date=transaction_date
-                ):
-                    for transfer_info in valid_data["trc20TransferInfo"]:
-                        if transfer_info["to_address"] != cls.STAS_TRC20_WALLET_ADDRESS:
-                            print(
-                                f"Stanislav Ivankin {cls.STAS_TRC20_WALLET_ADDRESS} didn't get your USDT!",
-                                False,
-                            )
-                            return False
-                        else:
-                            amount_usdt = cls.convert_string_to_trc20(
-                                transfer_info["amount_str"], transfer_info["decimals"]
-                            )
-                            if amount_usdt >= plan_price:
-                                result = {
-                                    "tx_hash": tx_hash,
-                                    "to_address": transfer_info["to_address"],
-                                    "amount_usdt": amount_usdt,
-                                    "subscription_price": plan_price,
-                                }
-                                print(result, True)
-                                return True
-                            else:
-                                result = {
-                                    "tx_hash": tx_hash,
-                                    "to_address": transfer_info["to_address"],
-                                    "amount_usdt": amount_usdt,
-                                    "subscription_price": plan_price,
-                                }
-                                print(result, False)
-                                return False
-                else:
-                    print(False)
-                    return False
-            else:
-                print(f"Error: {response.status_code}")
-                return False
-        except Exception as e:
-            print(f"Error occurred: {e}")
+            except CircuitOpenError as e:
+                lookup.retry_after.append(e.retry_after)
+                continue
+            except requests.RequestException as e:
+                lookup.record_error(provider, e, time.perf_counter() - started)
+                continue
+
+            if lookup.record_response(
+                provider, response, time.perf_counter() - started
+            ):
+                return response
+
+        return lookup.give_up()
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        # Per-provider metrics, latency in milliseconds
+        providers = cls.get_providers()
+        return {
+            provider["name"]: {
+                **provider_stats,
+                "latency": round(provider_stats["latency"] * 1000, 1),
+                "circuit": cls.get_circuit_breaker(provider).get_state(),
+            }
+            for provider, provider_stats in zip(providers, cls.read_stats(providers))
+        }
+
+
+class TronLookup:
+    # One request failing over the TronProviderPool providers: which provider
+    # is asked next, what the answers do to its stats, and what is returned
+    # when none of them helped. The blocking and the aiohttp lookups only
+    # differ in how they wait and send the request.
+    def __init__(self, providers: list, build_url):
+        self.providers = providers
+        self.build_url = build_url
+        self.policy = RetryPolicy()
+        self.response = None
+        self.error = None
+        self.retry_after = []
+        self.quota_retry_after = []
+
+    def get_attempts(self):
+        # Every provider gets one try in order of health; with fewer providers
+        # than retry attempts the healthy ones are asked again after a backoff.
+        # Yields (provider, seconds to wait before asking it).
+        count = len(self.providers)
+        for attempt in range(max(self.policy.attempts, count)):
+            provider = self.providers[attempt % count]
+            if attempt < count:
+                yield provider, 0
+            elif not TronProviderPool.is_cooling_down(provider):
+                yield provider, self.policy.get_delay(attempt - count)
+
+    def get_url(self, provider: dict) -> str:
+        return self.build_url(provider)
+
+    def reserve(self, provider: dict) -> Optional[CircuitBreaker]:
+        # The provider's breaker when it may be asked now, otherwise None with
+        # the wait noted. Quota isn't spent on a provider whose circuit is
+        # open.
+        breaker = TronProviderPool.get_circuit_breaker(provider)
+        if breaker.get_state() == CircuitBreaker.OPEN:
+            self.retry_after.append(breaker.get_retry_after())
+            return None
+        quota_wait = TronProviderPool.acquire_quota(provider)
+        if quota_wait:
+            self.quota_retry_after.append(quota_wait)
+            return None
+        return breaker
+
+    def record_error(self, provider: dict, error: Exception, latency: float) -> None:
+        TronProviderPool.record(provider, latency, failed=True)
+        print(f"TronGrid provider {provider['name']} failed: {error!r}")
+        self.error = error
+
+    def record_response(self, provider: dict, response, latency: float) -> bool:
+        # Records the provider's answer, True when it is final
+        self.response = response
+        if response.status_code == 429:
+            TronProviderPool.record(provider, latency, failed=True)
+            TronProviderPool.cool_down(provider, response)
+            print(f"TronGrid provider {provider['name']} is throttling.")
+            return False
+        if response.status_code >= 500:
+            TronProviderPool.record(provider, latency, failed=True)
+            print(
+                f"TronGrid provider {provider['name']} answered "
+                f"{response.status_code}."
+            )
             return False
+        TronProviderPool.record(provider, latency, failed=False)
+        return True
+
+    def give_up(self):
+        # The last 4xx/5xx answer is returned like TronHTTPClient would, a
+        # network error is raised, and when no provider could be asked at all
+        # QuotaExceededError or CircuitOpenError.
+        if self.response is not None:
+            return self.response
+        if self.error is not None:
+            raise self.error
+        if self.quota_retry_after:
+            raise QuotaExceededError(
+                TronHTTPClient.UPSTREAM, min(self.quota_retry_after)
+            )
+        raise CircuitOpenError(TronHTTPClient.UPSTREAM, min(self.retry_after))
+
+
+class Singleflight:
+    # Lets concurrent callers doing the same work share one run of it: the
+    # caller taking the Redis lock for a key does the work and publishes the
+    # result, the others wait for it. A failed run publishes nothing, then the
+    # waiters take their own turn. The key has to cover everything the result
+    # depends on.
+    LOCK_KEY = "singleflight:{name}:{key}:lock"
+    RESULT_KEY = "singleflight:{name}:{key}:result"
+
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def get_redis(self):
+        return get_redis_connection("default")
+
+    def get_result(self, key: str):
+        return cache.get(self.RESULT_KEY.format(name=self.name, key=key))
+
+    def acquire(self, key: str) -> Optional[str]:
+        # The lock's token when this caller is to do the work
+        token = os.urandom(16).hex()
+        if self.get_redis().set(
+            self.LOCK_KEY.format(name=self.name, key=key),
+            token,
+            nx=True,
+            ex=settings.SINGLEFLIGHT_LOCK_TIMEOUT,
+        ):
+            return token
+        return None
+
+    def publish(self, key: str, result) -> None:
+        cache.set(
+            self.RESULT_KEY.format(name=self.name, key=key),
+            result,
+            timeout=settings.SINGLEFLIGHT_RESULT_TTL,
+        )
+
+    def release(self, key: str, token: str) -> None:
+        self.get_redis().eval(
+            self.RELEASE_SCRIPT, 1, self.LOCK_KEY.format(name=self.name, key=key), token
+        )
+
+    def do(self, key: str, func):
+        while True:
+            result = self.get_result(key)
+            if result is not None:
+                return result
+
+            token = self.acquire(key)
+            if token is not None:
+                try:
+                    result = func()
+                    self.publish(key, result)
+                    return result
+                finally:
+                    self.release(key, token)
+
+            time.sleep(settings.SINGLEFLIGHT_POLL_INTERVAL)
+
+
+class TelegramRateLimiter:
+    # Token buckets kept in Redis, so the global and per-chat Bot API limits
+    # hold across every gunicorn and Celery worker process.
+    GLOBAL_KEY = "telegram:ratelimit:global"
+    CHAT_KEY = "telegram:ratelimit:chat:{chat_id}"
+    PAUSE_KEY = "telegram:ratelimit:pause"
+    COUNTERS_KEY = "telegram:ratelimit:counters"
+    COUNTERS = ("sent", "queued", "throttled")
+
+    # Returns 0 when a token was taken from both buckets, otherwise the number
+    # of milliseconds to wait before trying again.
+    ACQUIRE_SCRIPT = """
+    local pause_ttl = redis.call('PTTL', KEYS[3])
+    if pause_ttl > 0 then
+        return pause_ttl
+    end
+
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+    local function refill(key, rate, capacity)
+        local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+        local tokens = tonumber(bucket[1]) or capacity
+        local ts = tonumber(bucket[2]) or now
+        return math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+    end
+
+    local function take(key, tokens, rate, capacity)
+        redis.call('HSET', key, 'tokens', tokens - 1, 'ts', now)
+        redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000) + 1000)
+    end
+
+    local global_rate, global_capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+    local chat_rate, chat_capacity = tonumber(ARGV[3]), tonumber(ARGV[4])
+    local global_tokens = refill(KEYS[1], global_rate, global_capacity)
+    local chat_tokens = refill(KEYS[2], chat_rate, chat_capacity)
+
+    if global_tokens >= 1 and chat_tokens >= 1 then
+        take(KEYS[1], global_tokens, global_rate, global_capacity)
+        take(KEYS[2], chat_tokens, chat_rate, chat_capacity)
+        return 0
+    end
+
+    local wait = 0
+    if global_tokens < 1 then
+        wait = math.max(wait, math.ceil((1 - global_tokens) * 1000 / global_rate))
+    end
+    if chat_tokens < 1 then
+        wait = math.max(wait, math.ceil((1 - chat_tokens) * 1000 / chat_rate))
+    end
+    return wait
+    """
+
+    _script = None
+
+    @classmethod
+    def get_redis(cls):
+        return get_redis_connection("default")
+
+    @classmethod
+    def try_acquire(cls, chat_id: Union[int, str]) -> float:
+        if cls._script is None:
+            cls._script = cls.get_redis().register_script(cls.ACQUIRE_SCRIPT)
+        wait_ms = cls._script(
+            keys=[
+                cls.GLOBAL_KEY,
+                cls.CHAT_KEY.format(chat_id=chat_id),
+                cls.PAUSE_KEY,
+            ],
+            args=[
+                settings.TELEGRAM_GLOBAL_RATE_LIMIT,
+                settings.TELEGRAM_GLOBAL_BURST,
+                settings.TELEGRAM_CHAT_RATE_LIMIT,
+                settings.TELEGRAM_CHAT_BURST,
+            ],
+        )
+        return wait_ms / 1000
+
+    @classmethod
+    def acquire(cls, chat_id: Union[int, str]) -> None:
+        queued = False
+        wait = cls.try_acquire(chat_id)
+        while wait > 0:
+            if not queued:
+                cls.increment("queued")
+                queued = True
+            time.sleep(wait)
+            wait = cls.try_acquire(chat_id)
+
+    @classmethod
+    def pause(cls, seconds: float) -> None:
+        # Telegram answered 429, hold every sender until retry_after passes
+        cls.get_redis().set(cls.PAUSE_KEY, 1, px=max(1, math.ceil(seconds * 1000)))
+
+    @classmethod
+    def increment(cls, counter: str, amount: int = 1) -> None:
+        cls.get_redis().hincrby(cls.COUNTERS_KEY, counter, amount)
+
+    @classmethod
+    def get_counters(cls) -> dict:
+        counters = cls.get_redis().hgetall(cls.COUNTERS_KEY)
+        return {name: int(counters.get(name.encode(), 0)) for name in cls.COUNTERS}
+
+
+class TelegramFileIdCache:
+    # Telegram file_id of every uploaded photo, keyed by the SHA-256 of the
+    # file content so a replaced image gets uploaded again. Redis is checked
+    # first, the database is the durable fallback.
+    CACHE_KEY = "telegram_file_id:{content_hash}"
+
+    # (path, mtime, size) -> content hash, so a file is hashed once per process
+    _content_hashes = {}
+
+    @classmethod
+    def get_content_hash(cls, photo_path: str) -> str:
+        stat = os.stat(photo_path)
+        key = (photo_path, stat.st_mtime_ns, stat.st_size)
+        if key not in cls._content_hashes:
+            with open(photo_path, "rb") as photo:
+                cls._content_hashes[key] = hashlib.sha256(photo.read()).hexdigest()
+        return cls._content_hashes[key]
+
+    @classmethod
+    def get(cls, content_hash: str) -> Optional[str]:
+        cache_key = cls.CACHE_KEY.format(content_hash=content_hash)
+        file_id = cache.get(cache_key)
+        if file_id is None:
+            telegram_file = TelegramFile.objects.filter(
+                content_hash=content_hash
+            ).first()
+            if telegram_file is not None:
+                file_id = telegram_file.file_id
+                cache.set(cache_key, file_id, timeout=None)
+        return file_id
+
+    @classmethod
+    def set(cls, content_hash: str, file_id: str) -> None:
+        TelegramFile.objects.update_or_create(
+            content_hash=content_hash, defaults={"file_id": file_id}
+        )
+        cache.set(cls.CACHE_KEY.format(content_hash=content_hash), file_id, None)
+
+    @classmethod
+    def delete(cls, content_hash: str) -> None:
+        TelegramFile.objects.filter(content_hash=content_hash).delete()
+        cache.delete(cls.CACHE_KEY.format(content_hash=content_hash))
+
+
+class SubscriptionStatusCache:
+    # The answer of GET /api/v1/subscriptions/ per username, as (status code,
+    # payload), so the bot's frequent status checks skip the database. Also
+    # used by the bulk status endpoint and for ETags. The
+    # signals in signals.py drop it whenever the subscription changes.
+    CACHE_KEY = "subscription_status:{telegram_username}"
+
+    @classmethod
+    def get(cls, telegram_username: str) -> Optional[tuple]:
+        return cache.get(cls.CACHE_KEY.format(telegram_username=telegram_username))
+
+    @classmethod
+    def set(cls, telegram_username: str, status_code: int, payload: dict) -> None:
+        cache.set(
+            cls.CACHE_KEY.format(telegram_username=telegram_username),
+            (status_code, payload),
+            timeout=settings.SUBSCRIPTION_CACHE_TTL,
+        )
+
+    @staticmethod
+    def get_etag(payload: dict) -> str:
+        # Version of a subscription status for conditional GETs. It changes
+        # with the transaction hash and end date, and with the plan, price and
+        # username shown next to them.
+        digest = hashlib.sha1(json.dumps(payload, sort_keys=True).encode())
+        return f'"{digest.hexdigest()}"'
+
+    @classmethod
+    def get_many(cls, telegram_usernames) -> dict:
+        keys = {
+            cls.CACHE_KEY.format(telegram_username=username): username
+            for username in telegram_usernames
+        }
+        return {keys[key]: value for key, value in cache.get_many(keys).items()}
+
+    @classmethod
+    def set_many(cls, statuses: dict) -> None:
+        cache.set_many(
+            {
+                cls.CACHE_KEY.format(telegram_username=username): value
+                for username, value in statuses.items()
+            },
+            timeout=settings.SUBSCRIPTION_CACHE_TTL,
+        )
+
+    @classmethod
+    def delete(cls, telegram_username: str) -> None:
+        cache.delete(cls.CACHE_KEY.format(telegram_username=telegram_username))
+
+    @classmethod
+    def delete_many(cls, telegram_usernames) -> None:
+        cache.delete_many(
+            [
+                cls.CACHE_KEY.format(telegram_username=username)
+                for username in telegram_usernames
+            ]
+        )
+
+    @classmethod
+    def delete_all(cls) -> None:
+        cache.delete_pattern(cls.CACHE_KEY.format(telegram_username="*"))
+
+
+class ReferenceCache:
+    # Two-tier cache for small, rarely changing reference data like plans
+    # and admins: a dict in every process in front of Redis. Changes are
+    # published on a Redis channel, each process listens on a daemon thread
+    # started lazily (and again after a fork) and drops its copy.
+    CACHE_KEY = "reference_cache:{name}"
+    CHANNEL = "reference_cache:invalidate"
+
+    # name -> (expires at, value)
+    _local = {}
+    _listener_pid = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name: str, loader):
+        cls.start_listener()
+        entry = cls._local.get(name)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        cache_key = cls.CACHE_KEY.format(name=name)
+        value = cache.get(cache_key)
+        if value is None:
+            value = loader()
+            cache.set(cache_key, value, timeout=settings.REFERENCE_CACHE_TTL)
+        cls._local[name] = (
+            time.monotonic() + settings.REFERENCE_CACHE_LOCAL_TTL,
+            value,
+        )
+        return value
+
+    @classmethod
+    def invalidate(cls, name: str) -> None:
+        cache.delete(cls.CACHE_KEY.format(name=name))
+        cls._local.pop(name, None)
+        get_redis_connection("default").publish(cls.CHANNEL, name)
+
+    @classmethod
+    def clear_local(cls) -> None:
+        cls._local.clear()
+
+    @classmethod
+    def start_listener(cls) -> None:
+        if cls._listener_pid == os.getpid():
+            return
+        with cls._lock:
+            if cls._listener_pid == os.getpid():
+                return
+            # Whatever was inherited from the parent isn't being watched
+            cls._local.clear()
+            pubsub = get_redis_connection("default").pubsub(
+                ignore_subscribe_messages=True
+            )
+            pubsub.subscribe(cls.CHANNEL)
+            threading.Thread(target=cls.listen, args=(pubsub,), daemon=True).start()
+            cls._listener_pid = os.getpid()
+
+    @classmethod
+    def listen(cls, pubsub) -> None:
+        while True:
+            try:
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        cls._local.pop(message["data"].decode(), None)
+            except Exception as e:
+                # Announcements may have been missed while disconnected
+                print(f"Reference cache listener failed: {e}")
+                cls._local.clear()
+                time.sleep(1)
+
+
+class AdminDigest:
+    # Collects what a task did during one run, so every admin gets a single
+    # summary split into pages under Telegram's message length limit instead
+    # of one log message per subscription.
+    MAX_MESSAGE_LENGTH = 4096
+
+    def __init__(self, title: str):
+        self.title = title
+        # section -> lines, dicts keep insertion order and drop duplicates
+        self.sections = {}
+
+    def add(self, section: str, line: str) -> None:
+        self.sections.setdefault(section, {})[line] = None
+
+    def is_empty(self) -> bool:
+        return not self.sections
+
+    def render_pages(self, admin_of_group: str) -> list:
+        header = f"Hi, {admin_of_group}!\n\n{self.title}\n"
+        # Room left on every page for the header and the "(page x/y)" footer
+        budget = self.MAX_MESSAGE_LENGTH - len(header) - 32
+
+        lines = []
+        for section, section_lines in self.sections.items():
+            lines.append(f"\n{section} ({len(section_lines)}):")
+            for line in section_lines:
+                lines.append(f"• {line}"[:budget])
+
+        bodies = [""]
+        for line in lines:
+            if len(bodies[-1]) + len(line) + 1 > budget:
+                bodies.append("")
+            bodies[-1] += f"{line}\n"
+
+        if len(bodies) == 1:
+            return [header + bodies[0]]
+        return [
+            f"{header}{body}\n(page {number}/{len(bodies)})"
+            for number, body in enumerate(bodies, start=1)
+        ]
+
+    def send(self, admins_of_group) -> None:
+        if self.is_empty():
+            return
+
+        for admin in admins_of_group:
+            for page in self.render_pages(admin_of_group=admin.telegram_username):
+                try:
+                    response = TelegramMessageSender.send_message_to_chat(
+                        message=page, chat_id=admin.chat_id
+                    )
+                    if response.status_code != 200:
+                        print(
+                            f"Failed to send digest to admin {admin.telegram_username}. Status code: {response.status_code}"
+                        )
+                except Exception as e:
+                    print(
+                        f"Failed to send digest to admin {admin.telegram_username}: {str(e)}"
+                    )
 
 
 class TelegramMessageSender:
     TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 
+    @classmethod
+    def build_url(cls, method: str) -> str:
+        return f"{settings.TELEGRAM_API_URL}/bot{cls.TELEGRAM_BOT_TOKEN}/{method}"
+
+    @classmethod
+    def dispatch(
+        cls, url: str, chat_id: Union[int, str], **kwargs
+    ) -> requests.Response:
+        # Every Bot API call is paced by the rate limiter and retried after
+        # the retry_after period when Telegram still answers 429
+        for attempt in range(settings.TELEGRAM_MAX_RETRIES_ON_429 + 1):
+            TelegramRateLimiter.acquire(chat_id)
+            response = TelegramHTTPClient.post(url=url, **kwargs)
+            if response.status_code != 429:
+                if response.status_code == 200:
+                    TelegramRateLimiter.increment("sent")
+                return response
+
+            retry_after = cls.get_retry_after(response)
+            print(f"Telegram rate limit hit, retrying after {retry_after}s.")
+            TelegramRateLimiter.increment("throttled")
+            TelegramRateLimiter.pause(retry_after)
+        return response
+
+    @staticmethod
+    def get_retry_after(response: requests.Response) -> float:
+        try:
+            return float(response.json()["parameters"]["retry_after"])
+        except (ValueError, KeyError, TypeError):
+            pass
+        try:
+            return float(response.headers["Retry-After"])
+        except (ValueError, KeyError, TypeError):
+            return 1.0
+
     @classmethod
     def send_message_to_chat(
         cls, message: str, chat_id: Union[int, str]
     ) -> requests.Response:
-        url = f"https://api.telegram.org/bot{cls.TELEGRAM_BOT_TOKEN}/sendMessage"
+        url = cls.build_url("sendMessage")
         params = {"chat_id": chat_id, "text": message}
 
-        response = requests.post(url=url, params=params)
+        response = cls.dispatch(url=url, chat_id=chat_id, params=params)
         if response.status_code == 200:
             print("Message sent successfully!")
         else:
@@ -124,17 +1435,52 @@ class TelegramMessageSender:
     def send_message_with_photo_to_chat(
         cls, message: str, photo_path: str, chat_id: Union[int, str]
     ) -> requests.Response:
-        url = f"https://api.telegram.org/bot{cls.TELEGRAM_BOT_TOKEN}/sendPhoto"
-        files = {"photo": open(photo_path, "rb")}
+        url = cls.build_url("sendPhoto")
         params = {"chat_id": chat_id, "caption": message}
+        content_hash = TelegramFileIdCache.get_content_hash(photo_path)
+        file_id = TelegramFileIdCache.get(content_hash)
 
-        response = requests.post(url=url, params=params, files=files)
+        if file_id is not None:
+            # The photo is already on Telegram servers, send it by reference
+            response = cls.dispatch(
+                url=url, chat_id=chat_id, params={**params, "photo": file_id}
+            )
+            if not cls.is_file_id_rejected(response):
+                if response.status_code == 200:
+                    print("Message with photo sent successfully!")
+                else:
+                    print("Failed to send message with photo:", response.text)
+                return response
+
+            print(f"Telegram rejected cached file_id {file_id}, uploading again.")
+            TelegramFileIdCache.delete(content_hash)
+
+        with open(photo_path, "rb") as photo:
+            response = cls.dispatch(
+                url=url, chat_id=chat_id, params=params, files={"photo": photo}
+            )
         if response.status_code == 200:
             print("Message with photo sent successfully!")
+            file_id = cls.get_file_id_from_response(response)
+            if file_id is not None:
+                TelegramFileIdCache.set(content_hash, file_id)
         else:
             print("Failed to send message with photo:", response.text)
         return response
 
+    @staticmethod
+    def get_file_id_from_response(response: requests.Response) -> Optional[str]:
+        # sendPhoto returns every generated size, the last one is the original
+        try:
+            file_id = response.json()["result"]["photo"][-1]["file_id"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            return None
+        return file_id if isinstance(file_id, str) else None
+
+    @staticmethod
+    def is_file_id_rejected(response: requests.Response) -> bool:
+        return response.status_code == 400 and "file" in response.text.lower()
+
     def create_message_about_add_user(
         admin_of_group: TelegramUser,
         telegram_username: str,
@@ -1,17 +1,46 @@
-import pytz
+import math
+from typing import Optional
+
+from django.conf import settings
 from django.http import HttpRequest, HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from subscription_service.utils import TelegramMessageSender, TronTransactionAnalyzer
+from subscription_service.utils import (
+    CircuitOpenError,
+    QuotaExceededError,
+    SlidingWindowThrottle,
+    SubscriptionStatusCache,
+    TronTransactionAnalyzer,
+)
 
-from .models import Plan, Subscription, TelegramUser
+from .models import PaymentVerification, Plan, TelegramUser
+from .pagination import SubscriptionPagination
 from .serializers import (
-    GetSubscriptionSerializer,
-    PostSubscriptionSerializer,
+    PaymentVerificationSerializer,
+    SubscriptionListQuerySerializer,
+    SubscriptionStatusRequestSerializer,
+    TelegramUserBulkSerializer,
     TelegramUserSerializer,
+    TelegramUserUpsertSerializer,
+)
+from .services import (
+    USER_NOT_FOUND,
+    activate_subscription,
+    build_subscription_payload,
+    build_subscription_status,
+    get_activated_subscription,
+    get_plan,
+    get_subscription_rows,
+    get_subscription_status_rows,
+    get_subscription_statuses,
+    is_transaction_hash_used,
+    register_telegram_users,
+    submit_payment_verification,
 )
 
 
@@ -27,35 +56,82 @@ class TelegramUserAPIView(APIView):
             return Response(res, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def put(self, request: HttpRequest) -> HttpResponse:
+        # Idempotent registration: creates the user or updates their names
+        serializer = TelegramUserUpsertSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        result = register_telegram_users([serializer.validated_data])
+        if result["conflicts"]:
+            return Response(
+                {
+                    "telegram_username": [
+                        "telegram user with this telegram username already exists."
+                    ]
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        code = status.HTTP_201_CREATED if result["created"] else status.HTTP_200_OK
+        return Response({"status": code, "data": serializer.data}, status=code)
+
+
+class TelegramUserBulkAPIView(APIView):
+    # Registers up to USER_REGISTRATION_BATCH_LIMIT users at once, existing
+    # ones are updated
+    permission_classes = [AllowAny]
+    authentication_classes = ()
+
+    def post(self, request: HttpRequest) -> HttpResponse:
+        serializer = TelegramUserBulkSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        result = register_telegram_users(serializer.validated_data["users"])
+        return Response(result, status=status.HTTP_200_OK)
+
 
 class SubscriptionAPIView(APIView):
     permission_classes = [AllowAny]
     authentication_classes = ()
 
+    INVALID_TRANSACTION = {
+        "status": status.HTTP_400_BAD_REQUEST,
+        "message": "Transaction is not valid",
+        "success": False,
+    }
+
     def get(self, request: HttpRequest) -> HttpResponse:
 
         # Get the username from the query parameters
         telegram_username = request.query_params.get("telegram_username")
 
-        # Find the user with the given telegram_username
-        try:
-            user = TelegramUser.objects.get(telegram_username=telegram_username)
-        except TelegramUser.DoesNotExist:
-            return Response(
-                {"message": "User not found"}, status=status.HTTP_404_NOT_FOUND
-            )
+        cached = SubscriptionStatusCache.get(telegram_username)
+        if cached is not None:
+            status_code, payload = cached
+            return self.status_response(request, status_code, payload)
 
-        # Retrieve the subscription for the user
-        try:
-            subscription = Subscription.objects.get(customer=user)
-        except Subscription.DoesNotExist:
-            return Response(
-                {"message": "Subscription not found"}, status=status.HTTP_404_NOT_FOUND
-            )
+        # The user, their subscription and its plan in one query
+        row = get_subscription_status_rows(telegram_username=telegram_username).first()
+        if row is None:
+            status_code, payload = USER_NOT_FOUND
+        else:
+            status_code, payload = build_subscription_status(row)
+        SubscriptionStatusCache.set(telegram_username, status_code, payload)
+        return self.status_response(request, status_code, payload)
 
-        # Initialize the serializer with the subscription instance
-        serializer = GetSubscriptionSerializer(instance=subscription)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    @staticmethod
+    def status_response(
+        request: HttpRequest, status_code: int, payload: dict
+    ) -> HttpResponse:
+        # A subscription comes with an ETag, the bot polling with it in
+        # If-None-Match gets an empty 304 until the subscription changes
+        if status_code != status.HTTP_200_OK:
+            return Response(payload, status=status_code)
+        etag = SubscriptionStatusCache.get_etag(payload)
+        response = Response(payload, status=status_code, headers={"ETag": etag})
+        return get_conditional_response(request, etag=etag, response=response)
 
     def post(self, request: HttpRequest) -> HttpResponse:
         data = request.data
@@ -65,6 +141,10 @@ class SubscriptionAPIView(APIView):
         plan_name = data.get("plan")
         transaction_hash = data.get("transaction_hash")
 
+        retry_after = self.get_submission_throttle().hit(str(telegram_username))
+        if retry_after:
+            return self.too_many_submissions(retry_after)
+
         # Find the user with the given telegram_username
         try:
             user = TelegramUser.objects.get(telegram_username=telegram_username)
@@ -74,172 +154,165 @@ class SubscriptionAPIView(APIView):
             )
 
         # Find the plan with the given plan name
-        try:
-            plan = Plan.objects.get(period=plan_name)
-        except Plan.DoesNotExist:
+        plan = get_plan(plan_name)
+        if plan is None:
             return Response(
                 {"message": "Plan not found"}, status=status.HTTP_404_NOT_FOUND
             )
 
-        # Get the price of the plan
-        plan_price = plan.price
+        if not TronTransactionAnalyzer.is_well_formed_tx_hash(transaction_hash):
+            return Response(
+                self.INVALID_TRANSACTION, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Check if the transaction hash is already used, now or before. A
+        # duplicate of this user's activated payment gets the same answer.
+        if is_transaction_hash_used(transaction_hash):
+            data = get_activated_subscription(user, transaction_hash)
+            if data is None:
+                raise ValidationError("Transaction hash already used for subscription.")
+            return self.outcome_response(self.build_outcome((data, None)))
+
+        if settings.PAYMENT_VERIFICATION_MODE == "async":
+            verification = submit_payment_verification(
+                user=user, plan=plan, transaction_hash=transaction_hash
+            )
+            return self.verification_accepted(verification)
+
+        # Concurrent submissions of one payment share the TronGrid lookup, see
+        # TronTransactionAnalyzer.get_transaction_facts
+        try:
+            outcome = self.verify_and_activate(user, plan, transaction_hash)
+        except CircuitOpenError as e:
+            return self.verification_unavailable(e)
+        return self.outcome_response(outcome)
+
+    @staticmethod
+    def get_submission_throttle() -> SlidingWindowThrottle:
+        # Every submission may cost a TronGrid call, so each user gets a few
+        return SlidingWindowThrottle(
+            "payment_submission",
+            settings.PAYMENT_SUBMISSION_LIMIT,
+            settings.PAYMENT_SUBMISSION_WINDOW,
+        )
+
+    @staticmethod
+    def too_many_submissions(retry_after: float) -> Response:
+        return Response(
+            {"message": "Too many payment submissions, try again later"},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    @staticmethod
+    def verification_accepted(verification: PaymentVerification) -> Response:
+        serializer = PaymentVerificationSerializer(instance=verification)
+        return Response(
+            serializer.data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={
+                "Location": reverse("payment-verification", args=[verification.pk])
+            },
+        )
+
+    @staticmethod
+    def verification_unavailable(error: CircuitOpenError) -> Response:
+        if isinstance(error, QuotaExceededError):
+            message = "Too many transaction checks, try again later"
+            status_code = status.HTTP_429_TOO_MANY_REQUESTS
+        else:
+            message = "Transaction validation is temporarily unavailable"
+            status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return Response(
+            {"message": message},
+            status=status_code,
+            headers={"Retry-After": str(math.ceil(error.retry_after))},
+        )
 
-        # Check if the transaction hash is already used
-        if Subscription.objects.filter(transaction_hash=transaction_hash).exists():
-            raise ValidationError("Transaction hash already used for subscription.")
+    @staticmethod
+    def outcome_response(outcome: dict) -> Response:
+        return Response(outcome["data"], status=outcome["status"])
 
+    @classmethod
+    def verify_and_activate(
+        cls, user: TelegramUser, plan: Plan, transaction_hash: str
+    ) -> dict:
         success = TronTransactionAnalyzer.validate_tx_hash(
-            tx_hash=transaction_hash, plan_price=plan_price
+            tx_hash=transaction_hash, plan_price=plan.price
         )
+        activation = None
         if success:
-            # Allow user to extend his subscription
-            try:
-                subscription = Subscription.objects.get(customer=user)
-                subscription.delete()
-                user.delete_from_private_group()
-                extended_subscription_data = {
-                    "customer": user.chat_id,
-                    "plan": plan.pk,
-                    "transaction_hash": transaction_hash,
-                }
-                serializer = PostSubscriptionSerializer(data=extended_subscription_data)
-                if serializer.is_valid():
-                    user.add_to_private_group()
-                    serializer.save()
-
-                    # Convert time in Moscow time zone
-                    moscow_tz = pytz.timezone("Europe/Moscow")
-
-                    # Get extended subscription
-                    extended_subscription = serializer.instance
-                    telegram_username = extended_subscription.customer.telegram_username
-                    subscription_plan = extended_subscription.plan.period
-                    subscription_price = extended_subscription.plan.price
-                    tx_hash = extended_subscription.transaction_hash
-                    subscription_start_date = (
-                        extended_subscription.start_date.astimezone(moscow_tz).strftime(
-                            "%d/%m/%Y %H:%M:%S"
-                        )
-                    )
-                    subscription_end_date = extended_subscription.end_date.astimezone(
-                        moscow_tz
-                    ).strftime("%d/%m/%Y %H:%M:%S")
-
-                    # Get the admins
-                    try:
-                        admins_of_group = TelegramUser.objects.filter(is_staff=True)
-                        print("Found users:", admins_of_group)
-                    except TelegramUser.DoesNotExist:
-                        print("Users not found.")
-
-                    for admin in admins_of_group:
-                        try:
-                            message = (
-                                TelegramMessageSender.create_message_about_keep_user(
-                                    admin_of_group=admin.telegram_username,
-                                    telegram_username=telegram_username,
-                                    subscription_start_date=subscription_start_date,
-                                    subscription_end_date=subscription_end_date,
-                                    subscription_plan=subscription_plan,
-                                    subscription_price=subscription_price,
-                                    tx_hash=tx_hash,
-                                )
-                            )
-
-                            response = TelegramMessageSender.send_message_to_chat(
-                                message=message, chat_id=admin.chat_id
-                            )
-                            if response.status_code == 200:
-                                print(
-                                    f"User {telegram_username} must be kept in the group."
-                                )
-                            else:
-                                print(
-                                    f"Failed to keep user {telegram_username} in the group. Status code: {response.status_code}"
-                                )
-                        except Exception as e:
-                            print(
-                                f"Failed to keep user {telegram_username} in the group: {str(e)}"
-                            )
-
-                    return Response(serializer.data, status=status.HTTP_201_CREATED)
-                else:
-                    return Response(
-                        serializer.errors, status=status.HTTP_400_BAD_REQUEST
-                    )
-            except Subscription.DoesNotExist:
-                # If the user does not have a subscription, create a new subscription
-                subscription_data = {
-                    "customer": user.chat_id,
-                    "plan": plan.pk,
-                    "transaction_hash": transaction_hash,
-                }
-                serializer = PostSubscriptionSerializer(data=subscription_data)
-                if serializer.is_valid():
-                    serializer.save()
-
-                    # Get the admins
-                    try:
-                        admins_of_group = TelegramUser.objects.filter(is_staff=True)
-                        print("Found users:", admins_of_group)
-                    except TelegramUser.DoesNotExist:
-                        print("Users not found.")
-
-                    # Convert time in Moscow time zone
-                    moscow_tz = pytz.timezone("Europe/Moscow")
-
-                    # Get subscription data
-                    subscription = Subscription.objects.get(customer=user)
-                    telegram_username = subscription.customer.telegram_username
-                    subscription_plan = subscription.plan.period
-                    subscription_price = subscription.plan.price
-                    tx_hash = subscription.transaction_hash
-                    subscription_start_date = subscription.start_date.astimezone(
-                        moscow_tz
-                    ).strftime("%d/%m/%Y %H:%M:%S")
-                    subscription_end_date = subscription.end_date.astimezone(
-                        moscow_tz
-                    ).strftime("%d/%m/%Y %H:%M:%S")
-
-                    # send log message to all admins about adding user to private group
-                    for admin in admins_of_group:
-                        try:
-                            message = (
-                                TelegramMessageSender.create_message_about_add_user(
-                                    admin_of_group=admin.telegram_username,
-                                    telegram_username=telegram_username,
-                                    subscription_start_date=subscription_start_date,
-                                    subscription_end_date=subscription_end_date,
-                                    subscription_plan=subscription_plan,
-                                    subscription_price=subscription_price,
-                                    tx_hash=tx_hash,
-                                )
-                            )
-
-                            response = TelegramMessageSender.send_message_to_chat(
-                                message=message, chat_id=admin.chat_id
-                            )
-
-                            if response.status_code == 200:
-                                subscription.customer.add_to_private_group()
-                                print(
-                                    f"User {telegram_username} must be added to the group."
-                                )
-                            else:
-                                print(
-                                    f"Failed to add user {telegram_username} to the group. Status code: {response.status_code}"
-                                )
-                        except Exception as e:
-                            print(
-                                f"Failed to add user {telegram_username} to the group: {str(e)}"
-                            )
-
-                    return Response(serializer.data, status=status.HTTP_201_CREATED)
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            activation = activate_subscription(
+                user=user, plan=plan, transaction_hash=transaction_hash
+            )
+        return cls.build_outcome(activation)
+
+    @classmethod
+    def build_outcome(cls, activation: Optional[tuple]) -> dict:
+        # activation is what activate_subscription returned, None when the
+        # transaction didn't pay for the plan
+        if activation is None:
+            data, status_code = cls.INVALID_TRANSACTION, status.HTTP_400_BAD_REQUEST
         else:
-            response = {
-                "status": status.HTTP_400_BAD_REQUEST,
-                "message": "Transaction is not valid",
-                "success": success,
-            }
-            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+            data, errors = activation
+            if errors:
+                data, status_code = errors, status.HTTP_400_BAD_REQUEST
+            else:
+                status_code = status.HTTP_201_CREATED
+        return {"status": status_code, "data": data}
+
+
+class SubscriptionStatusAPIView(APIView):
+    # Subscription status of many users at once, so the bot can check a whole
+    # chat roster with one request. Each result carries the status code and
+    # payload GET /api/v1/subscriptions/ would answer for that user.
+    permission_classes = [AllowAny]
+    authentication_classes = ()
+
+    def post(self, request: HttpRequest) -> HttpResponse:
+        serializer = SubscriptionStatusRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        results = get_subscription_statuses(**serializer.validated_data)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class SubscriptionListAPIView(APIView):
+    # All subscriptions by end date for admins, e.g.
+    # ?expiring_before=2024-06-01T00:00&plan=1 month. Pages are walked with
+    # the cursor in "next", not by number.
+    permission_classes = [IsAdminUser]
+    pagination_class = SubscriptionPagination
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        serializer = SubscriptionListQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = self.pagination_class()
+        rows = paginator.paginate_queryset(
+            get_subscription_rows(**serializer.validated_data), request, view=self
+        )
+        return paginator.get_paginated_response(
+            [build_subscription_payload(row) for row in rows]
+        )
+
+
+class PaymentVerificationAPIView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = ()
+
+    def get(self, request: HttpRequest, job_id) -> HttpResponse:
+        try:
+            verification = PaymentVerification.objects.select_related(
+                "customer", "plan"
+            ).get(pk=job_id)
+        except PaymentVerification.DoesNotExist:
+            return Response(
+                {"message": "Verification not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        serializer = PaymentVerificationSerializer(instance=verification)
+        return Response(serializer.data, status=status.HTTP_200_OK)
@@ -0,0 +1,61 @@
+import pytest
+from django.core.cache import cache
+from subscription_service.utils import ReferenceCache
+
+from benchmarks.fake_telegram import FakeTelegramServer
+from benchmarks.fake_tron import FakeTronServer
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Redis and the in-process reference cache outlive the per-test database
+    # rollback, start every test clean
+    cache.clear()
+    ReferenceCache.clear_local()
+    yield
+    cache.clear()
+    ReferenceCache.clear_local()
+
+
+@pytest.fixture
+def start_fake_telegram(settings):
+    # Starts a local fake of the Bot API and points the senders at it, e.g.
+    # start_fake_telegram(latency=0.01, throttle_rate=0.2, seed=1)
+    servers = []
+
+    def start(**options) -> FakeTelegramServer:
+        server = FakeTelegramServer(**options)
+        servers.append(server)
+        settings.TELEGRAM_API_URL = server.url
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture
+def fake_telegram(start_fake_telegram) -> FakeTelegramServer:
+    return start_fake_telegram()
+
+
+@pytest.fixture
+def start_fake_tron(settings):
+    # Starts local fakes of TronGrid and makes them the provider pool, in the
+    # order they were started, e.g. start_fake_tron(latency=0.2). Lookups go
+    # to the healthiest provider, never to a random one to explore it.
+    servers = []
+    settings.TRON_PROVIDERS = []
+    settings.TRON_PROVIDER_EXPLORATION = 0
+
+    def start(api_key: str = "test-key", **options) -> FakeTronServer:
+        server = FakeTronServer(**options)
+        servers.append(server)
+        settings.TRON_PROVIDERS = settings.TRON_PROVIDERS + [
+            {"endpoint": server.endpoint, "api_key": api_key}
+        ]
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
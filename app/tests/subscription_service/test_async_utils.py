@@ -0,0 +1,42 @@
+import pytest
+from asgiref.sync import async_to_sync
+from subscription_service.async_utils import AsyncTronClient
+from subscription_service.utils import TronProviderPool
+
+
+def get_transaction(tx_hash: str):
+    async def run():
+        try:
+            return await AsyncTronClient.get_transaction(tx_hash)
+        finally:
+            await AsyncTronClient.close()
+
+    return async_to_sync(run)()
+
+
+@pytest.mark.django_db
+def test_get_transaction_fails_over_when_provider_is_throttling(start_fake_tron):
+    throttled = start_fake_tron(api_key="key-1", throttle_rate=1, retry_after=30)
+    healthy = start_fake_tron(api_key="key-2", wallet_address="TOurWallet")
+
+    response = get_transaction("tx_1")
+
+    assert response.status_code == 200
+    assert response.json()["trc20TransferInfo"][0]["to_address"] == "TOurWallet"
+    assert [call["status"] for call in throttled.get_calls()] == [429]
+    assert [call["api_key"] for call in healthy.get_calls()] == ["key-2"]
+    # Stats and cooldowns are shared with the sync pool
+    stats = TronProviderPool.get_stats()
+    assert sum(provider["throttled"] for provider in stats.values()) == 1
+    assert sum(provider["requests"] for provider in stats.values()) == 2
+
+
+@pytest.mark.django_db
+def test_get_transaction_fails_over_when_provider_times_out(start_fake_tron, settings):
+    settings.TRON_READ_TIMEOUT = 0.2
+    start_fake_tron(latency=2)
+    start_fake_tron()
+
+    assert get_transaction("tx_1").status_code == 200
+    stats = TronProviderPool.get_stats()
+    assert sorted(provider["errors"] for provider in stats.values()) == [0, 1]
@@ -0,0 +1,182 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.test import AsyncRequestFactory
+from rest_framework import status
+from subscription_service.async_utils import AsyncTronClient
+from subscription_service.async_views import (
+    AsyncSubscriptionAPIView,
+    AsyncTelegramUserAPIView,
+)
+from subscription_service.models import Plan, Subscription, TelegramUser
+from subscription_service.serializers import PostSubscriptionSerializer
+from subscription_service.utils import TronProviderPool, TronTransactionAnalyzer
+
+WALLET = "TOurWallet"
+
+
+def call(view_class, *requests) -> list:
+    # Runs the requests concurrently on one event loop, like an ASGI worker
+    async def run():
+        view = view_class.as_view()
+        try:
+            return await asyncio.gather(*(view(request) for request in requests))
+        finally:
+            await AsyncTronClient.close()
+
+    return async_to_sync(run)()
+
+
+def submit(telegram_username: str, transaction_hash: str, plan: str = "1 month"):
+    return AsyncRequestFactory().post(
+        "/api/v1/subscriptions/",
+        {
+            "telegram_username": telegram_username,
+            "plan": plan,
+            "transaction_hash": transaction_hash,
+        },
+        content_type="application/json",
+    )
+
+
+def test_views_are_coroutines():
+    assert iscoroutinefunction(AsyncSubscriptionAPIView.as_view())
+    assert iscoroutinefunction(AsyncTelegramUserAPIView.as_view())
+
+
+@pytest.mark.django_db
+def test_create_telegram_user():
+    request = AsyncRequestFactory().post(
+        "/api/v1/users/",
+        {"chat_id": 123456, "telegram_username": "test_user"},
+        content_type="application/json",
+    )
+
+    [response] = call(AsyncTelegramUserAPIView, request)
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data["data"]["telegram_username"] == "test_user"
+    assert TelegramUser.objects.filter(chat_id=123456).exists()
+
+
+@pytest.mark.django_db
+def test_get_subscription():
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=10)
+    Subscription.objects.create(customer=user, plan=plan, transaction_hash="tx_1")
+    request = AsyncRequestFactory().get(
+        "/api/v1/subscriptions/", {"telegram_username": "test_user"}
+    )
+
+    [response] = call(AsyncSubscriptionAPIView, request)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["transaction_hash"] == "tx_1"
+
+    request = AsyncRequestFactory().get(
+        "/api/v1/subscriptions/",
+        {"telegram_username": "test_user"},
+        headers={"If-None-Match": response["ETag"]},
+    )
+    [response] = call(AsyncSubscriptionAPIView, request)
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.django_db
+@patch.object(TronTransactionAnalyzer, "STAS_TRC20_WALLET_ADDRESS", WALLET)
+def test_create_subscription_checks_tron_without_blocking(start_fake_tron):
+    tron = start_fake_tron(wallet_address=WALLET, latency=0.3)
+    Plan.objects.create(period="1 month", price=10)
+    requests = []
+    for i in range(5):
+        TelegramUser.objects.create(chat_id=i, telegram_username=f"user_{i}")
+        requests.append(submit(f"user_{i}", f"{i:064x}"))
+
+    started = time.perf_counter()
+    responses = call(AsyncSubscriptionAPIView, *requests)
+
+    # The TronGrid lookups overlap instead of taking 5 * 0.3 seconds
+    assert time.perf_counter() - started < 1.2
+    assert [response.status_code for response in responses] == [201] * 5
+    assert len(tron.get_calls()) == 5
+    assert Subscription.objects.count() == 5
+
+
+@pytest.mark.django_db
+@patch.object(TronTransactionAnalyzer, "STAS_TRC20_WALLET_ADDRESS", WALLET)
+def test_retry_with_another_plan_is_checked_again(start_fake_tron):
+    tron = start_fake_tron(wallet_address=WALLET, amount_str="50000000")
+    TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    Plan.objects.create(period="1 month", price=10)
+    Plan.objects.create(period="1 year", price=100)
+
+    [response] = call(AsyncSubscriptionAPIView, submit("test_user", "a" * 64, "1 year"))
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    [response] = call(AsyncSubscriptionAPIView, submit("test_user", "a" * 64))
+    assert response.status_code == status.HTTP_201_CREATED
+    assert len(tron.get_calls()) == 1
+
+
+@pytest.mark.django_db
+def test_create_subscription_with_unknown_transaction(start_fake_tron):
+    start_fake_tron()
+    TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    Plan.objects.create(period="1 month", price=10)
+
+    [response] = call(AsyncSubscriptionAPIView, submit("test_user", "a" * 64))
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["message"] == "Transaction is not valid"
+    assert not Subscription.objects.exists()
+
+
+@pytest.mark.django_db
+def test_create_subscription_with_used_transaction_hash(start_fake_tron):
+    tron = start_fake_tron()
+    other_user = TelegramUser.objects.create(chat_id=1, telegram_username="other")
+    TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=10)
+    Subscription.objects.create(
+        customer=other_user, plan=plan, transaction_hash="a" * 64
+    )
+
+    [response] = call(AsyncSubscriptionAPIView, submit("test_user", "a" * 64))
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data == ["Transaction hash already used for subscription."]
+    assert tron.get_calls() == []
+
+
+@pytest.mark.django_db
+def test_resubmitted_payment_gets_the_same_answer(start_fake_tron):
+    tron = start_fake_tron()
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=10)
+    subscription = Subscription.objects.create(
+        customer=user, plan=plan, transaction_hash="a" * 64
+    )
+
+    [response] = call(AsyncSubscriptionAPIView, submit("test_user", "a" * 64))
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data == PostSubscriptionSerializer(instance=subscription).data
+    assert tron.get_calls() == []
+
+
+@pytest.mark.django_db
+def test_create_subscription_when_tron_quota_is_spent(start_fake_tron, settings):
+    settings.TRON_API_KEY_LIMIT = 1
+    settings.TRON_API_KEY_WINDOW = 60
+    start_fake_tron()
+    TronProviderPool.acquire_quota(TronProviderPool.get_providers()[0])
+    TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    Plan.objects.create(period="1 month", price=10)
+
+    [response] = call(AsyncSubscriptionAPIView, submit("test_user", "a" * 64))
+
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response["Retry-After"]) >= 1
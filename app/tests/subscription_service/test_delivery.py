@@ -0,0 +1,197 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from asgiref.sync import async_to_sync
+from subscription_service.delivery import (
+    AsyncTelegramDeliveryEngine,
+    OutboundMessage,
+    deliver_messages,
+)
+from subscription_service.models import TelegramFile
+from subscription_service.utils import (
+    TelegramFileIdCache,
+    TelegramHTTPClient,
+    TelegramRateLimiter,
+)
+
+
+@pytest.fixture(autouse=True)
+def relaxed_rate_limits(settings):
+    settings.TELEGRAM_GLOBAL_RATE_LIMIT = 10000
+    settings.TELEGRAM_GLOBAL_BURST = 10000
+
+
+def deliver(settings, handler, messages: list, concurrency: int = None) -> list:
+    # Run the engine against a local aiohttp app standing in for the Bot API
+    async def run():
+        app = web.Application()
+        app.router.add_post("/{method:.*}", handler)
+        async with TestServer(app) as server:
+            settings.TELEGRAM_API_URL = str(server.make_url("")).rstrip("/")
+            engine = AsyncTelegramDeliveryEngine(concurrency=concurrency)
+            return await engine.deliver(messages)
+
+    return async_to_sync(run)()
+
+
+@pytest.mark.django_db
+def test_deliver_keeps_order_per_chat_and_bounds_concurrency(settings):
+    in_flight = 0
+    max_in_flight = 0
+    received = []
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        received.append((request.query["chat_id"], request.query["text"]))
+        return web.json_response({"ok": True})
+
+    messages = []
+    for chat_id in range(20):
+        messages.append(OutboundMessage(chat_id=chat_id, text="first"))
+        messages.append(OutboundMessage(chat_id=chat_id, text="second"))
+
+    results = deliver(settings, handler, messages, concurrency=5)
+
+    assert all(result.ok for result in results)
+    assert [result.message for result in results] == messages
+    assert max_in_flight == 5
+    for chat_id in range(20):
+        texts = [text for chat, text in received if chat == str(chat_id)]
+        assert texts == ["first", "second"]
+    assert TelegramRateLimiter.get_counters()["sent"] == 40
+
+
+@pytest.mark.django_db
+def test_deliver_uploads_each_photo_once(settings, tmp_path):
+    photo_path = tmp_path / "7-days.jpg"
+    photo_path.write_bytes(b"jpeg bytes")
+    uploads = 0
+
+    async def handler(request):
+        nonlocal uploads
+        if "photo" in request.query:
+            assert request.query["photo"] == "cached_id"
+            return web.json_response({"ok": True})
+        form = await request.post()
+        assert form["photo"].file.read() == b"jpeg bytes"
+        uploads += 1
+        await asyncio.sleep(0.01)
+        return web.json_response(
+            {"ok": True, "result": {"photo": [{"file_id": "cached_id"}]}}
+        )
+
+    messages = [
+        OutboundMessage(chat_id=chat_id, text="reminder", photo_path=str(photo_path))
+        for chat_id in range(10)
+    ]
+    results = deliver(settings, handler, messages, concurrency=10)
+
+    assert all(result.ok for result in results)
+    assert uploads == 1
+    assert TelegramFile.objects.get().file_id == "cached_id"
+
+
+@pytest.mark.django_db
+def test_deliver_uploads_once_when_cached_file_id_is_rejected(settings, tmp_path):
+    photo_path = tmp_path / "7-days.jpg"
+    photo_path.write_bytes(b"jpeg bytes")
+    TelegramFileIdCache.set(
+        TelegramFileIdCache.get_content_hash(str(photo_path)), "expired_id"
+    )
+    uploads = 0
+
+    async def handler(request):
+        nonlocal uploads
+        if request.query.get("photo") == "expired_id":
+            await asyncio.sleep(0.01)
+            return web.json_response(
+                {"ok": False, "description": "Bad Request: wrong file identifier"},
+                status=400,
+            )
+        if "photo" in request.query:
+            return web.json_response({"ok": True})
+        uploads += 1
+        return web.json_response(
+            {"ok": True, "result": {"photo": [{"file_id": "new_id"}]}}
+        )
+
+    messages = [
+        OutboundMessage(chat_id=chat_id, text="reminder", photo_path=str(photo_path))
+        for chat_id in range(10)
+    ]
+    results = deliver(settings, handler, messages, concurrency=10)
+
+    assert all(result.ok for result in results)
+    assert uploads == 1
+    assert TelegramFile.objects.get().file_id == "new_id"
+
+
+@pytest.mark.django_db
+def test_deliver_retries_after_429(settings, monkeypatch):
+    monkeypatch.setattr(TelegramRateLimiter, "pause", lambda seconds: None)
+    responses = [
+        web.json_response({"ok": False, "parameters": {"retry_after": 1}}, status=429),
+        web.json_response({"ok": True}),
+    ]
+
+    async def handler(request):
+        return responses.pop(0)
+
+    results = deliver(settings, handler, [OutboundMessage(chat_id=1, text="hello")])
+
+    assert results[0].ok
+    assert TelegramRateLimiter.get_counters()["throttled"] == 1
+
+
+@pytest.mark.django_db
+def test_deliver_reports_failures_per_message(settings):
+    settings.TELEGRAM_READ_TIMEOUT = 0.05
+
+    async def handler(request):
+        if request.query["chat_id"] == "1":
+            return web.Response(
+                status=403, text="Forbidden: bot was blocked by the user"
+            )
+        if request.query["chat_id"] == "2":
+            await asyncio.sleep(0.5)
+        return web.json_response({"ok": True})
+
+    messages = [OutboundMessage(chat_id=chat_id, text="hi") for chat_id in (1, 2, 3)]
+    results = deliver(settings, handler, messages)
+
+    assert [result.status_code for result in results] == [403, None, 200]
+    assert "blocked" in results[0].error
+    assert results[1].error
+
+
+@pytest.mark.django_db
+def test_deliver_fails_fast_when_circuit_is_open(settings):
+    settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD = 2
+    settings.HTTP_RETRY_BACKOFF = 0
+    calls = 0
+
+    async def handler(request):
+        nonlocal calls
+        calls += 1
+        return web.Response(status=502, text="Bad Gateway")
+
+    messages = [OutboundMessage(chat_id=chat_id, text="hi") for chat_id in range(5)]
+    results = deliver(settings, handler, messages, concurrency=1)
+
+    # Sends aren't retried after a 5xx, two failed messages open the circuit
+    assert calls == 2
+    assert [result.status_code for result in results[:2]] == [502, 502]
+    assert all("unavailable" in result.error for result in results[2:])
+    breaker = TelegramHTTPClient.get_circuit_breaker()
+    assert breaker.get_transitions()["open"] == 1
+
+
+@pytest.mark.django_db
+def test_deliver_messages_with_empty_batch():
+    assert deliver_messages([]) == []
@@ -42,3 +42,24 @@ class TestTelegramUserManager:
                 at_private_group=False,
                 password="password123",
             )
+
+    def test_upsert_keeps_names_left_out_of_the_payload(self):
+        TelegramUser.objects.create_user(
+            chat_id=1,
+            telegram_username="old_name",
+            first_name="John",
+            last_name="Doe",
+            at_private_group=False,
+        )
+
+        TelegramUser.objects.upsert(
+            [
+                {"chat_id": 1, "telegram_username": "new_name"},
+                {"chat_id": 2, "telegram_username": "other", "first_name": "Jane"},
+            ]
+        )
+
+        user = TelegramUser.objects.get(chat_id=1)
+        assert user.telegram_username == "new_name"
+        assert (user.first_name, user.last_name) == ("John", "Doe")
+        assert TelegramUser.objects.get(chat_id=2).first_name == "Jane"
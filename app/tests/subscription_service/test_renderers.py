@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
+from subscription_service.renderers import ORJSONRenderer
+
+
+def test_renders_like_drf_json_renderer():
+    data = {
+        "message": gettext_lazy("Subscription not found"),
+        "users": {0: [ErrorDetail("This field is required.", code="required")]},
+        "price": Decimal("10.50"),
+        "created_at": datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        "customer": "пользователь",
+        "plan": None,
+    }
+
+    assert ORJSONRenderer().render(data) == JSONRenderer().render(data)
+
+
+def test_renders_indented_when_asked():
+    rendered = ORJSONRenderer().render(
+        {"status": 200}, accepted_media_type="application/json; indent=4"
+    )
+
+    assert rendered == b'{\n  "status": 200\n}'
+
+
+def test_renders_nothing_for_no_data():
+    assert ORJSONRenderer().render(None) == b""
@@ -0,0 +1,196 @@
+from unittest.mock import patch
+
+import pytest
+from django.utils import timezone
+from subscription_service.models import (
+    OutboxMessage,
+    Plan,
+    Subscription,
+    SubscriptionHistory,
+    TelegramUser,
+)
+from subscription_service.services import (
+    TRANSACTION_HASH_USED,
+    activate_subscription,
+    build_subscription_status,
+    get_admins,
+    get_plan,
+    get_subscription_status_rows,
+    is_transaction_hash_used,
+)
+from subscription_service.serializers import GetSubscriptionSerializer
+
+
+@pytest.fixture
+def send_outbox_messages():
+    with patch("subscription_service.tasks.send_outbox_messages.delay") as mock_delay:
+        yield mock_delay
+
+
+@pytest.mark.django_db
+def test_activate_subscription_creates_subscription(send_outbox_messages):
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="3 months", price=250)
+
+    data, errors = activate_subscription(user, plan, "hash_1")
+
+    assert errors is None
+    assert data == {
+        "customer": user.chat_id,
+        "plan": plan.pk,
+        "transaction_hash": "hash_1",
+    }
+    subscription = Subscription.objects.get()
+    assert subscription.end_date - subscription.start_date == subscription.duration
+    assert subscription.duration.days == 90
+    user.refresh_from_db()
+    assert user.at_private_group is True
+
+
+@pytest.mark.django_db
+def test_activate_subscription_extends_in_place(
+    send_outbox_messages, django_assert_max_num_queries
+):
+    TelegramUser.objects.create(chat_id=1, telegram_username="admin", is_staff=True)
+    user = TelegramUser.objects.create(
+        chat_id=123456, telegram_username="test_user", at_private_group=True
+    )
+    plan = Plan.objects.create(period="1 month", price=100)
+    yearly_plan = Plan.objects.create(period="1 year", price=1000)
+    started = timezone.now() - timezone.timedelta(days=20)
+    Subscription.objects.create(
+        customer=user, plan=plan, transaction_hash="hash_1", start_date=started
+    )
+
+    # History check, row lock, archive, update and the admin notifications,
+    # plus the savepoints around them
+    with django_assert_max_num_queries(10):
+        data, errors = activate_subscription(user, yearly_plan, "hash_2")
+
+    assert errors is None
+    subscription = Subscription.objects.get()
+    assert subscription.transaction_hash == "hash_2"
+    assert subscription.plan == yearly_plan
+    assert subscription.duration.days == 365
+    history = SubscriptionHistory.objects.get()
+    assert history.transaction_hash == "hash_1"
+    assert history.reason == SubscriptionHistory.EXTENDED
+    assert history.start_date == started
+    assert "test_user" in OutboxMessage.objects.get(chat_id=1).text
+    assert is_transaction_hash_used("hash_1")
+    assert is_transaction_hash_used("hash_2")
+
+
+@pytest.mark.django_db
+def test_activate_subscription_rejects_used_hashes(send_outbox_messages):
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    other_user = TelegramUser.objects.create(chat_id=654321, telegram_username="other")
+    plan = Plan.objects.create(period="1 month", price=100)
+    activate_subscription(user, plan, "hash_1")
+    activate_subscription(user, plan, "hash_2")
+
+    # An archived hash can't pay again, nor can a live one of another user
+    assert activate_subscription(user, plan, "hash_1") == (None, TRANSACTION_HASH_USED)
+    assert activate_subscription(other_user, plan, "hash_2") == (
+        None,
+        TRANSACTION_HASH_USED,
+    )
+    assert list(Subscription.objects.values_list("transaction_hash", flat=True)) == [
+        "hash_2"
+    ]
+    assert SubscriptionHistory.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_activate_subscription_twice_with_the_same_payment(send_outbox_messages):
+    # Two submissions of one payment that were checked at the same time
+    TelegramUser.objects.create(chat_id=1, telegram_username="admin", is_staff=True)
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=100)
+
+    first = activate_subscription(user, plan, "hash_1")
+    second = activate_subscription(user, plan, "hash_1")
+
+    assert second == first
+    assert Subscription.objects.count() == 1
+    assert not SubscriptionHistory.objects.exists()
+    assert OutboxMessage.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_activate_subscription_loses_the_insert_race(send_outbox_messages):
+    # The concurrent first purchase with this payment committed after this
+    # one looked for a current subscription, the insert then collides
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=100)
+    first = activate_subscription(user, plan, "hash_1")
+
+    with patch.object(
+        Subscription.objects,
+        "select_for_update",
+        return_value=Subscription.objects.none(),
+    ):
+        second = activate_subscription(user, plan, "hash_1")
+
+    assert second == first
+    assert Subscription.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_plans_are_read_from_memory(django_assert_num_queries):
+    plan = Plan.objects.create(period="1 month", price=100)
+    assert get_plan("1 month") == plan
+    with django_assert_num_queries(0):
+        assert get_plan("1 month").price == 100
+        assert get_plan("2 months") is None
+
+    # Edits and new plans are seen right away
+    plan.price = 90
+    plan.save()
+    Plan.objects.create(period="1 year", price=1000)
+    assert get_plan("1 month").price == 90
+    assert get_plan("1 year").price == 1000
+
+
+@pytest.mark.django_db
+def test_admins_are_read_from_memory(django_assert_num_queries):
+    admin = TelegramUser.objects.create(
+        chat_id=1, telegram_username="admin", is_staff=True
+    )
+    user = TelegramUser.objects.create(chat_id=2, telegram_username="user")
+    assert get_admins() == [admin]
+    with django_assert_num_queries(0):
+        assert get_admins() == [admin]
+    # Saving an ordinary user's other fields keeps the cached admins
+    user.add_to_private_group()
+    with django_assert_num_queries(0):
+        assert get_admins() == [admin]
+
+    user.is_staff = True
+    user.save()
+    assert get_admins() == [admin, user]
+    admin.is_staff = False
+    admin.save()
+    assert get_admins() == [user]
+
+
+@pytest.mark.django_db
+def test_subscription_status_rows_match_the_serializer():
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    TelegramUser.objects.create(chat_id=654321, telegram_username="no_subscription")
+    plan = Plan.objects.create(period="3 months", price=250)
+    subscription = Subscription.objects.create(
+        customer=user, plan=plan, transaction_hash="hash_1"
+    )
+    subscription.refresh_from_db()
+
+    rows = {row["telegram_username"]: row for row in get_subscription_status_rows()}
+
+    assert build_subscription_status(rows["test_user"]) == (
+        200,
+        GetSubscriptionSerializer(instance=subscription).data,
+    )
+    assert build_subscription_status(rows["no_subscription"]) == (
+        404,
+        {"message": "Subscription not found"},
+    )
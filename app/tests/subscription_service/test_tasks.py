@@ -2,19 +2,35 @@ from datetime import datetime, timedelta
 from unittest.mock import patch
 
 import pytest
+import requests
+from celery.exceptions import Retry
 from django.utils import timezone
-from subscription_service.models import Plan, Subscription, TelegramUser
+from subscription_service.delivery import AsyncTelegramDeliveryEngine, DeliveryResult
+from subscription_service.models import (
+    OutboxMessage,
+    PaymentVerification,
+    Plan,
+    SentReminder,
+    Subscription,
+    SubscriptionHistory,
+    TelegramUser,
+)
+from subscription_service.utils import CircuitOpenError, TelegramRateLimiter
 from subscription_service.tasks import (
     delete_expired_subscriptions,
     notify_about_expiring_subscriptions_1_day,
     notify_about_expiring_subscriptions_3_days,
     notify_about_expiring_subscriptions_7_days,
+    ingest_incoming_transfers,
+    send_outbox_messages,
+    claim_payment_verification,
+    verify_payment,
 )
 
 
 @pytest.mark.django_db
-@patch("subscription_service.tasks.TelegramMessageSender")
-def test_delete_expired_subscriptions(mock_telegram_message_sender):
+@patch("subscription_service.utils.TelegramMessageSender.send_message_to_chat")
+def test_delete_expired_subscriptions(mock_send_message_to_chat):
     # Create mock objects
     admin_user = TelegramUser.objects.create(
         chat_id=1, telegram_username="admin", is_staff=True
@@ -28,18 +44,40 @@ def test_delete_expired_subscriptions(mock_telegram_message_sender):
         end_date=datetime.now() - timedelta(days=3),
     )
 
-    # Mock TelegramMessageSender
-    mock_telegram_message_sender.create_message_about_delete_user.return_value = (
-        "Test message"
-    )
-    mock_telegram_message_sender.send_message_to_chat.return_value.status_code = 200
+    # Mock the Telegram API, the admins get one digest
+    mock_send_message_to_chat.return_value.status_code = 200
 
     # Run Celery task
     delete_expired_subscriptions()
 
     # Assertions
     assert not Subscription.objects.filter(customer=admin_user).exists()
+    admin_user.refresh_from_db()
     assert admin_user.at_private_group is False
+    mock_send_message_to_chat.assert_called_once()
+    assert mock_send_message_to_chat.call_args.kwargs["chat_id"] == 1
+    assert "1234567890" in mock_send_message_to_chat.call_args.kwargs["message"]
+
+
+@pytest.mark.django_db
+@patch("subscription_service.utils.TelegramMessageSender.send_message_to_chat")
+def test_delete_expired_subscriptions_archives_them(mock_send_message_to_chat):
+    mock_send_message_to_chat.return_value.status_code = 200
+    user = TelegramUser.objects.create(chat_id=10, telegram_username="user_10")
+    Subscription.objects.create(
+        customer=user,
+        plan=Plan.objects.create(period="1 month", price=100),
+        transaction_hash="expired_10",
+        start_date=timezone.now() - timedelta(days=33),
+    )
+
+    delete_expired_subscriptions()
+
+    assert not Subscription.objects.exists()
+    history = SubscriptionHistory.objects.get()
+    assert history.transaction_hash == "expired_10"
+    assert history.reason == SubscriptionHistory.EXPIRED
+    assert history.customer == user
 
 
 @pytest.mark.django_db
@@ -108,3 +146,395 @@ def test_notify_about_expiring_subscriptions_7_days():
     # Assertions
     subscription.refresh_from_db()
     assert subscription.customer.telegram_username == "expiring_user_7_days"
+
+
+@pytest.mark.django_db
+@patch("subscription_service.utils.TelegramMessageSender.send_message_to_chat")
+def test_delete_expired_subscriptions_sends_one_digest_per_admin(
+    mock_send_message_to_chat,
+):
+    mock_send_message_to_chat.return_value.status_code = 200
+    admins = [
+        TelegramUser.objects.create(
+            chat_id=i, telegram_username=f"admin_{i}", is_staff=True
+        )
+        for i in (1, 2)
+    ]
+    plan = Plan.objects.create(period="1 month", price=100)
+    for i in range(10, 15):
+        Subscription.objects.create(
+            customer=TelegramUser.objects.create(
+                chat_id=i, telegram_username=f"user_{i}"
+            ),
+            plan=plan,
+            transaction_hash=f"expired_{i}",
+            start_date=timezone.now() - timedelta(days=33),
+        )
+
+    delete_expired_subscriptions()
+
+    assert not Subscription.objects.exists()
+    assert mock_send_message_to_chat.call_count == len(admins)
+    digest = mock_send_message_to_chat.call_args.kwargs["message"]
+    assert "Must be deleted from the group (5):" in digest
+    assert all(f"@user_{i}" in digest for i in range(10, 15))
+
+
+@pytest.mark.django_db
+@patch("subscription_service.tasks.TelegramMessageSender")
+def test_delete_expired_subscriptions_per_event_mode(
+    mock_telegram_message_sender, settings, capsys
+):
+    settings.ADMIN_NOTIFICATION_MODE = "per_event"
+    mock_telegram_message_sender.send_message_to_chat.return_value.status_code = 200
+    for i in (1, 2):
+        TelegramUser.objects.create(
+            chat_id=i, telegram_username=f"admin_{i}", is_staff=True
+        )
+    plan = Plan.objects.create(period="1 month", price=100)
+    for i in range(10, 13):
+        Subscription.objects.create(
+            customer=TelegramUser.objects.create(
+                chat_id=i, telegram_username=f"user_{i}"
+            ),
+            plan=plan,
+            transaction_hash=f"expired_{i}",
+            start_date=timezone.now() - timedelta(days=33),
+        )
+
+    delete_expired_subscriptions()
+
+    assert not Subscription.objects.exists()
+    assert mock_telegram_message_sender.send_message_to_chat.call_count == 3 * 2
+    # Archived once each, not once per admin
+    assert "Failed" not in capsys.readouterr().out
+    assert sorted(
+        SubscriptionHistory.objects.values_list("transaction_hash", flat=True)
+    ) == ["expired_10", "expired_11", "expired_12"]
+
+
+def record_outbound_messages(failing_chat_ids=()):
+    # Replace the network call of the delivery engine with a recorder
+    sent = []
+
+    async def send(self, session, message):
+        sent.append(message)
+        status_code = 403 if message.chat_id in failing_chat_ids else 200
+        return DeliveryResult(message=message, status_code=status_code)
+
+    return sent, patch.object(AsyncTelegramDeliveryEngine, "send", send)
+
+
+def create_subscriptions_expiring_in(days: int, chat_ids, plan: Plan) -> None:
+    # A 1 month plan lasts 30 days from start_date
+    for chat_id in chat_ids:
+        Subscription.objects.create(
+            customer=TelegramUser.objects.create(
+                chat_id=chat_id, telegram_username=f"user_{chat_id}"
+            ),
+            plan=plan,
+            transaction_hash=f"hash_{chat_id}",
+            start_date=timezone.now() - timedelta(days=30 - days),
+        )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "mode, admin_messages_per_run",
+    [
+        ("digest", lambda users, admins: admins),
+        ("per_event", lambda users, admins: users * admins),
+    ],
+)
+def test_notify_about_expiring_subscriptions_outbound_calls(
+    settings, mode, admin_messages_per_run
+):
+    settings.ADMIN_NOTIFICATION_MODE = mode
+    users, admins = 5, 3
+    admin_chat_ids = set(range(1, admins + 1))
+    for chat_id in admin_chat_ids:
+        TelegramUser.objects.create(
+            chat_id=chat_id, telegram_username=f"admin_{chat_id}", is_staff=True
+        )
+    plan = Plan.objects.create(period="1 month", price=100)
+    create_subscriptions_expiring_in(3, range(100, 100 + users), plan)
+    create_subscriptions_expiring_in(10, [200], plan)
+
+    sent, patched_send = record_outbound_messages()
+    with patched_send:
+        notify_about_expiring_subscriptions_3_days()
+
+    user_messages = [m for m in sent if m.chat_id not in admin_chat_ids]
+    admin_messages = [m for m in sent if m.chat_id in admin_chat_ids]
+    assert len(user_messages) == 2 * users
+    for chat_id in range(100, 100 + users):
+        photo, details = [m for m in user_messages if m.chat_id == chat_id]
+        assert photo.photo_path.endswith("3-days.jpg")
+        assert details.photo_path is None
+    assert len(admin_messages) == admin_messages_per_run(users, admins)
+
+
+@pytest.mark.django_db
+def test_notify_about_expiring_subscriptions_reports_failures_in_digest():
+    TelegramUser.objects.create(chat_id=1, telegram_username="admin", is_staff=True)
+    plan = Plan.objects.create(period="1 month", price=100)
+    create_subscriptions_expiring_in(1, [100, 101], plan)
+
+    sent, patched_send = record_outbound_messages(failing_chat_ids={101})
+    with patched_send:
+        notify_about_expiring_subscriptions_1_day()
+
+    digest = sent[-1].text
+    assert sent[-1].chat_id == 1
+    assert "Reminder sent (1):\n• @user_100" in digest
+    assert "Failed to send reminder (1):\n• @user_101" in digest
+
+
+@pytest.mark.django_db
+def test_send_outbox_messages_marks_delivery_status(settings):
+    settings.OUTBOX_BATCH_SIZE = 2
+    for chat_id in (1, 2, 3):
+        OutboxMessage.objects.create(chat_id=chat_id, text=f"hello {chat_id}")
+
+    sent, patched_send = record_outbound_messages(failing_chat_ids={2})
+    with patched_send:
+        send_outbox_messages()
+
+    assert sorted(message.chat_id for message in sent) == [1, 2, 3]
+    assert OutboxMessage.objects.get(chat_id=1).status == OutboxMessage.SENT
+    assert OutboxMessage.objects.get(chat_id=1).sent_at is not None
+    assert OutboxMessage.objects.get(chat_id=2).status == OutboxMessage.FAILED
+    assert OutboxMessage.objects.get(chat_id=3).status == OutboxMessage.SENT
+
+    # Nothing is due anymore, a second run sends nothing
+    sent.clear()
+    with patched_send:
+        send_outbox_messages()
+    assert sent == []
+
+
+@pytest.mark.django_db
+def test_send_outbox_messages_retries_with_backoff(settings):
+    settings.OUTBOX_MAX_ATTEMPTS = 2
+    settings.OUTBOX_RETRY_BACKOFF = 30
+    outbox_message = OutboxMessage.objects.create(chat_id=1, text="hello")
+
+    async def send(self, session, message):
+        return DeliveryResult(message=message, error="Read timed out")
+
+    with patch.object(AsyncTelegramDeliveryEngine, "send", send):
+        send_outbox_messages()
+        outbox_message.refresh_from_db()
+        assert outbox_message.status == OutboxMessage.PENDING
+        assert outbox_message.attempts == 1
+        assert outbox_message.last_error == "Read timed out"
+        assert outbox_message.next_attempt_at > timezone.now() + timedelta(seconds=25)
+
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+        send_outbox_messages()
+        outbox_message.refresh_from_db()
+        assert outbox_message.status == OutboxMessage.FAILED
+        assert outbox_message.attempts == 2
+
+
+@pytest.mark.django_db
+def test_send_outbox_messages_leases_the_batch_while_sending(settings):
+    settings.OUTBOX_LEASE_TIMEOUT = 600
+    outbox_message = OutboxMessage.objects.create(chat_id=1, text="hello")
+    due_while_sending = []
+
+    async def send(self, session, message):
+        # Another worker draining the outbox meanwhile finds nothing to take
+        due_while_sending.append(await OutboxMessage.objects.due().aexists())
+        raise SystemExit("worker killed")
+
+    with patch.object(AsyncTelegramDeliveryEngine, "send", send):
+        with pytest.raises(SystemExit):
+            send_outbox_messages()
+
+    assert due_while_sending == [False]
+    outbox_message.refresh_from_db()
+    assert outbox_message.status == OutboxMessage.PENDING
+    assert outbox_message.attempts == 1
+    assert outbox_message.next_attempt_at > timezone.now() + timedelta(seconds=590)
+
+    # Once the lease runs out the message is sent by the next run
+    OutboxMessage.objects.update(next_attempt_at=timezone.now())
+    sent, patched_send = record_outbound_messages()
+    with patched_send:
+        send_outbox_messages()
+    assert [message.chat_id for message in sent] == [1]
+    outbox_message.refresh_from_db()
+    assert outbox_message.status == OutboxMessage.SENT
+    assert outbox_message.attempts == 2
+
+
+@pytest.mark.django_db
+def test_notify_about_expiring_subscriptions_skips_already_sent(settings):
+    settings.REMINDER_CHUNK_SIZE = 2
+    TelegramUser.objects.create(chat_id=1, telegram_username="admin", is_staff=True)
+    plan = Plan.objects.create(period="1 month", price=100)
+    create_subscriptions_expiring_in(7, [100, 101, 102], plan)
+
+    sent, patched_send = record_outbound_messages(failing_chat_ids={102})
+    with patched_send:
+        notify_about_expiring_subscriptions_7_days()
+    assert set(
+        SentReminder.objects.filter(offset_days=7).values_list(
+            "transaction_hash", flat=True
+        )
+    ) == {"hash_100", "hash_101"}
+
+    # A rerun only retries the reminder that wasn't delivered
+    sent, patched_send = record_outbound_messages()
+    with patched_send:
+        notify_about_expiring_subscriptions_7_days()
+    assert {message.chat_id for message in sent} == {1, 102}
+    assert SentReminder.objects.count() == 3
+
+
+@pytest.mark.django_db
+@patch("subscription_service.utils.TelegramMessageSender.send_message_to_chat")
+def test_delete_expired_subscriptions_cleans_reminder_ledger(
+    mock_send_message_to_chat,
+):
+    mock_send_message_to_chat.return_value.status_code = 200
+    plan = Plan.objects.create(period="1 month", price=100)
+    create_subscriptions_expiring_in(-1, [100], plan)
+    create_subscriptions_expiring_in(3, [101], plan)
+    for chat_id in (100, 101):
+        SentReminder.objects.create(transaction_hash=f"hash_{chat_id}", offset_days=1)
+
+    delete_expired_subscriptions()
+
+    assert list(SentReminder.objects.values_list("transaction_hash", flat=True)) == [
+        "hash_101"
+    ]
+
+
+@pytest.mark.django_db
+def test_notify_about_expiring_subscriptions_against_fake_telegram(
+    start_fake_telegram, settings
+):
+    settings.TELEGRAM_CHAT_BURST = 10
+    # Enough retries that no message runs out of them on repeated 429s
+    settings.TELEGRAM_MAX_RETRIES_ON_429 = 10
+    fake_telegram = start_fake_telegram(throttle_rate=0.2, retry_after=0, seed=1)
+    TelegramUser.objects.create(chat_id=1, telegram_username="admin", is_staff=True)
+    plan = Plan.objects.create(period="1 month", price=100)
+    create_subscriptions_expiring_in(3, range(100, 120), plan)
+
+    notify_about_expiring_subscriptions_3_days()
+
+    calls = [call for call in fake_telegram.get_calls() if call["status"] == 200]
+    for chat_id in range(100, 120):
+        photo, details = [call for call in calls if call["chat_id"] == str(chat_id)]
+        assert photo["method"] == "sendPhoto"
+        assert details["method"] == "sendMessage"
+    assert [call["photo"] for call in calls].count("upload") == 1
+    assert [call["chat_id"] for call in calls].count("1") == 1
+    assert SentReminder.objects.count() == 20
+    assert TelegramRateLimiter.get_counters()["throttled"] > 0
+
+
+@pytest.mark.django_db
+def test_notify_about_expiring_subscriptions_when_telegram_fails(
+    start_fake_telegram, settings
+):
+    settings.HTTP_RETRY_BACKOFF = 0
+    fake_telegram = start_fake_telegram(error_rate=1.0)
+    plan = Plan.objects.create(period="1 month", price=100)
+    create_subscriptions_expiring_in(1, range(100, 110), plan)
+
+    notify_about_expiring_subscriptions_1_day()
+
+    # Without the breaker every message would be tried three times (60 calls),
+    # it stops the run shortly after the first failures instead
+    assert len(fake_telegram.get_calls()) < 10
+    assert not SentReminder.objects.exists()
+
+
+def create_payment_verification() -> PaymentVerification:
+    return PaymentVerification.objects.create(
+        customer=TelegramUser.objects.create(chat_id=100, telegram_username="user"),
+        plan=Plan.objects.create(period="1 month", price=100),
+        transaction_hash="hash_100",
+    )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "valid, expected_status",
+    [(True, PaymentVerification.VERIFIED), (False, PaymentVerification.REJECTED)],
+)
+@patch("subscription_service.utils.TronTransactionAnalyzer.validate_tx_hash")
+def test_verify_payment(mock_validate_tx_hash, valid, expected_status):
+    mock_validate_tx_hash.return_value = valid
+    verification = create_payment_verification()
+
+    verify_payment(str(verification.pk))
+
+    verification.refresh_from_db()
+    assert verification.status == expected_status
+    assert Subscription.objects.filter(transaction_hash="hash_100").exists() is valid
+
+
+@pytest.mark.django_db
+@patch("subscription_service.utils.TronTransactionAnalyzer.validate_tx_hash")
+def test_verify_payment_retries_while_tron_is_unavailable(
+    mock_validate_tx_hash, settings
+):
+    mock_validate_tx_hash.side_effect = CircuitOpenError("trongrid", 12.5)
+    verification = create_payment_verification()
+
+    with patch.object(verify_payment, "retry", side_effect=Retry) as mock_retry:
+        with pytest.raises(Retry):
+            verify_payment(str(verification.pk))
+    assert mock_retry.call_args.kwargs["countdown"] == 13
+    verification.refresh_from_db()
+    assert verification.status == PaymentVerification.PENDING
+
+    # Once out of retries the verification fails for good
+    settings.PAYMENT_VERIFICATION_MAX_RETRIES = 0
+    verify_payment(str(verification.pk))
+    verification.refresh_from_db()
+    assert verification.status == PaymentVerification.FAILED
+    assert not Subscription.objects.exists()
+
+
+@pytest.mark.django_db
+@patch("subscription_service.utils.time.sleep")
+@patch("requests.Session.get")
+def test_verify_payment_retries_when_tron_does_not_answer(mock_get, mock_sleep):
+    mock_get.side_effect = requests.ConnectionError("Connection refused")
+    verification = create_payment_verification()
+
+    with patch.object(verify_payment, "retry", side_effect=Retry):
+        with pytest.raises(Retry):
+            verify_payment(str(verification.pk))
+
+    verification.refresh_from_db()
+    assert verification.status == PaymentVerification.PENDING
+    # The lease is given back for the retry
+    assert verification.leased_until is None
+
+
+@pytest.mark.django_db
+@patch("subscription_service.utils.TronTransactionAnalyzer.validate_tx_hash")
+def test_verify_payment_skips_a_leased_verification(mock_validate_tx_hash):
+    verification = create_payment_verification()
+    assert claim_payment_verification(str(verification.pk)) is not None
+
+    verify_payment(str(verification.pk))
+
+    mock_validate_tx_hash.assert_not_called()
+    verification.refresh_from_db()
+    assert verification.status == PaymentVerification.PENDING
+
+
+@pytest.mark.django_db
+@patch("subscription_service.tasks.TronTransferIngester.ingest")
+def test_ingest_incoming_transfers_survives_errors(mock_ingest):
+    mock_ingest.side_effect = CircuitOpenError("trongrid", 10)
+    ingest_incoming_transfers()
+    mock_ingest.assert_called_once_with()
@@ -1,7 +1,14 @@
 import pytest
 from django.urls import resolve, reverse
 
-from subscription_service.views import SubscriptionAPIView, TelegramUserAPIView
+from subscription_service.views import (
+    PaymentVerificationAPIView,
+    SubscriptionAPIView,
+    SubscriptionListAPIView,
+    SubscriptionStatusAPIView,
+    TelegramUserAPIView,
+    TelegramUserBulkAPIView,
+)
 
 
 @pytest.mark.django_db
@@ -10,7 +17,33 @@ def test_create_user_url():
     assert resolve(resolver).func.view_class == TelegramUserAPIView
 
 
+@pytest.mark.django_db
+def test_register_users_url():
+    resolver = reverse("register-telegram-users")
+    assert resolve(resolver).func.view_class == TelegramUserBulkAPIView
+
+
 @pytest.mark.django_db
 def test_manage_subscription_url():
     resolver = reverse("manage-subscription")
     assert resolve(resolver).func.view_class == SubscriptionAPIView
+
+
+@pytest.mark.django_db
+def test_payment_verification_url():
+    resolver = reverse(
+        "payment-verification", args=["00000000-0000-0000-0000-000000000000"]
+    )
+    assert resolve(resolver).func.view_class == PaymentVerificationAPIView
+
+
+@pytest.mark.django_db
+def test_subscription_statuses_url():
+    resolver = reverse("subscription-statuses")
+    assert resolve(resolver).func.view_class == SubscriptionStatusAPIView
+
+
+@pytest.mark.django_db
+def test_list_subscriptions_url():
+    resolver = reverse("list-subscriptions")
+    assert resolve(resolver).func.view_class == SubscriptionListAPIView
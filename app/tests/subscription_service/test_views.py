@@ -1,12 +1,29 @@
+import threading
 from unittest.mock import patch
 
 import pytest
+from django.db import connection
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.timezone import localtime
 from rest_framework import status
-from rest_framework.test import APIClient
-from subscription_service.models import Plan, Subscription, TelegramUser
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from subscription_service.models import (
+    OutboxMessage,
+    PaymentVerification,
+    Plan,
+    Subscription,
+    SubscriptionHistory,
+    TelegramUser,
+)
+from subscription_service.pagination import KeysetPagination, SubscriptionPagination
+from subscription_service.utils import (
+    CircuitOpenError,
+    QuotaExceededError,
+    TronTransactionAnalyzer,
+)
 
 
 @pytest.mark.django_db
@@ -42,6 +59,93 @@ def test_invalid_telegram_user():
     assert response.data == expected_errors
 
 
+@pytest.mark.django_db
+def test_register_telegram_user_is_idempotent():
+    url = reverse("create-telegram-user")
+    data = {
+        "chat_id": 2141241241245,
+        "telegram_username": "@TestUser",
+        "first_name": "Conor",
+        "last_name": "McGregor",
+    }
+    client = APIClient()
+    response = client.put(url, data, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+
+    response = client.put(
+        url,
+        {**data, "telegram_username": "@Renamed", "first_name": "C."},
+        format="json",
+    )
+    assert response.status_code == status.HTTP_200_OK
+    user = TelegramUser.objects.get()
+    assert (user.telegram_username, user.first_name) == ("@Renamed", "C.")
+
+    # Another chat can't take a username that is still in use
+    response = client.put(
+        url, {"chat_id": 1, "telegram_username": "@Renamed"}, format="json"
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert TelegramUser.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_register_telegram_users_in_bulk(django_assert_max_num_queries):
+    TelegramUser.objects.create(chat_id=1, telegram_username="old_name")
+    TelegramUser.objects.create(chat_id=2, telegram_username="taken")
+    users = [
+        {"chat_id": 1, "telegram_username": "new_name", "first_name": "One"},
+        {"chat_id": 3, "telegram_username": "taken"},
+    ] + [
+        {"chat_id": chat_id, "telegram_username": f"user_{chat_id}"}
+        for chat_id in range(100, 1100)
+    ]
+
+    client = APIClient()
+    url = reverse("register-telegram-users")
+    # One lookup and the upsert, which SQLite splits by its parameter limit
+    with django_assert_max_num_queries(20):
+        response = client.post(url, {"users": users}, format="json")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {
+        "created": 1000,
+        "updated": 1,
+        "conflicts": [{"chat_id": 3, "telegram_username": "taken"}],
+    }
+    assert TelegramUser.objects.count() == 1002
+    user = TelegramUser.objects.get(chat_id=1)
+    assert (user.telegram_username, user.first_name) == ("new_name", "One")
+
+    # Registering the same users again changes nothing
+    response = client.post(url, {"users": users[2:]}, format="json")
+    assert response.data == {"created": 0, "updated": 1000, "conflicts": []}
+    assert TelegramUser.objects.count() == 1002
+
+
+@pytest.mark.django_db
+def test_register_telegram_users_in_bulk_validates_request(settings):
+    settings.USER_REGISTRATION_BATCH_LIMIT = 2
+    client = APIClient()
+    url = reverse("register-telegram-users")
+
+    for users in (
+        [],
+        [{"chat_id": 1}],
+        [
+            {"chat_id": 1, "telegram_username": "same"},
+            {"chat_id": 2, "telegram_username": "same"},
+        ],
+        [
+            {"chat_id": chat_id, "telegram_username": f"user_{chat_id}"}
+            for chat_id in range(3)
+        ],
+    ):
+        response = client.post(url, {"users": users}, format="json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert not TelegramUser.objects.exists()
+
+
 @pytest.mark.django_db
 def test_valid_subscription_create():
     # Create necessary test data
@@ -79,6 +183,42 @@ def test_valid_subscription_create():
         assert Subscription.objects.filter(customer=user, plan=plan).exists()
 
 
+@pytest.mark.django_db
+@patch("subscription_service.utils.TronTransactionAnalyzer.validate_tx_hash")
+@patch("subscription_service.utils.TelegramMessageSender.send_message_to_chat")
+def test_create_subscription_enqueues_admin_notifications(
+    mock_send_message_to_chat, mock_validate_tx_hash, django_capture_on_commit_callbacks
+):
+    mock_validate_tx_hash.return_value = True
+    for chat_id in (1, 2):
+        TelegramUser.objects.create(
+            chat_id=chat_id, telegram_username=f"admin_{chat_id}", is_staff=True
+        )
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=10)
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+    data = {
+        "telegram_username": user.telegram_username,
+        "plan": plan.period,
+        "transaction_hash": "a2497862faf68c54e6b745f9b84fcb4e6a736b3cd108696590b7ba8e3910b170",
+    }
+    with patch("subscription_service.tasks.send_outbox_messages.delay") as mock_delay:
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_201_CREATED
+    mock_send_message_to_chat.assert_not_called()
+    mock_delay.assert_called_once_with()
+    outbox_messages = OutboxMessage.objects.order_by("chat_id")
+    assert [message.chat_id for message in outbox_messages] == [1, 2]
+    assert all(message.status == OutboxMessage.PENDING for message in outbox_messages)
+    assert "test_user" in outbox_messages[0].text
+    user.refresh_from_db()
+    assert user.at_private_group is True
+
+
 @pytest.mark.django_db
 def test_invalid_create_subscription():
     # Create necessary test data
@@ -122,6 +262,256 @@ def test_invalid_create_subscription():
         assert response.data["message"] == "Transaction is not valid"
 
 
+@pytest.mark.django_db
+@patch("subscription_service.utils.TronTransactionAnalyzer.validate_tx_hash")
+def test_create_subscription_when_tron_is_unavailable(mock_validate_tx_hash):
+    mock_validate_tx_hash.side_effect = CircuitOpenError("trongrid", 12.5)
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=10)
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+    data = {
+        "telegram_username": user.telegram_username,
+        "plan": plan.period,
+        "transaction_hash": "a2497862faf68c54e6b745f9b84fcb4e6a736b3cd108696590b7ba8e3910b170",
+    }
+    response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response["Retry-After"] == "13"
+    assert not Subscription.objects.exists()
+
+
+@pytest.mark.django_db
+@patch("subscription_service.utils.TronTransactionAnalyzer.validate_tx_hash")
+def test_create_subscription_with_archived_transaction_hash(mock_validate_tx_hash):
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=10)
+    transaction_hash = (
+        "a2497862faf68c54e6b745f9b84fcb4e6a736b3cd108696590b7ba8e3910b170"
+    )
+    SubscriptionHistory.objects.create(
+        transaction_hash=transaction_hash,
+        customer=user,
+        plan=plan,
+        start_date=timezone.now(),
+        duration=timezone.timedelta(days=30),
+        reason=SubscriptionHistory.EXPIRED,
+    )
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+    data = {
+        "telegram_username": user.telegram_username,
+        "plan": plan.period,
+        "transaction_hash": transaction_hash,
+    }
+    response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data == ["Transaction hash already used for subscription."]
+    mock_validate_tx_hash.assert_not_called()
+
+
+@pytest.mark.django_db
+@patch("subscription_service.utils.TronTransactionAnalyzer.validate_tx_hash")
+def test_malformed_transaction_hash_is_not_checked_on_tron(mock_validate_tx_hash):
+    TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    Plan.objects.create(period="1 month", price=10)
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+    data = {
+        "telegram_username": "test_user",
+        "plan": "1 month",
+        "transaction_hash": "0x123456789abcdef",
+    }
+    response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["message"] == "Transaction is not valid"
+    mock_validate_tx_hash.assert_not_called()
+
+
+@pytest.mark.django_db
+@patch("subscription_service.utils.TronTransactionAnalyzer.validate_tx_hash")
+def test_payment_submissions_are_throttled_per_user(mock_validate_tx_hash, settings):
+    settings.PAYMENT_SUBMISSION_LIMIT = 2
+    settings.PAYMENT_SUBMISSION_WINDOW = 60
+    mock_validate_tx_hash.return_value = False
+    TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    TelegramUser.objects.create(chat_id=654321, telegram_username="other_user")
+    Plan.objects.create(period="1 month", price=10)
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+
+    def submit(telegram_username: str, i: int):
+        data = {
+            "telegram_username": telegram_username,
+            "plan": "1 month",
+            "transaction_hash": f"{i:064x}",
+        }
+        return client.post(url, data, format="json")
+
+    assert [submit("test_user", i).status_code for i in range(2)] == [400, 400]
+    response = submit("test_user", 2)
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert 0 < int(response["Retry-After"]) <= 60
+    assert mock_validate_tx_hash.call_count == 2
+    assert submit("other_user", 3).status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+@patch("subscription_service.utils.TronTransactionAnalyzer.validate_tx_hash")
+def test_create_subscription_when_tron_quota_is_spent(mock_validate_tx_hash):
+    mock_validate_tx_hash.side_effect = QuotaExceededError("trongrid", 0.4)
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=10)
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+    data = {
+        "telegram_username": user.telegram_username,
+        "plan": plan.period,
+        "transaction_hash": "a2497862faf68c54e6b745f9b84fcb4e6a736b3cd108696590b7ba8e3910b170",
+    }
+    response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert response["Retry-After"] == "1"
+    assert not Subscription.objects.exists()
+
+
+@pytest.mark.django_db
+@patch.object(TronTransactionAnalyzer, "STAS_TRC20_WALLET_ADDRESS", "TOurWallet")
+def test_retry_with_another_plan_is_checked_again(start_fake_tron):
+    # The transfer pays 50 USDT, enough for a month but not for a year
+    tron = start_fake_tron(wallet_address="TOurWallet", amount_str="50000000")
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    Plan.objects.create(period="1 month", price=10)
+    Plan.objects.create(period="1 year", price=100)
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+    data = {"telegram_username": user.telegram_username, "transaction_hash": "a" * 64}
+    response = client.post(url, {**data, "plan": "1 year"}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["message"] == "Transaction is not valid"
+
+    response = client.post(url, {**data, "plan": "1 month"}, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert Subscription.objects.get().plan.period == "1 month"
+    # Only the TronGrid lookup is reused
+    assert len(tron.get_calls()) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+@patch.object(TronTransactionAnalyzer, "STAS_TRC20_WALLET_ADDRESS", "TOurWallet")
+def test_concurrent_submissions_share_the_tron_lookup(start_fake_tron):
+    # A double-tapped "paid" button: the submissions overlap while TronGrid
+    # is asked, each gets the answer of the one that activated the payment
+    tron = start_fake_tron(wallet_address="TOurWallet", latency=0.3)
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    Plan.objects.create(period="1 month", price=10)
+    data = {
+        "telegram_username": user.telegram_username,
+        "plan": "1 month",
+        "transaction_hash": "a" * 64,
+    }
+    url = reverse("manage-subscription")
+    responses = []
+
+    # The test database can't take concurrent writers, the submissions take
+    # turns at it but overlap while they wait for TronGrid
+    database_turn = threading.Lock()
+    validate_tx_hash = TronTransactionAnalyzer.validate_tx_hash
+
+    in_lookup = []
+    overlap = []
+
+    def validate_outside_database_turn(**kwargs):
+        database_turn.release()
+        in_lookup.append(kwargs)
+        overlap.append(len(in_lookup))
+        try:
+            return validate_tx_hash(**kwargs)
+        finally:
+            in_lookup.pop()
+            database_turn.acquire()
+
+    def submit():
+        try:
+            with database_turn:
+                responses.append(APIClient().post(url, data, format="json"))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=submit) for _ in range(3)]
+    with patch.object(
+        TronTransactionAnalyzer, "validate_tx_hash", validate_outside_database_turn
+    ):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert [response.status_code for response in responses] == [
+        status.HTTP_201_CREATED
+    ] * 3
+    assert responses[0].data == responses[1].data == responses[2].data
+    assert max(overlap) == 3
+    assert len(tron.get_calls()) == 1
+    assert Subscription.objects.count() == 1
+
+
+@pytest.mark.django_db
+@patch("subscription_service.utils.TronTransactionAnalyzer.validate_tx_hash")
+def test_create_subscription_in_async_mode(
+    mock_validate_tx_hash, settings, django_capture_on_commit_callbacks
+):
+    settings.PAYMENT_VERIFICATION_MODE = "async"
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=10)
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+    data = {
+        "telegram_username": user.telegram_username,
+        "plan": plan.period,
+        "transaction_hash": "a2497862faf68c54e6b745f9b84fcb4e6a736b3cd108696590b7ba8e3910b170",
+    }
+    with patch("subscription_service.tasks.verify_payment.delay") as mock_delay:
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post(url, data, format="json")
+        # A resubmitted payment gets the same job
+        repeated_response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.data["status"] == PaymentVerification.PENDING
+    job_id = response.data["job_id"]
+    mock_delay.assert_called_once_with(str(job_id))
+    mock_validate_tx_hash.assert_not_called()
+    assert not Subscription.objects.exists()
+    assert repeated_response.data["job_id"] == job_id
+    assert PaymentVerification.objects.count() == 1
+
+    response = client.get(response["Location"])
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["status"] == PaymentVerification.PENDING
+    assert response.data["transaction_hash"] == data["transaction_hash"]
+
+
+@pytest.mark.django_db
+def test_get_unknown_payment_verification():
+    client = APIClient()
+    url = reverse("payment-verification", args=["00000000-0000-0000-0000-000000000000"])
+    response = client.get(url)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.data["message"] == "Verification not found"
+
+
 @pytest.mark.django_db
 def test_valid_get_subscription():
     # Create a TelegramUser
@@ -213,3 +603,303 @@ def test_invalid_get_subscription():
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert "message" in response.data
     assert response.data["message"] == "User not found"
+
+
+@pytest.mark.django_db
+def test_get_subscription_is_one_query_then_cached(
+    django_assert_max_num_queries, django_assert_num_queries
+):
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=100)
+    Subscription.objects.create(
+        customer=user, plan=plan, transaction_hash="0x123456789abcdef"
+    )
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+    data = {"telegram_username": user.telegram_username}
+    with django_assert_max_num_queries(1):
+        response = client.get(url, data)
+    with django_assert_num_queries(0):
+        cached_response = client.get(url, data)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert cached_response.status_code == status.HTTP_200_OK
+    assert cached_response.data == response.data
+    assert response.data["plan"] == "1 month"
+    assert response.data["price"] == 100
+
+
+@pytest.mark.django_db
+def test_get_subscription_cache_follows_subscription_changes():
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=100)
+    yearly_plan = Plan.objects.create(period="1 year", price=1000)
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+    assert client.get(url, {"telegram_username": "new_user"}).status_code == 404
+    TelegramUser.objects.create(chat_id=654321, telegram_username="new_user")
+    response = client.get(url, {"telegram_username": "new_user"})
+    assert response.data == {"message": "Subscription not found"}
+
+    data = {"telegram_username": user.telegram_username}
+    assert client.get(url, data).status_code == status.HTTP_404_NOT_FOUND
+
+    subscription = Subscription.objects.create(
+        customer=user, plan=plan, transaction_hash="0x123456789abcdef"
+    )
+    assert client.get(url, data).data["plan"] == "1 month"
+
+    subscription.plan = yearly_plan
+    subscription.save()
+    assert client.get(url, data).data["plan"] == "1 year"
+
+    yearly_plan.price = 900
+    yearly_plan.save()
+    assert client.get(url, data).data["price"] == 900
+
+    subscription.delete()
+    assert client.get(url, data).status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_get_subscription_answers_not_modified_while_unchanged(
+    django_assert_num_queries,
+):
+    user = TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+    plan = Plan.objects.create(period="1 month", price=100)
+    subscription = Subscription.objects.create(
+        customer=user, plan=plan, transaction_hash="0x123456789abcdef"
+    )
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+    data = {"telegram_username": user.telegram_username}
+    etag = client.get(url, data)["ETag"]
+    with django_assert_num_queries(0):
+        response = client.get(url, data, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+    assert response["ETag"] == etag
+
+    # A later start moves the end date
+    subscription.start_date += timezone.timedelta(days=30)
+    subscription.save()
+    response = client.get(url, data, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response["ETag"] != etag
+
+
+@pytest.mark.django_db
+def test_get_missing_subscription_has_no_etag():
+    TelegramUser.objects.create(chat_id=123456, telegram_username="test_user")
+
+    client = APIClient()
+    url = reverse("manage-subscription")
+    response = client.get(url, {"telegram_username": "test_user"})
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert not response.has_header("ETag")
+
+
+@pytest.mark.django_db
+def test_get_subscription_statuses_in_bulk(
+    django_assert_max_num_queries, django_assert_num_queries
+):
+    plan = Plan.objects.create(period="1 month", price=100)
+    for chat_id in (1, 2, 3):
+        user = TelegramUser.objects.create(
+            chat_id=chat_id, telegram_username=f"user_{chat_id}"
+        )
+        if chat_id != 2:
+            Subscription.objects.create(
+                customer=user, plan=plan, transaction_hash=f"hash_{chat_id}"
+            )
+
+    client = APIClient()
+    url = reverse("subscription-statuses")
+    data = {"telegram_usernames": ["user_3", "user_2", "unknown", "user_1"]}
+    with django_assert_max_num_queries(1):
+        response = client.post(url, data, format="json")
+    with django_assert_num_queries(0):
+        cached_response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert cached_response.data == response.data
+    results = response.data["results"]
+    assert [result["telegram_username"] for result in results] == data[
+        "telegram_usernames"
+    ]
+    assert [result["status"] for result in results] == [200, 404, 404, 200]
+    assert results[0]["data"]["transaction_hash"] == "hash_3"
+    assert results[1]["data"] == {"message": "Subscription not found"}
+    assert results[2]["data"] == {"message": "User not found"}
+    # Every result is what the single status check answers
+    single_response = client.get(
+        reverse("manage-subscription"), {"telegram_username": "user_1"}
+    )
+    assert results[3]["data"] == single_response.data
+
+    response = client.post(url, {"chat_ids": [2, 3, 4]}, format="json")
+    assert [
+        (result["chat_id"], result["status"]) for result in response.data["results"]
+    ] == [(2, 404), (3, 200), (4, 404)]
+
+
+@pytest.mark.django_db
+def test_get_subscription_statuses_validates_request(settings):
+    settings.SUBSCRIPTION_STATUS_BATCH_LIMIT = 2
+    client = APIClient()
+    url = reverse("subscription-statuses")
+
+    for data in (
+        {},
+        {"telegram_usernames": []},
+        {"telegram_usernames": ["user_1"], "chat_ids": [1]},
+        {"chat_ids": [1, 2, 3]},
+        {"chat_ids": ["user_1"]},
+    ):
+        response = client.post(url, data, format="json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def create_subscriptions(count: int, plan: Plan) -> list:
+    # Pairs of subscriptions share an end date, so pages split ties
+    start_date = timezone.now()
+    subscriptions = []
+    for i in range(count):
+        user = TelegramUser.objects.create(chat_id=i, telegram_username=f"user_{i}")
+        subscription = Subscription(
+            customer=user, plan=plan, transaction_hash=f"hash_{count - i:03d}"
+        )
+        subscription.start_date = start_date + timezone.timedelta(days=i // 2)
+        subscription.save()
+        subscriptions.append(subscription)
+    return sorted(subscriptions, key=lambda s: (s.end_date, s.transaction_hash))
+
+
+@pytest.fixture
+def admin_client():
+    admin = TelegramUser.objects.create(
+        chat_id=10**9, telegram_username="admin", is_staff=True
+    )
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=admin)}")
+    return client
+
+
+@pytest.mark.django_db
+def test_list_subscriptions_requires_an_admin_token():
+    user = TelegramUser.objects.create(chat_id=1, telegram_username="test_user")
+    url = reverse("list-subscriptions")
+
+    assert APIClient().get(url).status_code == status.HTTP_401_UNAUTHORIZED
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user)}")
+    assert client.get(url).status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_list_subscriptions_walks_pages_by_cursor(
+    admin_client, django_assert_max_num_queries
+):
+    plan = Plan.objects.create(period="1 month", price=100)
+    subscriptions = create_subscriptions(7, plan)
+
+    seen = []
+    url = reverse("list-subscriptions") + "?page_size=3"
+    while url:
+        # The token lookup (until cachalot has it) and the page, however deep
+        with django_assert_max_num_queries(2):
+            response = admin_client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data["results"]) <= 3
+        seen += response.data["results"]
+        url = response.data["next"]
+
+    assert [row["transaction_hash"] for row in seen] == [
+        subscription.transaction_hash for subscription in subscriptions
+    ]
+    assert seen[0] == {
+        "customer": subscriptions[0].customer.telegram_username,
+        "plan": "1 month",
+        "price": 100,
+        "transaction_hash": subscriptions[0].transaction_hash,
+        "start_date": localtime(subscriptions[0].start_date).strftime(
+            "%d/%m/%Y %H:%M:%S"
+        ),
+        "end_date": localtime(subscriptions[0].end_date).strftime("%d/%m/%Y %H:%M:%S"),
+    }
+
+
+@pytest.mark.django_db
+def test_list_subscriptions_caps_the_page_size(admin_client):
+    plan = Plan.objects.create(period="1 month", price=100)
+    create_subscriptions(3, plan)
+    url = reverse("list-subscriptions")
+
+    with patch.object(SubscriptionPagination, "max_page_size", 2):
+        response = admin_client.get(url, {"page_size": 100})
+    assert len(response.data["results"]) == 2
+    assert response.data["next"]
+
+
+@pytest.mark.django_db
+def test_keyset_pagination_has_a_default_page_size():
+    # REST_FRAMEWORK sets no PAGE_SIZE, a subclass needn't set one either
+    class TransactionPagination(KeysetPagination):
+        ordering = ("transaction_hash",)
+
+    plan = Plan.objects.create(period="1 month", price=100)
+    create_subscriptions(3, plan)
+    paginator = TransactionPagination()
+
+    rows = paginator.paginate_queryset(
+        Subscription.objects.values("transaction_hash").order_by("transaction_hash"),
+        Request(APIRequestFactory().get("/")),
+    )
+    assert len(rows) == 3
+    assert paginator.get_next_link() is None
+
+
+@pytest.mark.django_db
+def test_list_subscriptions_filters(admin_client):
+    plan = Plan.objects.create(period="1 month", price=100)
+    yearly_plan = Plan.objects.create(period="1 year", price=1000)
+    subscriptions = create_subscriptions(6, plan)
+    subscriptions[-1].plan = yearly_plan
+    subscriptions[-1].save()
+    url = reverse("list-subscriptions")
+
+    response = admin_client.get(
+        url,
+        {
+            "expiring_after": subscriptions[0].end_date.isoformat(),
+            "expiring_before": subscriptions[-1].end_date.isoformat(),
+        },
+    )
+    assert [row["transaction_hash"] for row in response.data["results"]] == [
+        subscription.transaction_hash
+        for subscription in subscriptions
+        if subscriptions[0].end_date
+        < subscription.end_date
+        < subscriptions[-1].end_date
+    ]
+
+    response = admin_client.get(url, {"plan": "1 year"})
+    assert [row["transaction_hash"] for row in response.data["results"]] == [
+        subscriptions[-1].transaction_hash
+    ]
+
+
+@pytest.mark.django_db
+def test_list_subscriptions_validates_request(admin_client):
+    url = reverse("list-subscriptions")
+
+    response = admin_client.get(url, {"plan": "2 weeks"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert "plan" in response.data
+    response = admin_client.get(url, {"cursor": "not-a-cursor"})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
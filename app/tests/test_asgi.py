@@ -0,0 +1,25 @@
+from asgiref.sync import async_to_sync
+from core.asgi import application
+from subscription_service.async_utils import AsyncTronClient
+
+
+def test_lifespan_shutdown_closes_the_tron_session():
+    sent = []
+
+    async def run():
+        session = AsyncTronClient.get_session()
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        await application({"type": "lifespan"}, receive, send)
+        return session
+
+    session = async_to_sync(run)()
+
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert session.closed
@@ -1,9 +1,35 @@
+import threading
+import time
 import unittest
 from datetime import datetime, timedelta
 from unittest.mock import patch
 
 import pytest
-from subscription_service.views import TelegramMessageSender, TronTransactionAnalyzer
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from subscription_service.models import IncomingTransfer, TelegramFile
+from subscription_service.utils import (
+    AdminDigest,
+    CircuitBreaker,
+    CircuitOpenError,
+    QuotaExceededError,
+    ReferenceCache,
+    RetryPolicy,
+    Singleflight,
+    SlidingWindowThrottle,
+    TelegramFileIdCache,
+    TelegramHTTPClient,
+    TelegramMessageSender,
+    TelegramRateLimiter,
+    TronHTTPClient,
+    TronProviderPool,
+    TronTransactionAnalyzer,
+    TronTransferIngester,
+    UpstreamUnavailableError,
+)
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 
 
 @pytest.mark.django_db
@@ -16,7 +42,16 @@ class TestTronTransactionAnalyzer:
         result = TronTransactionAnalyzer.convert_string_to_trc20(amount_str, decimals)
         assert result == 100
 
-    @patch("requests.get")
+    def test_is_well_formed_tx_hash(self):
+        tx_hash = "a2497862faf68c54e6b745f9b84fcb4e6a736b3cd108696590b7ba8e3910b170"
+        assert TronTransactionAnalyzer.is_well_formed_tx_hash(tx_hash)
+        assert TronTransactionAnalyzer.is_well_formed_tx_hash(tx_hash.upper())
+        assert not TronTransactionAnalyzer.is_well_formed_tx_hash(tx_hash[:-1])
+        assert not TronTransactionAnalyzer.is_well_formed_tx_hash(f"0x{tx_hash}")
+        assert not TronTransactionAnalyzer.is_well_formed_tx_hash(f"{tx_hash}\n")
+        assert not TronTransactionAnalyzer.is_well_formed_tx_hash(None)
+
+    @patch("requests.Session.get")
     def test_validate_tx_hash_valid(self, mock_get):
         # Test case where amount_usdt >= plan_price
         tx_hash = "test_tx_hash"
@@ -45,7 +80,7 @@ class TestTronTransactionAnalyzer:
             result = TronTransactionAnalyzer.validate_tx_hash(tx_hash, plan_price)
             assert result
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_validate_tx_hash_invalid(self, mock_get):
         # Test case where amount_usdt < plan_price
         tx_hash = "test_tx_hash"
@@ -67,7 +102,7 @@ class TestTronTransactionAnalyzer:
         result = TronTransactionAnalyzer.validate_tx_hash(tx_hash, plan_price)
         assert not result
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_validate_tx_hash_error_handling(self, mock_get):
         # Test error handling in validate_tx_hash method
         tx_hash = "test_tx_hash"
@@ -121,7 +156,7 @@ class TestTronTransactionAnalyzer:
         )
         assert result_min == 0
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_validate_tx_hash_malformed_data(self, mock_get):
         # Test error handling in validate_tx_hash method when API returns malformed data
         tx_hash = "test_tx_hash"
@@ -135,10 +170,621 @@ class TestTronTransactionAnalyzer:
         assert not result
 
 
+@pytest.mark.django_db
+class TestTronTransactionCache:
+
+    def mock_transaction(self, confirmed: bool = True) -> unittest.mock.Mock:
+        response = unittest.mock.Mock(status_code=200)
+        response.json.return_value = {
+            "confirmed": confirmed,
+            "timestamp": 1623334000000,
+            "trc20TransferInfo": [
+                {
+                    "to_address": TronTransactionAnalyzer.STAS_TRC20_WALLET_ADDRESS,
+                    "amount_str": "100000000",
+                    "decimals": 6,
+                    "token_name": "Tether USD",
+                }
+            ],
+        }
+        return response
+
+    def get_ttl(self, tx_hash: str) -> int:
+        return cache.ttl(
+            TronTransactionAnalyzer.TRANSACTION_CACHE_KEY.format(tx_hash=tx_hash)
+        )
+
+    @patch("requests.Session.get")
+    def test_confirmed_transaction_is_fetched_once(self, mock_get):
+        mock_get.return_value = self.mock_transaction()
+        with patch.object(
+            TronTransactionAnalyzer,
+            "convert_timestamp_to_date_format",
+            return_value=datetime.today().date(),
+        ):
+            for _ in range(3):
+                assert TronTransactionAnalyzer.validate_tx_hash("tx_hash", 100)
+            assert not TronTransactionAnalyzer.validate_tx_hash("tx_hash", 200)
+
+        assert mock_get.call_count == 1
+        assert self.get_ttl("tx_hash") > settings.TRON_NEGATIVE_CACHE_TTL
+        assert TronTransactionAnalyzer.get_transaction_facts("tx_hash")[
+            "transfers"
+        ] == [
+            {
+                "to_address": TronTransactionAnalyzer.STAS_TRC20_WALLET_ADDRESS,
+                "amount_str": "100000000",
+                "decimals": 6,
+            }
+        ]
+
+    @patch("requests.Session.get")
+    def test_unconfirmed_transaction_is_cached_briefly(self, mock_get):
+        mock_get.return_value = self.mock_transaction(confirmed=False)
+        assert TronTransactionAnalyzer.get_transaction_facts("tx_hash") is not None
+        assert self.get_ttl("tx_hash") <= settings.TRON_NEGATIVE_CACHE_TTL
+
+    @patch("requests.Session.get")
+    def test_missing_transaction_is_cached_briefly(self, mock_get):
+        mock_get.return_value = unittest.mock.Mock(status_code=404)
+        for _ in range(2):
+            assert not TronTransactionAnalyzer.validate_tx_hash("tx_hash", 100)
+
+        assert mock_get.call_count == 1
+        assert 0 < self.get_ttl("tx_hash") <= settings.TRON_NEGATIVE_CACHE_TTL
+
+    @patch("subscription_service.utils.time.sleep")
+    @patch("requests.Session.get")
+    def test_connection_errors_are_not_cached(self, mock_get, mock_sleep):
+        mock_get.side_effect = requests.ConnectionError("Connection refused")
+        # "Can't check now", not "not valid"
+        with pytest.raises(UpstreamUnavailableError):
+            TronTransactionAnalyzer.validate_tx_hash("tx_hash", 100)
+        assert (
+            cache.get(
+                TronTransactionAnalyzer.TRANSACTION_CACHE_KEY.format(tx_hash="tx_hash")
+            )
+            is None
+        )
+
+    @patch("subscription_service.utils.time.sleep")
+    @patch("requests.Session.get")
+    def test_server_errors_are_not_cached(self, mock_get, mock_sleep):
+        mock_get.return_value = unittest.mock.Mock(status_code=503)
+        with pytest.raises(UpstreamUnavailableError):
+            TronTransactionAnalyzer.validate_tx_hash("tx_hash", 100)
+        assert cache.get(TronTransactionAnalyzer.get_cache_key("tx_hash")) is None
+
+
+def build_trongrid_transfer(tx_hash: str, timestamp: int, to_address=None) -> dict:
+    return {
+        "transaction_id": tx_hash,
+        "token_info": {
+            "symbol": "USDT",
+            "address": "TR7NHqjeKQxGTCi8q8ZY4pq3BjTKB7GcWw",
+            "decimals": 6,
+        },
+        "block_timestamp": timestamp,
+        "from": "TSenderAddress",
+        "to": to_address or TronTransactionAnalyzer.STAS_TRC20_WALLET_ADDRESS,
+        "type": "Transfer",
+        "value": "100000000",
+    }
+
+
+@pytest.mark.django_db
+class TestTronTransferIngester:
+
+    @pytest.fixture(autouse=True)
+    def wallet_address(self):
+        with patch.object(
+            TronTransactionAnalyzer, "STAS_TRC20_WALLET_ADDRESS", "TOurWallet"
+        ):
+            yield
+
+    @patch("requests.Session.get")
+    def test_ingest_pages_from_high_water_mark(self, mock_get):
+        IncomingTransfer.objects.create(
+            transaction_hash="old",
+            from_address="TSenderAddress",
+            to_address=TronTransactionAnalyzer.STAS_TRC20_WALLET_ADDRESS,
+            token_address="TR7NHqjeKQxGTCi8q8ZY4pq3BjTKB7GcWw",
+            amount_str="1000000",
+            decimals=6,
+            timestamp=1000,
+        )
+        first_page = unittest.mock.Mock(status_code=200)
+        first_page.json.return_value = {
+            "data": [
+                build_trongrid_transfer("old", 1000),
+                build_trongrid_transfer("tx_1", 2000),
+            ],
+            "meta": {"fingerprint": "next"},
+        }
+        second_page = unittest.mock.Mock(status_code=200)
+        second_page.json.return_value = {
+            "data": [
+                build_trongrid_transfer("tx_2", 3000),
+                build_trongrid_transfer("outgoing", 3000, to_address="TOther"),
+            ],
+            "meta": {},
+        }
+        mock_get.side_effect = [first_page, second_page]
+
+        assert TronTransferIngester.ingest() == 2
+
+        first_params = mock_get.call_args_list[0].kwargs["params"]
+        assert first_params["min_timestamp"] == 1000
+        assert "fingerprint" not in first_params
+        assert mock_get.call_args_list[1].kwargs["params"]["fingerprint"] == "next"
+        assert set(
+            IncomingTransfer.objects.values_list("transaction_hash", flat=True)
+        ) == {"old", "tx_1", "tx_2"}
+        assert TronTransferIngester.get_high_water_mark() == 3000
+
+    @patch("requests.Session.get")
+    def test_fetch_page_goes_through_the_provider_pool(self, mock_get, settings):
+        settings.TRON_PROVIDERS = [
+            {"endpoint": "https://tron.example/wallet/gettransactioninfobyid?value"}
+        ]
+        mock_get.return_value = unittest.mock.Mock(status_code=200)
+        mock_get.return_value.json.return_value = {"data": [], "meta": {}}
+
+        assert TronTransferIngester.fetch_page(0) == {"data": [], "meta": {}}
+
+        url = mock_get.call_args.kwargs["url"]
+        assert url == "https://tron.example/v1/accounts/TOurWallet/transactions/trc20"
+        # No key configured, no key header
+        assert "TRON-PRO-API-KEY" not in mock_get.call_args.kwargs["headers"]
+        (stats,) = TronProviderPool.get_stats().values()
+        assert stats["requests"] == 1
+
+    @patch("requests.Session.get")
+    def test_validate_tx_hash_answers_from_index(self, mock_get):
+        IncomingTransfer.objects.create(
+            transaction_hash="indexed",
+            from_address="TSenderAddress",
+            to_address=TronTransactionAnalyzer.STAS_TRC20_WALLET_ADDRESS,
+            token_address="TR7NHqjeKQxGTCi8q8ZY4pq3BjTKB7GcWw",
+            amount_str="100000000",
+            decimals=6,
+            timestamp=1623334000000,
+        )
+        with patch.object(
+            TronTransactionAnalyzer,
+            "convert_timestamp_to_date_format",
+            return_value=datetime.today().date(),
+        ):
+            assert TronTransactionAnalyzer.validate_tx_hash("indexed", 100)
+            assert not TronTransactionAnalyzer.validate_tx_hash("indexed", 101)
+        mock_get.assert_not_called()
+
+
+class TestRetryPolicy:
+
+    def test_delay_is_jittered_and_bounded(self):
+        policy = RetryPolicy(attempts=5, backoff=0.5, max_backoff=2)
+        delays = [policy.get_delay(attempt) for attempt in range(10) for _ in range(20)]
+        assert all(0 <= delay <= 2 for delay in delays)
+        assert len(set(delays)) > 1
+
+    def test_read_timeouts_are_retried_only_when_idempotent(self):
+        refused = requests.ConnectionError(
+            MaxRetryError(None, "/", NewConnectionError(None, "refused"))
+        )
+        assert RetryPolicy.is_retryable_exception(refused, False)
+        assert RetryPolicy.is_retryable_exception(requests.ConnectTimeout(), False)
+        assert RetryPolicy.is_retryable_exception(requests.ReadTimeout(), True)
+        assert not RetryPolicy.is_retryable_exception(requests.ReadTimeout(), False)
+        # Dropped after the request was sent
+        assert not RetryPolicy.is_retryable_exception(requests.ConnectionError(), False)
+
+    def test_server_errors_are_retried_only_when_idempotent(self):
+        policy = RetryPolicy()
+        assert policy.is_retryable_status(503, True)
+        assert not policy.is_retryable_status(503, False)
+        assert not policy.is_retryable_status(404, True)
+
+
+class TestCircuitBreaker:
+
+    @pytest.fixture(autouse=True)
+    def breaker_settings(self, settings):
+        settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD = 3
+        settings.CIRCUIT_BREAKER_RESET_TIMEOUT = 30
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker("test")
+        for _ in range(2):
+            breaker.record_failure()
+        assert breaker.allow_request()
+
+        breaker.record_failure()
+        assert breaker.get_state() == CircuitBreaker.OPEN
+        assert not breaker.allow_request()
+        assert 0 < breaker.get_retry_after() <= 30
+        assert breaker.get_transitions()["open"] == 1
+
+    def test_stays_closed_while_most_calls_succeed(self):
+        breaker = CircuitBreaker("test")
+        for _ in range(10):
+            breaker.record_success()
+        for _ in range(5):
+            breaker.record_failure()
+        assert breaker.get_state() == CircuitBreaker.CLOSED
+
+        for _ in range(5):
+            breaker.record_failure()
+        assert breaker.get_state() == CircuitBreaker.OPEN
+
+    def test_half_open_allows_single_probe(self):
+        breaker = CircuitBreaker("test")
+        for _ in range(3):
+            breaker.record_failure()
+        # Let the open period run out
+        breaker.get_redis().delete(breaker.key(CircuitBreaker.OPEN_KEY))
+
+        assert breaker.get_state() == CircuitBreaker.HALF_OPEN
+        assert breaker.allow_request()
+        assert not breaker.allow_request()
+
+        breaker.record_success()
+        assert breaker.get_state() == CircuitBreaker.CLOSED
+        assert breaker.get_transitions() == {"open": 1, "half_open": 1, "closed": 1}
+
+    def test_failed_probe_opens_again(self):
+        breaker = CircuitBreaker("test")
+        for _ in range(3):
+            breaker.record_failure()
+        breaker.get_redis().delete(breaker.key(CircuitBreaker.OPEN_KEY))
+
+        assert breaker.allow_request()
+        breaker.record_failure()
+        assert breaker.get_state() == CircuitBreaker.OPEN
+        assert breaker.get_transitions()["open"] == 2
+
+    def test_success_while_open_keeps_it_open(self):
+        breaker = CircuitBreaker("test")
+        for _ in range(3):
+            breaker.record_failure()
+
+        # A call that started before the breaker opened
+        CircuitBreaker("test").record_success()
+        assert breaker.get_state() == CircuitBreaker.OPEN
+
+        breaker.get_redis().delete(breaker.key(CircuitBreaker.OPEN_KEY))
+        prober = CircuitBreaker("test")
+        assert prober.allow_request()
+        # Only the probe closes the breaker
+        CircuitBreaker("test").record_success()
+        assert breaker.get_state() == CircuitBreaker.HALF_OPEN
+
+        prober.record_success()
+        assert breaker.get_state() == CircuitBreaker.CLOSED
+
+
+class TestTronHTTPClient:
+
+    @patch("subscription_service.utils.time.sleep")
+    @patch("requests.Session.get")
+    def test_retries_server_errors(self, mock_get, mock_sleep):
+        mock_get.side_effect = [
+            unittest.mock.Mock(status_code=503),
+            unittest.mock.Mock(status_code=200),
+        ]
+        response = TronHTTPClient.get("https://api.trongrid.io")
+        assert response.status_code == 200
+        assert mock_get.call_count == 2
+        assert mock_get.call_args.kwargs["timeout"] == (
+            settings.TRON_CONNECT_TIMEOUT,
+            settings.TRON_READ_TIMEOUT,
+        )
+
+    @pytest.mark.django_db
+    @patch("subscription_service.utils.time.sleep")
+    @patch("requests.Session.get")
+    def test_fails_fast_when_circuit_is_open(self, mock_get, mock_sleep, settings):
+        settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD = 2
+        mock_get.side_effect = requests.ConnectionError("Connection refused")
+
+        with pytest.raises(CircuitOpenError):
+            TronHTTPClient.get("https://api.trongrid.io")
+        assert mock_get.call_count == 2
+
+        with pytest.raises(CircuitOpenError):
+            TronHTTPClient.get("https://api.trongrid.io")
+        assert mock_get.call_count == 2
+
+
+@pytest.mark.django_db
+class TestTronProviderPool:
+
+    @pytest.fixture(autouse=True)
+    def no_exploration(self, settings):
+        settings.TRON_PROVIDER_EXPLORATION = 0
+
+    def get_stats(self, server) -> dict:
+        for name, stats in TronProviderPool.get_stats().items():
+            if name.startswith(f"127.0.0.1:{server.server_port}:"):
+                return stats
+
+    def test_routes_lookups_to_the_fastest_provider(self, start_fake_tron):
+        slow = start_fake_tron(latency=0.2)
+        fast = start_fake_tron()
+
+        for i in range(6):
+            response = TronProviderPool.get_transaction(f"tx_{i}")
+            assert response.status_code == 200
+
+        assert len(slow.get_calls()) == 1
+        assert len(fast.get_calls()) == 5
+        assert self.get_stats(slow)["latency"] > self.get_stats(fast)["latency"]
+        assert self.get_stats(fast)["requests"] == 5
+
+    def test_fails_over_when_provider_is_throttling(self, start_fake_tron):
+        throttled = start_fake_tron(api_key="key-1", throttle_rate=1, retry_after=30)
+        healthy = start_fake_tron(api_key="key-2", wallet_address="TOurWallet")
+
+        with patch.object(
+            TronTransactionAnalyzer, "STAS_TRC20_WALLET_ADDRESS", "TOurWallet"
+        ):
+            assert TronTransactionAnalyzer.validate_tx_hash("tx_1", 100)
+            assert TronTransactionAnalyzer.validate_tx_hash("tx_2", 100)
+
+        # The throttled provider rests instead of being asked again
+        assert [call["status"] for call in throttled.get_calls()] == [429]
+        assert [call["api_key"] for call in healthy.get_calls()] == ["key-2"] * 2
+        stats = self.get_stats(throttled)
+        assert stats["throttled"] == 1
+        assert stats["errors"] == 1
+        assert 0 < stats["cooldown"] <= 30
+
+    def test_fails_over_when_provider_times_out(self, start_fake_tron, settings):
+        settings.TRON_READ_TIMEOUT = 0.2
+        hanging = start_fake_tron(latency=2)
+        start_fake_tron()
+
+        response = TronProviderPool.get_transaction("tx_1")
+        assert response.status_code == 200
+        assert self.get_stats(hanging)["errors"] == 1
+        assert self.get_stats(hanging)["error_rate"] == 1
+
+    def test_skips_providers_whose_key_quota_is_spent(self, start_fake_tron, settings):
+        settings.TRON_API_KEY_LIMIT = 1
+        settings.TRON_API_KEY_WINDOW = 60
+        first = start_fake_tron(api_key="key-1")
+        second = start_fake_tron(api_key="key-2")
+
+        for tx_hash in ("tx_1", "tx_2"):
+            assert TronProviderPool.get_transaction(tx_hash).status_code == 200
+        with pytest.raises(QuotaExceededError) as exc_info:
+            TronProviderPool.get_transaction("tx_3")
+
+        assert 0 < exc_info.value.retry_after <= 60
+        assert [call["hash"] for call in first.get_calls()] == ["tx_1"]
+        assert [call["hash"] for call in second.get_calls()] == ["tx_2"]
+
+    @patch("subscription_service.utils.time.sleep")
+    @patch("requests.Session.get")
+    def test_fails_fast_when_every_circuit_is_open(
+        self, mock_get, mock_sleep, settings
+    ):
+        settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD = 2
+        mock_get.side_effect = requests.ConnectionError("Connection refused")
+
+        with pytest.raises(UpstreamUnavailableError):
+            TronTransactionAnalyzer.validate_tx_hash("test_tx_hash", 100)
+        assert mock_get.call_count == 2
+
+        with pytest.raises(CircuitOpenError) as exc_info:
+            TronTransactionAnalyzer.validate_tx_hash("test_tx_hash", 100)
+        assert not isinstance(exc_info.value, UpstreamUnavailableError)
+        assert mock_get.call_count == 2
+
+
+class TestSlidingWindowThrottle:
+
+    def test_limits_hits_within_the_window(self):
+        throttle = SlidingWindowThrottle("test", limit=2, window=60)
+        assert throttle.hit("user") == 0
+        assert throttle.hit("user") == 0
+        assert 59 < throttle.hit("user") <= 60
+        # Other keys have their own budget
+        assert throttle.hit("other_user") == 0
+
+    def test_hits_leave_the_window(self):
+        throttle = SlidingWindowThrottle("test", limit=1, window=0.1)
+        assert throttle.hit("user") == 0
+        assert throttle.hit("user") > 0
+        time.sleep(0.15)
+        assert throttle.hit("user") == 0
+
+
+class TestReferenceCache:
+
+    def test_values_are_loaded_once(self):
+        loader = unittest.mock.Mock(return_value={"1 month": 100})
+        assert ReferenceCache.get("plans", loader) == {"1 month": 100}
+        assert ReferenceCache.get("plans", loader) == {"1 month": 100}
+
+        # Another process finds the value in Redis
+        ReferenceCache.clear_local()
+        assert ReferenceCache.get("plans", loader) == {"1 month": 100}
+        assert loader.call_count == 1
+
+    def test_local_copy_expires(self, settings):
+        settings.REFERENCE_CACHE_LOCAL_TTL = 0
+        ReferenceCache.get("plans", lambda: "old")
+        cache.set(ReferenceCache.CACHE_KEY.format(name="plans"), "new")
+        assert ReferenceCache.get("plans", lambda: "loaded") == "new"
+
+    def test_invalidation_reaches_other_processes(self):
+        ReferenceCache.get("plans", lambda: "old")
+        # What another process announces after changing a plan
+        cache.delete(ReferenceCache.CACHE_KEY.format(name="plans"))
+        get_redis_connection("default").publish(ReferenceCache.CHANNEL, "plans")
+
+        deadline = time.monotonic() + 2
+        while "plans" in ReferenceCache._local and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert ReferenceCache.get("plans", lambda: "new") == "new"
+
+
+class TestSingleflight:
+
+    def test_concurrent_callers_share_one_run(self):
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"status": 201}
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(Singleflight("test").do("tx", work))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert results == [{"status": 201}] * 5
+
+    def test_failed_run_is_not_shared(self):
+        with pytest.raises(CircuitOpenError):
+            Singleflight("test").do(
+                "tx", unittest.mock.Mock(side_effect=CircuitOpenError("trongrid", 5))
+            )
+        assert Singleflight("test").do("tx", lambda: "done") == "done"
+
+
+class TestTelegramHTTPClient:
+
+    def teardown_method(self):
+        TelegramHTTPClient.close()
+
+    def test_session_is_reused_between_calls(self):
+        session = TelegramHTTPClient.get_session()
+        assert TelegramHTTPClient.get_session() is session
+
+    def test_session_is_recreated_after_fork(self):
+        session = TelegramHTTPClient.get_session()
+        TelegramHTTPClient._session_pid = -1
+        assert TelegramHTTPClient.get_session() is not session
+
+    def test_session_mounts_pooled_adapter(self):
+        adapter = TelegramHTTPClient.get_session().get_adapter(
+            "https://api.telegram.org"
+        )
+        assert adapter._pool_maxsize == settings.TELEGRAM_POOL_MAXSIZE
+
+    @patch("requests.Session.post")
+    def test_post_applies_default_timeout(self, mock_post):
+        mock_post.return_value.status_code = 200
+        TelegramHTTPClient.post("https://api.telegram.org/botX/sendMessage")
+        assert mock_post.call_args.kwargs["timeout"] == (
+            settings.TELEGRAM_CONNECT_TIMEOUT,
+            settings.TELEGRAM_READ_TIMEOUT,
+        )
+
+
+class TestTelegramRateLimiter:
+
+    def test_global_bucket_limits_all_chats(self, settings):
+        settings.TELEGRAM_GLOBAL_RATE_LIMIT = 1
+        settings.TELEGRAM_GLOBAL_BURST = 2
+        assert TelegramRateLimiter.try_acquire(1) == 0
+        assert TelegramRateLimiter.try_acquire(2) == 0
+        assert TelegramRateLimiter.try_acquire(3) > 0
+
+    def test_chat_bucket_limits_single_chat(self, settings):
+        settings.TELEGRAM_CHAT_RATE_LIMIT = 1
+        settings.TELEGRAM_CHAT_BURST = 1
+        assert TelegramRateLimiter.try_acquire(1) == 0
+        assert 0 < TelegramRateLimiter.try_acquire(1) <= 1
+        assert TelegramRateLimiter.try_acquire(2) == 0
+
+    def test_pause_blocks_every_chat(self):
+        TelegramRateLimiter.pause(5)
+        assert 4 < TelegramRateLimiter.try_acquire(1) <= 5
+
+    @patch("subscription_service.utils.time.sleep")
+    def test_acquire_waits_and_counts_queued(self, mock_sleep):
+        with patch.object(
+            TelegramRateLimiter, "try_acquire", side_effect=[0.5, 0.25, 0]
+        ):
+            TelegramRateLimiter.acquire(1)
+        assert [call.args[0] for call in mock_sleep.call_args_list] == [0.5, 0.25]
+        assert TelegramRateLimiter.get_counters()["queued"] == 1
+
+    @patch("subscription_service.utils.TelegramRateLimiter.pause")
+    @patch("requests.Session.post")
+    def test_sender_honours_retry_after(self, mock_post, mock_pause):
+        throttled = unittest.mock.Mock(status_code=429)
+        throttled.json.return_value = {
+            "ok": False,
+            "error_code": 429,
+            "parameters": {"retry_after": 7},
+        }
+        sent = unittest.mock.Mock(status_code=200)
+        mock_post.side_effect = [throttled, sent]
+
+        response = TelegramMessageSender.send_message_to_chat("Test Message", 123)
+
+        assert response.status_code == 200
+        mock_pause.assert_called_once_with(7.0)
+        counters = TelegramRateLimiter.get_counters()
+        assert counters["throttled"] == 1
+        assert counters["sent"] == 1
+
+
+class TestAdminDigest:
+
+    def test_render_pages_fits_in_one_message(self):
+        digest = AdminDigest(title="Action: 🔴 delete expired subscriptions")
+        digest.add("Must be deleted from the group", "@first")
+        digest.add("Must be deleted from the group", "@second")
+        digest.add("Must be deleted from the group", "@first")
+        digest.add("Failed to delete", "@third: timeout")
+
+        assert digest.render_pages(admin_of_group="admin") == [
+            "Hi, admin!\n\n"
+            "Action: 🔴 delete expired subscriptions\n"
+            "\nMust be deleted from the group (2):\n"
+            "• @first\n"
+            "• @second\n"
+            "\nFailed to delete (1):\n"
+            "• @third: timeout\n"
+        ]
+
+    def test_render_pages_splits_at_telegram_limit(self):
+        digest = AdminDigest(title="Action: 🔔 remind")
+        for i in range(500):
+            digest.add("Reminder sent", f"@subscriber_with_a_long_username_{i}")
+
+        pages = digest.render_pages(admin_of_group="admin")
+
+        assert len(pages) > 1
+        assert all(len(page) <= AdminDigest.MAX_MESSAGE_LENGTH for page in pages)
+        assert pages[-1].endswith(f"(page {len(pages)}/{len(pages)})")
+        text = "".join(pages)
+        assert all(f"_{i}\n" in text for i in range(500))
+
+    @patch("subscription_service.utils.TelegramMessageSender.send_message_to_chat")
+    def test_send_skips_empty_digest(self, mock_send_message_to_chat):
+        AdminDigest(title="nothing happened").send([unittest.mock.Mock()])
+        mock_send_message_to_chat.assert_not_called()
+
+
 @pytest.mark.django_db
 class TestTelegramMessageSender:
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_send_message_to_chat_success(self, mock_post):
         # Mock the response from the API
         mock_post.return_value.status_code = 200
@@ -149,7 +795,7 @@ class TestTelegramMessageSender:
         # Assert that the response is successful
         assert response.status_code == 200
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_send_message_to_chat_failure(self, mock_post):
         # Mock the response from the API
         mock_post.return_value.status_code = 500
@@ -159,8 +805,10 @@ class TestTelegramMessageSender:
 
         # Assert that the response is unsuccessful
         assert response.status_code == 500
+        # Telegram may have sent it anyway, so it isn't sent again
+        assert mock_post.call_count == 1
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_send_message_with_photo_to_chat_success(self, mock_post):
         # Mock the response from the API
         mock_post.return_value.status_code = 200
@@ -173,6 +821,94 @@ class TestTelegramMessageSender:
         # Assert that the response is successful
         assert response.status_code == 200
 
+    @patch("requests.Session.post")
+    def test_send_message_with_photo_uploads_once_then_uses_file_id(
+        self, mock_post, tmp_path
+    ):
+        photo_path = tmp_path / "1-day.jpg"
+        photo_path.write_bytes(b"jpeg bytes")
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {
+            "ok": True,
+            "result": {"photo": [{"file_id": "small"}, {"file_id": "original"}]},
+        }
+
+        TelegramMessageSender.send_message_with_photo_to_chat(
+            "Test Message", str(photo_path), 123
+        )
+        TelegramMessageSender.send_message_with_photo_to_chat(
+            "Test Message", str(photo_path), 456
+        )
+
+        first_call, second_call = mock_post.call_args_list
+        assert "photo" in first_call.kwargs["files"]
+        assert "files" not in second_call.kwargs
+        assert second_call.kwargs["params"]["photo"] == "original"
+        assert TelegramFile.objects.get().file_id == "original"
+
+    @patch("requests.Session.post")
+    def test_send_message_with_photo_uploads_replaced_image(self, mock_post, tmp_path):
+        photo_path = tmp_path / "1-day.jpg"
+        photo_path.write_bytes(b"old image")
+        TelegramFileIdCache.set(
+            TelegramFileIdCache.get_content_hash(str(photo_path)), "old_file_id"
+        )
+        photo_path.write_bytes(b"new image, different size")
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {
+            "result": {"photo": [{"file_id": "new_file_id"}]}
+        }
+
+        TelegramMessageSender.send_message_with_photo_to_chat(
+            "Test Message", str(photo_path), 123
+        )
+
+        assert "photo" in mock_post.call_args.kwargs["files"]
+        assert TelegramFile.objects.count() == 2
+
+    @patch("requests.Session.post")
+    def test_send_message_with_photo_reuploads_rejected_file_id(
+        self, mock_post, tmp_path
+    ):
+        photo_path = tmp_path / "1-day.jpg"
+        photo_path.write_bytes(b"jpeg bytes")
+        content_hash = TelegramFileIdCache.get_content_hash(str(photo_path))
+        TelegramFileIdCache.set(content_hash, "stale_file_id")
+
+        rejected = unittest.mock.Mock(status_code=400)
+        rejected.text = "Bad Request: wrong file identifier/HTTP URL specified"
+        uploaded = unittest.mock.Mock(status_code=200)
+        uploaded.json.return_value = {"result": {"photo": [{"file_id": "fresh"}]}}
+        mock_post.side_effect = [rejected, uploaded]
+
+        response = TelegramMessageSender.send_message_with_photo_to_chat(
+            "Test Message", str(photo_path), 123
+        )
+
+        assert response.status_code == 200
+        assert TelegramFileIdCache.get(content_hash) == "fresh"
+
+    def test_send_message_with_photo_against_fake_telegram(
+        self, fake_telegram, settings
+    ):
+        photo_path = settings.MEDIA_ROOT + "/1-day.jpg"
+        for _ in range(2):
+            response = TelegramMessageSender.send_message_with_photo_to_chat(
+                "Test Message", photo_path, 123
+            )
+            assert response.status_code == 200
+
+        calls = fake_telegram.get_calls()
+        assert calls[0]["photo"] == "upload"
+        assert calls[1]["photo"] == TelegramFileIdCache.get(
+            TelegramFileIdCache.get_content_hash(photo_path)
+        )
+        assert all(call["text"] == "Test Message" for call in calls)
+
+    def test_file_id_cache_falls_back_to_database(self):
+        TelegramFile.objects.create(content_hash="abc", file_id="from_db")
+        assert TelegramFileIdCache.get("abc") == "from_db"
+
     def test_create_message_about_add_user(self):
         # Test create_message_about_add_user method
         expected_message = (